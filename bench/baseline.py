@@ -0,0 +1,108 @@
+import json
+import os
+import platform
+import sys
+import time
+
+from shared.utils import rpath
+
+BASELINE_DIR = rpath("bench", "baselines")
+
+BASELINE_FORMAT_VERSION = 1
+
+DEFAULT_THRESHOLD = 0.10  # a stage this much slower than its baseline is a regression
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def make_baseline(
+    results: dict[str, dict[str, float]], config: dict[str, int]
+) -> dict[str, object]:
+    return {
+        "version": BASELINE_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "config": config,
+        "results": results,
+    }
+
+
+def save_baseline(baseline: dict[str, object], path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2)
+        f.write("\n")
+
+
+def load_baseline(path: str) -> dict[str, object]:
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported baseline format in {path}")
+    return baseline
+
+
+class StageComparison:
+    """
+    The timing of a stage against its baseline.
+    Attributes:
+    stage: The name of the stage.
+    baseline: The baseline median in seconds, None if the stage is new.
+    current: The current median in seconds, None if the stage is gone.
+    """
+
+    stage: str
+    baseline: float | None
+    current: float | None
+
+    def __init__(
+        self, stage: str, baseline: float | None, current: float | None
+    ) -> None:
+        self.stage = stage
+        self.baseline = baseline
+        self.current = current
+
+    @property
+    def ratio(self) -> float | None:
+        """current / baseline, above 1 means slower."""
+        if self.baseline is None or self.current is None or self.baseline == 0:
+            return None
+        return self.current / self.baseline
+
+    def is_regression(self, threshold: float = DEFAULT_THRESHOLD) -> bool:
+        ratio = self.ratio
+        return ratio is not None and ratio > 1.0 + threshold
+
+    def __str__(self) -> str:
+        def fmt(value: float | None) -> str:
+            return "-" if value is None else f"{value * 1000:.3f} ms"
+
+        ratio = self.ratio
+        change = "" if ratio is None else f"{(ratio - 1.0) * 100:+.1f}%"
+        return f"{self.stage:<20}{fmt(self.baseline):>14}{fmt(self.current):>14}{change:>10}"
+
+
+def compare(
+    baseline: dict[str, object], results: dict[str, dict[str, float]]
+) -> list[StageComparison]:
+    """Compare the median of every stage to the baseline."""
+    baseline_results: dict[str, dict[str, float]] = baseline["results"]  # type: ignore
+    comparisons: list[StageComparison] = []
+    for stage in list(baseline_results) + [
+        s for s in results if s not in baseline_results
+    ]:
+        comparisons.append(
+            StageComparison(
+                stage,
+                (
+                    baseline_results[stage]["median"]
+                    if stage in baseline_results
+                    else None
+                ),
+                results[stage]["median"] if stage in results else None,
+            )
+        )
+    return comparisons
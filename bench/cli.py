@@ -0,0 +1,83 @@
+import argparse
+import json
+import sys
+
+from bench.baseline import (
+    DEFAULT_THRESHOLD,
+    baseline_path,
+    compare,
+    load_baseline,
+    make_baseline,
+    save_baseline,
+)
+from bench.generator import generate_chart
+from bench.stages import STAGES, run_stages
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--beats", type=int, default=2000, help="beats in the chart")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage")
+    parser.add_argument(
+        "--stage", action="append", choices=list(STAGES), help="only run this stage"
+    )
+    parser.add_argument(
+        "--save", metavar="NAME", help="store the results as baseline NAME"
+    )
+    parser.add_argument("--compare", metavar="NAME", help="compare to baseline NAME")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="slowdown of the median counted as a regression",
+    )
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+
+
+def resolve_baseline(name: str) -> str:
+    return name if name.endswith(".json") else baseline_path(name)
+
+
+def run(args: argparse.Namespace) -> int:
+    """Run the benchmark, returns 1 if a stage regressed against the compared baseline."""
+    config = {"beats": args.beats, "seed": args.seed, "repeat": args.repeat}
+    chart_text = generate_chart(args.beats, args.seed)
+    results = run_stages(chart_text, args.stage, args.repeat)
+
+    if args.json:
+        print(json.dumps({"config": config, "results": results}, indent=2))
+    else:
+        for stage, timing in results.items():
+            print(
+                f"{stage:<20}median {timing['median'] * 1000:10.3f} ms"
+                f"  min {timing['min'] * 1000:10.3f} ms"
+            )
+
+    if args.save:
+        save_baseline(make_baseline(results, config), resolve_baseline(args.save))
+
+    if args.compare:
+        baseline = load_baseline(resolve_baseline(args.compare))
+        if baseline["config"] != config:
+            print(
+                f"warning: baseline was run with {baseline['config']}", file=sys.stderr
+            )
+        comparisons = compare(baseline, results)
+        print(f"{'stage':<20}{'baseline':>14}{'current':>14}{'change':>10}")
+        regressed = False
+        for comparison in comparisons:
+            mark = ""
+            if comparison.is_regression(args.threshold):
+                mark = "  REGRESSION"
+                regressed = True
+            print(f"{comparison}{mark}")
+        return 1 if regressed else 0
+    return 0
+
+
+def main(argv: list[str] | None = None, prog: str = "python -m bench") -> int:
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Benchmark the chart pipeline."
+    )
+    add_arguments(parser)
+    return run(parser.parse_args(argv))
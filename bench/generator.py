@@ -0,0 +1,98 @@
+import random
+
+from chart.constants import KEYBOARD_INDEX_TABLE
+
+# units per beat that match the time signature
+BEAT_DIVISIONS: dict[int, tuple[int, ...]] = {4: (1, 2, 2, 4, 4, 8), 3: (1, 3, 3, 6)}
+
+BPM_CHOICES = (72, 90, 96, 110, 120, 128, 140, 160, 180)
+
+
+class ChartGenerator:
+    """
+    Generates random but well formed charts for benchmarks.
+
+    The charts mix single notes, rests, sustains, chords, arpeggios and nested
+    tuplets, with occasional @set bpm and @set ts changes, in proportions close to
+    hand written charts. The same seed always gives the same chart.
+    Attributes:
+    seed: The seed of the random generator.
+    beats_per_line: The number of beats on a line in 4/4, one less in 3/4.
+    tempo_change_rate: The chance of a @set bpm line before a line of beats.
+    signature_change_rate: The chance of a @set ts line before a line of beats.
+    max_depth: The deepest nesting of brackets.
+    """
+
+    seed: int
+    beats_per_line: int
+    tempo_change_rate: float
+    signature_change_rate: float
+    max_depth: int
+
+    def __init__(
+        self,
+        seed: int = 0,
+        beats_per_line: int = 4,
+        tempo_change_rate: float = 0.05,
+        signature_change_rate: float = 0.02,
+        max_depth: int = 3,
+    ) -> None:
+        self.seed = seed
+        self.beats_per_line = beats_per_line
+        self.tempo_change_rate = tempo_change_rate
+        self.signature_change_rate = signature_change_rate
+        self.max_depth = max_depth
+        self.random = random.Random(seed)
+
+    def key(self) -> str:
+        return self.random.choice(KEYBOARD_INDEX_TABLE)
+
+    def keys(self, count: int) -> str:
+        return "".join(self.random.sample(KEYBOARD_INDEX_TABLE, count))
+
+    def group(self, depth: int) -> str:
+        """A chord, an arpeggio or a tuplet, tuplets may contain further groups."""
+        kind = self.random.random()
+        if kind < 0.45:
+            return f"({self.keys(self.random.randint(2, 4))})"
+        if kind < 0.75 or depth >= self.max_depth:
+            return f"[{self.keys(self.random.randint(2, 5))}]"
+        parts = [
+            self.group(depth + 1) if self.random.random() < 0.3 else self.key()
+            for _ in range(self.random.choice((2, 3, 3, 4, 5)))
+        ]
+        return "{" + "".join(parts) + "}"
+
+    def beat(self, time_signature: int) -> str:
+        units: list[str] = []
+        for index in range(self.random.choice(BEAT_DIVISIONS[time_signature])):
+            kind = self.random.random()
+            if kind < 0.12:
+                units.append(" ")
+            elif kind < 0.25 and index > 0 and units[-1] != " ":
+                units.append("_")  # sustains the previous note
+            elif kind < 0.45:
+                units.append(self.group(1))
+            else:
+                units.append(self.key())
+        return "".join(units)
+
+    def generate(self, beats: int, title: str = "Benchmark chart") -> str:
+        """Generate a chart with the given number of beats."""
+        time_signature = 4
+        lines = [title, f"@set bpm {self.random.choice(BPM_CHOICES)}", "@set ts 4"]
+        remaining = beats
+        while remaining > 0:
+            if self.random.random() < self.tempo_change_rate:
+                lines.append(f"@set bpm {self.random.choice(BPM_CHOICES)}")
+            if self.random.random() < self.signature_change_rate:
+                time_signature = 7 - time_signature
+                lines.append(f"@set ts {time_signature}")
+            count = min(remaining, self.beats_per_line - (4 - time_signature))
+            lines.append("".join(self.beat(time_signature) + "/" for _ in range(count)))
+            remaining -= count
+        return "\n".join(lines) + "\n"
+
+
+def generate_chart(beats: int, seed: int = 0) -> str:
+    return ChartGenerator(seed).generate(beats)
@@ -0,0 +1,93 @@
+import argparse
+import json
+import subprocess
+import sys
+
+from shared.utils import PROJECT_ROOT
+
+# module -> the longest its import may take in a fresh interpreter, in seconds
+IMPORT_BUDGETS: dict[str, float] = {
+    "chart.parser": 0.05,
+    "player.runtime": 0.10,
+    "player.practice": 0.10,
+    "player.handlers.keyboard_h": 0.10,
+    "player.handlers.sound_h": 0.10,
+    "main": 0.10,
+}
+
+# dependencies that must only be imported when they are used
+DEFERRED_MODULES = ("keyboard", "playsound", "numpy")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str, runs: int = 3) -> dict[str, object]:
+    """Import a module in fresh interpreters, keeps the fastest run."""
+    best: dict[str, object] | None = None
+    for _ in range(runs):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                _PROBE.format(module=module, deferred=DEFERRED_MODULES),
+            ],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:  # type: ignore
+            best = result
+    assert best is not None
+    return best
+
+
+def check_import_budgets(
+    budgets: dict[str, float] = IMPORT_BUDGETS, runs: int = 3
+) -> list[dict[str, object]]:
+    """Measure every module against its budget and the deferred dependencies."""
+    results: list[dict[str, object]] = []
+    for module, budget in budgets.items():
+        result = measure_import(module, runs)
+        eager = result["loaded"]
+        result.update(
+            module=module,
+            budget=budget,
+            eager=eager,
+            ok=result["seconds"] <= budget and not eager,  # type: ignore
+        )
+        results.append(result)
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.imports", description="Check the import time budgets."
+    )
+    parser.add_argument("--runs", type=int, default=3, help="imports per module")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = check_import_budgets(runs=args.runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            status = "ok  " if result["ok"] else "FAIL"
+            eager = f"  eagerly imports {', '.join(result['eager'])}" if result["eager"] else ""  # type: ignore
+            print(
+                f"{status} {result['module']:<30}{result['seconds'] * 1000:8.1f} ms"  # type: ignore
+                f" / {result['budget'] * 1000:.0f} ms{eager}"  # type: ignore
+            )
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
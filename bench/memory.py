@@ -0,0 +1,66 @@
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+
+from typing import Callable
+
+from bench.generator import generate_chart
+from chart.parser import parse_chart
+from player.interal import InternalProperty
+from player.runtime import ChartRuntime
+
+
+def retained_bytes(build: Callable[[], object]) -> tuple[int, object]:
+    """Measure the memory still held by the result of build, in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return after - before, result
+
+
+def measure_memory(chart_text: str) -> dict[str, float]:
+    """The memory held by the parsed lines and by the compiled playlist of a chart."""
+    lines_bytes, lines = retained_bytes(lambda: parse_chart(chart_text))
+    runtime = ChartRuntime(InternalProperty(), lines)  # type: ignore
+    playlist_bytes, _ = retained_bytes(runtime.caculate_playlist)
+    playlist = runtime.get_playlist()
+    notes = sum(len(beat.notes) for beat in playlist)
+    return {
+        "beats": len(playlist),
+        "notes": notes,
+        "lines_bytes": lines_bytes,
+        "playlist_bytes": playlist_bytes,
+        "bytes_per_beat": (lines_bytes + playlist_bytes) / max(len(playlist), 1),
+        "bytes_per_note": playlist_bytes / max(notes, 1),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.memory",
+        description="Measure the memory of a parsed and compiled chart.",
+    )
+    parser.add_argument("--beats", type=int, default=20000, help="beats in the chart")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args(argv)
+
+    result = measure_memory(generate_chart(args.beats, args.seed))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<16}{value:14.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
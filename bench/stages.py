@@ -0,0 +1,133 @@
+import gc
+import statistics
+import time
+
+from typing import Callable
+
+from chart.beat import Beat
+from chart.parser import BeatLine, parse_chart
+from player.handlers.recording_h import RecordingBackend
+from player.interal import InternalProperty
+from player.pattern import get_notes_pattern_in_beat
+from player.runtime import BeatContainer, ChartRuntime, PlayerThreadingPool
+from player.tempo import TempoMap
+
+# a stage gets the chart text and returns a function running the timed work once
+StageSetup = Callable[[str], Callable[[], object]]
+
+SCHEDULE_TIMEOUT = 10.0  # seconds a scheduled run may take to record every note
+
+
+def _parse_chart(chart_text: str) -> Callable[[], object]:
+    return lambda: parse_chart(chart_text)
+
+
+def _parse_beats(chart_text: str) -> Callable[[], object]:
+    beat_strs = [
+        beat.raw_text
+        for line in parse_chart(chart_text)
+        if isinstance(line, BeatLine)
+        for beat in line.beats
+    ]
+    return lambda: [Beat.from_string(beat_str) for beat_str in beat_strs]
+
+
+def _get_notes_patterns(chart_text: str) -> Callable[[], object]:
+    # every beat with the tempo and time signature it is played with
+    lines = parse_chart(chart_text)
+    tempo_map = TempoMap.from_lines(lines, InternalProperty())
+    beats: list[tuple[Beat, InternalProperty]] = [
+        (beat, tempo_map.property_at(beat_id))
+        for beat_id, beat in enumerate(
+            beat for line in lines if isinstance(line, BeatLine) for beat in line.beats
+        )
+    ]
+    return lambda: [get_notes_pattern_in_beat(beat, ip) for beat, ip in beats]
+
+
+def _caculate_playlist(chart_text: str) -> Callable[[], object]:
+    runtime = ChartRuntime(InternalProperty(), parse_chart(chart_text))
+    return runtime.caculate_playlist
+
+
+def schedule_headless(playlist: list[BeatContainer]) -> RecordingBackend:
+    """Stage every beat as if it were due and wait until all notes are recorded."""
+    backend = RecordingBackend()
+    pool = PlayerThreadingPool(playlist, backend, latencies=[0.0])
+    note_count = sum(len(beat.notes) for beat in playlist)
+    # every note is due already, only the scheduling itself is timed
+    pool.begin_time = time.time() - max(
+        (nc.play_time for beat in playlist for nc in beat.notes), default=0.0
+    )
+    deadline = time.perf_counter() + SCHEDULE_TIMEOUT
+    try:
+        for beat in playlist:
+            pool.stage_beat(beat)
+        while len(backend.records) < note_count:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(
+                    f"{note_count - len(backend.records)} of {note_count} notes "
+                    f"not recorded after {SCHEDULE_TIMEOUT} s"
+                )
+            time.sleep(0.0005)
+    finally:
+        pool.stop()
+    return backend
+
+
+def _schedule(chart_text: str) -> Callable[[], object]:
+    runtime = ChartRuntime(InternalProperty(), parse_chart(chart_text))
+    runtime.caculate_playlist()
+    playlist = runtime.get_playlist()
+    return lambda: schedule_headless(playlist)
+
+
+STAGES: dict[str, StageSetup] = {
+    "parse_chart": _parse_chart,
+    "beat_parse": _parse_beats,
+    "notes_pattern": _get_notes_patterns,
+    "caculate_playlist": _caculate_playlist,
+    "schedule": _schedule,
+}
+
+
+def time_stage(
+    run: Callable[[], object], repeat: int = 5, warmup: int = 1
+) -> dict[str, float]:
+    """Time a stage, in seconds per run."""
+    for _ in range(warmup):
+        run()
+    timings: list[float] = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+            gc.collect()
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "max": max(timings),
+    }
+
+
+def run_stages(
+    chart_text: str,
+    stages: list[str] | None = None,
+    repeat: int = 5,
+) -> dict[str, dict[str, float]]:
+    """Run the named stages on a chart, all stages by default."""
+    if stages is None:
+        stages = list(STAGES)
+    results: dict[str, dict[str, float]] = {}
+    for name in stages:
+        if name not in STAGES:
+            raise KeyError(f"Unknown benchmark stage: {name}")
+        results[name] = time_stage(STAGES[name](chart_text), repeat)
+    return results
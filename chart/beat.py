@@ -17,7 +17,6 @@ from chart.note import (
     ArpeggioBuilder,
 )
 
-
 BeatUnit = BasicNote | Literal[" "]
 
 
@@ -37,6 +36,8 @@ class Beat:
     position: int | None , position in line, available when parsing a full chart
     """
 
+    __slots__ = ("notes", "raw_text", "line_number", "position")
+
     notes: list[BeatUnit]
     raw_text: str
     line_number: int | None  # available when parsing a full chart
@@ -45,6 +46,8 @@ class Beat:
     def __init__(self, raw_text: str) -> None:
         self.raw_text = raw_text
         self.notes = []
+        self.line_number = None
+        self.position = None
 
     def set_notes(self, notes: list[BeatUnit]) -> None:
         self.notes = notes
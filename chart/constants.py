@@ -121,3 +121,5 @@ ALLOWED_TOKENS.extend(TUPLET_BRACKET_TOKENS)
 ALLOWED_TOKENS.append(BEAT_TOKEN)
 ALLOWED_TOKENS.append(CONTINUE_TOKEN)
 ALLOWED_TOKENS.append(SPACE_TOKEN)
+
+CHART_EXTENSIONS = (".txt", ".chart")  # file extensions of chart files
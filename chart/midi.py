@@ -0,0 +1,197 @@
+import struct
+
+DRUM_CHANNEL = 9  # General MIDI percussion, channel 10 counted from 1
+
+DEFAULT_TEMPO = 500000  # microseconds per quarter note, 120 bpm
+
+
+class MidiParseError(Exception):
+    def __init__(self, message: str, position: int) -> None:
+        super().__init__(message)
+        self.position = position  # byte offset in the file
+
+
+class MidiNote:
+    """
+    A note of a MIDI file, from its note on to its note off.
+    Attributes:
+    start: The tick of the note on.
+    end: The tick of the note off.
+    pitch: The MIDI note number, 60 is the middle C (C4).
+    velocity: The velocity of the note on.
+    channel: The channel, counted from 0.
+    track: The track the note is in, counted from 0.
+    """
+
+    __slots__ = ("start", "end", "pitch", "velocity", "channel", "track")
+
+    start: int
+    end: int
+    pitch: int
+    velocity: int
+    channel: int
+    track: int
+
+    def __init__(
+        self,
+        start: int,
+        end: int,
+        pitch: int,
+        velocity: int,
+        channel: int = 0,
+        track: int = 0,
+    ) -> None:
+        self.start = start
+        self.end = end
+        self.pitch = pitch
+        self.velocity = velocity
+        self.channel = channel
+        self.track = track
+
+    def __repr__(self) -> str:
+        return f"MidiNote(start={self.start}, end={self.end}, pitch={self.pitch})"
+
+
+class MidiFile:
+    """
+    The notes, tempo and meter of a standard MIDI file, with times in ticks.
+    Attributes:
+    ticks_per_beat: The ticks of a quarter note.
+    notes: The notes of all tracks, sorted by start tick.
+    tempos: (tick, microseconds per quarter note) of every tempo change, in order.
+    time_signatures: (tick, numerator, denominator) of every time signature change, in order.
+    title: The name of the first track, if it has one.
+    """
+
+    ticks_per_beat: int
+    notes: list[MidiNote]
+    tempos: list[tuple[int, int]]
+    time_signatures: list[tuple[int, int, int]]
+    title: str | None
+
+    def __init__(self, ticks_per_beat: int) -> None:
+        self.ticks_per_beat = ticks_per_beat
+        self.notes = []
+        self.tempos = []
+        self.time_signatures = []
+        self.title = None
+
+
+class _Reader:
+    def __init__(self, data: bytes, position: int = 0, end: int | None = None) -> None:
+        self.data = data
+        self.position = position
+        self.end = len(data) if end is None else end
+
+    def read(self, count: int) -> bytes:
+        if self.position + count > self.end:
+            raise MidiParseError("Unexpected end of data", self.position)
+        chunk = self.data[self.position : self.position + count]
+        self.position += count
+        return chunk
+
+    def byte(self) -> int:
+        return self.read(1)[0]
+
+    def variable_length(self) -> int:
+        """A variable length quantity, 7 bits per byte, at most 4 bytes."""
+        value = 0
+        for _ in range(4):
+            byte = self.byte()
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value
+        raise MidiParseError("Variable length quantity too long", self.position)
+
+
+def _parse_track(reader: _Reader, midi: MidiFile, track: int) -> None:
+    sounding: dict[tuple[int, int], list[tuple[int, int]]] = {}  # (channel, pitch)
+    tick = 0
+    running_status = 0  # the last channel message status, reused by running status
+    while reader.position < reader.end:
+        tick += reader.variable_length()
+        status = reader.byte()
+        if status == 0xFF:  # meta event
+            meta_type = reader.byte()
+            data = reader.read(reader.variable_length())
+            if meta_type == 0x2F:
+                break
+            if meta_type == 0x51 and len(data) == 3:
+                midi.tempos.append((tick, int.from_bytes(data, "big")))
+            elif meta_type == 0x58 and len(data) >= 2:
+                midi.time_signatures.append((tick, data[0], 2 ** data[1]))
+            elif meta_type == 0x03 and track == 0 and midi.title is None:
+                midi.title = data.decode("latin-1").strip() or None
+            continue
+        if status in (0xF0, 0xF7):  # sysex
+            reader.read(reader.variable_length())
+            continue
+        if status & 0x80:
+            if status >= 0xF0:
+                raise MidiParseError(
+                    f"Unsupported status 0x{status:02X}", reader.position - 1
+                )
+            running_status = status
+            data1 = reader.byte()
+        elif running_status:
+            data1 = status
+            status = running_status
+        else:
+            raise MidiParseError("Data byte without a status", reader.position - 1)
+
+        kind = status & 0xF0
+        channel = status & 0x0F
+        if kind in (0xC0, 0xD0):  # program change, channel pressure
+            continue
+        data2 = reader.byte()
+        if kind == 0x90 and data2 > 0:
+            sounding.setdefault((channel, data1), []).append((tick, data2))
+        elif kind == 0x80 or kind == 0x90:
+            started = sounding.get((channel, data1))
+            if started:
+                start, velocity = started.pop(0)
+                midi.notes.append(
+                    MidiNote(start, tick, data1, velocity, channel, track)
+                )
+    # notes never released end with the track
+    for (channel, pitch), started in sounding.items():
+        for start, velocity in started:
+            midi.notes.append(MidiNote(start, tick, pitch, velocity, channel, track))
+
+
+def parse_midi(data: bytes) -> MidiFile:
+    """Parse a standard MIDI file of format 0, 1 or 2."""
+    reader = _Reader(data)
+    if reader.read(4) != b"MThd":
+        raise MidiParseError("Not a MIDI file", 0)
+    header_length = struct.unpack(">I", reader.read(4))[0]
+    if header_length < 6:
+        raise MidiParseError("Header too short", 4)
+    _, track_count, division = struct.unpack(">HHH", reader.read(6))
+    reader.read(header_length - 6)
+    if division & 0x8000:
+        raise MidiParseError("SMPTE time division is not supported", 12)
+    if division == 0:
+        raise MidiParseError("Zero ticks per quarter note", 12)
+
+    midi = MidiFile(division)
+    track = 0
+    while track < track_count and reader.position + 8 <= len(data):
+        chunk_type = reader.read(4)
+        length = struct.unpack(">I", reader.read(4))[0]
+        end = reader.position + length
+        if end > len(data):
+            raise MidiParseError("Chunk longer than the file", reader.position - 8)
+        if chunk_type == b"MTrk":
+            _parse_track(_Reader(data, reader.position, end), midi, track)
+            track += 1
+        reader.position = end  # unknown chunks are skipped
+    midi.notes.sort(key=lambda note: (note.start, note.pitch))
+    midi.tempos.sort(key=lambda tempo: tempo[0])
+    midi.time_signatures.sort(key=lambda signature: signature[0])
+    return midi
+
+
+def read_midi(path: str) -> MidiFile:
+    with open(path, "rb") as f:
+        return parse_midi(f.read())
@@ -0,0 +1,314 @@
+import os
+
+import numpy as np
+
+from chart.constants import KEYBOARD_INDEX_TABLE, NOTATION_INDEX_TABLE
+from chart.midi import (
+    DEFAULT_TEMPO,
+    DRUM_CHANNEL,
+    MidiFile,
+    MidiParseError,
+    read_midi,
+)
+from chart.utils import is_beat_line
+
+MIDI_EXTENSIONS = (".mid", ".midi")
+
+# the divisions of a beat get_notes_pattern_in_beat accepts, by time signature
+BEAT_DIVISIONS: dict[int, tuple[int, ...]] = {4: (1, 2, 4, 8, 16), 3: (1, 3, 6, 12)}
+
+# every division a beat can be quantized to, simplest first
+QUANTIZE_DIVISIONS = np.array(sorted(set(BEAT_DIVISIONS[4] + BEAT_DIVISIONS[3])))
+
+QUANTIZE_TOLERANCE = 1 / 32  # in beats, the simplest division within it is used
+
+# pitch class -> step of the white key scale, sharps fall to the key below
+_WHITE_STEP = np.array([0, 0, 1, 1, 2, 3, 3, 4, 4, 5, 5, 6])
+
+_LOWEST_OCTAVE = int(NOTATION_INDEX_TABLE[0][-1])  # C3, the first chart note
+_KEY_COUNT = len(NOTATION_INDEX_TABLE)
+
+
+def map_pitches(pitches: np.ndarray, transpose: int | None = None) -> np.ndarray:
+    """
+    Map MIDI note numbers onto the indexes of NOTATION_INDEX_TABLE.
+
+    The song is moved by whole octaves, by transpose or else by the shift that
+    keeps the most notes in range; notes still out of range are folded into the
+    lowest or highest octave. Sharps and flats fall to the white key below.
+    """
+    steps = (pitches // 12 - 1 - _LOWEST_OCTAVE) * 7 + _WHITE_STEP[pitches % 12]
+    if transpose is None:
+        shifts = np.arange(-5, 6) * 7
+        in_range = ((steps[None, :] + shifts[:, None] >= 0)) & (
+            steps[None, :] + shifts[:, None] < _KEY_COUNT
+        )
+        # most notes in range, then the smallest shift
+        scores = in_range.sum(axis=1) * 100 - np.abs(shifts)
+        shift = int(shifts[np.argmax(scores)])
+    else:
+        shift = transpose * 7
+    steps = steps + shift
+    steps = np.where(steps < 0, steps % 7, steps)
+    return np.where(steps >= _KEY_COUNT, _KEY_COUNT - 7 + steps % 7, steps)
+
+
+class QuantizedNotes:
+    """
+    Notes placed on the beat grids of the chart syntax.
+    Attributes:
+    beat: The beat of every note.
+    slot: The unit of its beat the note starts on.
+    end_slot: The unit of its beat the note ends before, at most the division of the beat.
+    divisions: The number of units of every beat.
+    ternary: Whether every beat is on the 3/4 grid.
+    """
+
+    beat: np.ndarray
+    slot: np.ndarray
+    end_slot: np.ndarray
+    divisions: np.ndarray
+    ternary: np.ndarray
+
+    def __init__(
+        self,
+        beat: np.ndarray,
+        slot: np.ndarray,
+        end_slot: np.ndarray,
+        divisions: np.ndarray,
+        ternary: np.ndarray,
+    ) -> None:
+        self.beat = beat
+        self.slot = slot
+        self.end_slot = end_slot
+        self.divisions = divisions
+        self.ternary = ternary
+
+
+def quantize(starts: np.ndarray, ends: np.ndarray) -> QuantizedNotes:
+    """
+    Quantize note onsets and ends, in beats, all notes at once.
+
+    Every beat gets the simplest division that puts all of its onsets within
+    QUANTIZE_TOLERANCE, or the closest fitting one if none does.
+    """
+    if len(starts) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return QuantizedNotes(empty, empty, empty, empty, np.zeros(0, dtype=bool))
+    finest = int(np.lcm.reduce(QUANTIZE_DIVISIONS))
+    rough_beat = (np.rint(starts * finest) // finest).astype(np.int64)
+    beat_count = int(rough_beat.max()) + 2
+
+    # the largest onset error of every beat for every division
+    scaled = starts[None, :] * QUANTIZE_DIVISIONS[:, None]
+    errors = np.abs(scaled - np.rint(scaled)) / QUANTIZE_DIVISIONS[:, None]
+    beat_errors = np.zeros((len(QUANTIZE_DIVISIONS), beat_count))
+    np.maximum.at(
+        beat_errors,
+        (np.arange(len(QUANTIZE_DIVISIONS))[:, None], rough_beat[None, :]),
+        errors,
+    )
+    fits = beat_errors <= QUANTIZE_TOLERANCE
+    choice = np.where(
+        fits.any(axis=0), np.argmax(fits, axis=0), np.argmin(beat_errors, axis=0)
+    )
+    divisions = QUANTIZE_DIVISIONS[choice]
+
+    note_divisions = divisions[rough_beat]
+    position = np.rint(starts * note_divisions).astype(np.int64)
+    beat = position // note_divisions
+    # a note rounded onto the next beat starts it, which every division has
+    slot = np.where(beat == rough_beat, position - beat * note_divisions, 0)
+    note_divisions = divisions[beat]
+    end_slot = np.clip(
+        np.rint((ends - beat) * note_divisions).astype(np.int64),
+        slot + 1,
+        note_divisions,
+    )
+    ternary = divisions % 3 == 0
+    return QuantizedNotes(beat, slot, end_slot, divisions, ternary)
+
+
+def _unit(keys: list[int]) -> str:
+    chars = "".join(KEYBOARD_INDEX_TABLE[key] for key in keys)
+    return chars if len(keys) == 1 else f"({chars})"
+
+
+def _beat_text(
+    onsets: dict[int, list[int]], ends: dict[int, int], division: int, tuplet: bool
+) -> str:
+    """
+    The text of a beat of division units.
+    onsets maps a unit to the keys starting on it, ends a unit to the unit its notes end before.
+    """
+    units: list[str] = []
+    sounding_until = 0
+    for slot in range(division):
+        if slot in onsets:
+            units.append(_unit(onsets[slot]))
+            sounding_until = ends[slot]
+        elif tuplet:
+            units.append("_")  # a silent unit, tuplets drop rests
+        elif slot < sounding_until:
+            units.append("_")
+        else:
+            units.append(" ")
+            sounding_until = 0
+    text = "".join(units)
+    return "{" + text + "}" if tuplet else text
+
+
+def _bar_starts(midi: MidiFile, beat_count: int) -> np.ndarray:
+    """Whether a bar begins on every beat, from the time signatures of the file."""
+    bar_starts = np.zeros(beat_count + 1, dtype=bool)
+    signatures = midi.time_signatures or [(0, 4, 4)]
+    if signatures[0][0] > 0:
+        signatures = [(0, 4, 4)] + signatures
+    for index, (tick, numerator, denominator) in enumerate(signatures):
+        first = round(tick / midi.ticks_per_beat)
+        last = (
+            round(signatures[index + 1][0] / midi.ticks_per_beat)
+            if index + 1 < len(signatures)
+            else beat_count
+        )
+        bar_length = max(round(numerator * 4 / denominator), 1)
+        bar_starts[first:last:bar_length] = True
+    return bar_starts
+
+
+def _format_bpm(tempo: int) -> str:
+    return f"{round(60_000_000 / tempo, 3):g}"
+
+
+def convert_midi(
+    midi: MidiFile,
+    title: str | None = None,
+    include_drums: bool = False,
+    transpose: int | None = None,
+) -> str:
+    """
+    Convert a MIDI file to a chart.
+
+    Beats are quarter notes and lines are bars. Bars with mostly triplet beats are
+    written in 3/4, a beat that does not fit the grid of its bar becomes a tuplet.
+    Tempo changes are moved to the closest beat and start a new line.
+    Args:
+        midi: The parsed file.
+        title: The first line of the chart, the track name by default.
+        include_drums: Whether the notes of the percussion channel are kept.
+        transpose: Octaves to move the song by, chosen to fit the 21 keys by default.
+    """
+    notes = [
+        note for note in midi.notes if include_drums or note.channel != DRUM_CHANNEL
+    ]
+    lines = [title or midi.title or "Imported MIDI"]
+    if is_beat_line(lines[0]):
+        lines[0] = f"# {lines[0]}"  # would be read as beats otherwise
+
+    starts = np.array([note.start for note in notes], dtype=np.float64)
+    ends = np.array([note.end for note in notes], dtype=np.float64)
+    starts /= midi.ticks_per_beat
+    ends /= midi.ticks_per_beat
+    keys = map_pitches(
+        np.array([note.pitch for note in notes], dtype=np.int64), transpose
+    )
+    quantized = quantize(starts, ends)
+    beat_count = int(quantized.beat.max()) + 1 if len(notes) else 0
+
+    # one entry per (beat, slot, key), the longest of the duplicates
+    order = np.lexsort((keys, quantized.slot, quantized.beat))
+    beat = quantized.beat[order]
+    slot = quantized.slot[order]
+    end_slot = quantized.end_slot[order]
+    keys = keys[order]
+    code = (beat * int(QUANTIZE_DIVISIONS[-1]) + slot) * _KEY_COUNT + keys
+    first = np.flatnonzero(np.r_[True, code[1:] != code[:-1]]) if len(code) else code
+    if len(code):
+        end_slot = np.maximum.reduceat(end_slot, first)
+    beat, slot, keys = beat[first], slot[first], keys[first]
+    beat_bounds = np.searchsorted(beat, np.arange(beat_count + 1))
+
+    tempos: dict[int, int] = {}
+    for tick, tempo in midi.tempos:
+        tempos[round(tick / midi.ticks_per_beat)] = tempo
+    bar_starts = _bar_starts(midi, beat_count)
+    bar_index = np.cumsum(bar_starts[:beat_count]) - 1
+    # a bar is in 3/4 if most of its split beats are on the ternary grid
+    split = quantized.divisions[:beat_count] > 1
+    bar_count = int(bar_index[-1]) + 1 if beat_count else 0
+    ternary_beats = np.bincount(
+        bar_index, split & quantized.ternary[:beat_count], bar_count
+    )
+    split_beats = np.bincount(bar_index, split, bar_count)
+    bar_ternary = ternary_beats * 2 > split_beats
+
+    # leading bars without notes are skipped, tempo changes in them still apply
+    first_beat = (
+        int(np.flatnonzero(bar_starts[: int(beat[0]) + 1])[-1]) if len(beat) else 0
+    )
+    tempo = DEFAULT_TEMPO
+    for tempo_beat in sorted(tempos):
+        if tempo_beat <= first_beat:
+            tempo = tempos[tempo_beat]
+    lines.append(f"@set bpm {_format_bpm(tempo)}")
+    time_signature = 0
+    beat_texts: list[str] = []
+    for index in range(first_beat, beat_count):
+        new_tempo = index > first_beat and index in tempos and tempos[index] != tempo
+        if beat_texts and (bar_starts[index] or new_tempo):
+            lines.append("/".join(beat_texts) + "/")
+            beat_texts = []
+        if new_tempo:
+            tempo = tempos[index]
+            lines.append(f"@set bpm {_format_bpm(tempo)}")
+        bar_signature = 3 if bar_ternary[bar_index[index]] else 4
+        if not beat_texts and bar_signature != time_signature:
+            time_signature = bar_signature
+            lines.append(f"@set ts {time_signature}")
+
+        division = int(quantized.divisions[index])
+        onsets: dict[int, list[int]] = {}
+        note_ends: dict[int, int] = {}
+        for note in range(beat_bounds[index], beat_bounds[index + 1]):
+            onsets.setdefault(int(slot[note]), []).append(int(keys[note]))
+            note_ends[int(slot[note])] = max(
+                note_ends.get(int(slot[note]), 0), int(end_slot[note])
+            )
+        tuplet = division > 1 and division not in BEAT_DIVISIONS[time_signature]
+        beat_texts.append(
+            _beat_text(onsets, note_ends, division, tuplet) if onsets else " "
+        )
+    if beat_texts:
+        lines.append("/".join(beat_texts) + "/")
+    return "\n".join(lines) + "\n"
+
+
+def convert_file(
+    path: str,
+    output_dir: str | None = None,
+    include_drums: bool = False,
+    transpose: int | None = None,
+) -> dict[str, object]:
+    """Convert a MIDI file to a chart file next to it or in output_dir."""
+    result: dict[str, object] = {"path": path}
+    try:
+        midi = read_midi(path)
+        title = midi.title or os.path.splitext(os.path.basename(path))[0]
+        chart = convert_midi(midi, title, include_drums, transpose)
+    except (MidiParseError, OSError) as e:
+        result.update(ok=False, errors=[{"message": str(e)}])
+        return result
+    directory = os.path.dirname(path) if output_dir is None else output_dir
+    os.makedirs(directory or ".", exist_ok=True)
+    output = os.path.join(
+        directory, os.path.splitext(os.path.basename(path))[0] + ".txt"
+    )
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(chart)
+    result.update(
+        ok=True,
+        output=output,
+        notes=len(midi.notes),
+        lines=chart.count("\n"),
+    )
+    return result
@@ -7,6 +7,8 @@ from chart.utils import token_to_keyboard, token_to_index
 class BasicNote(ABC):
     """An abstract base class for chart notes."""
 
+    __slots__ = ()
+
     @abstractmethod
     def __eq__(self, value: object) -> bool:
         pass
@@ -39,6 +41,8 @@ class BasicNote(ABC):
 class ContinuousNote(BasicNote):
     """A class representing a continue chart note."""
 
+    __slots__ = ()
+
     def __eq__(self, value: object) -> bool:
         return isinstance(value, ContinuousNote)
 
@@ -65,6 +69,8 @@ class ContinuousNote(BasicNote):
 class SingleNote(BasicNote):
     """A class representing a single chart note."""
 
+    __slots__ = ("token",)
+
     token: ChartNotation
 
     def __init__(self, token: ChartNotation) -> None:
@@ -105,6 +111,8 @@ class SingleNote(BasicNote):
 class ChordNote(BasicNote):
     """A class representing a chord chart note."""
 
+    __slots__ = ("notes",)
+
     notes: list[BasicNote]
 
     def __init__(self, notes: list[BasicNote]) -> None:
@@ -149,6 +157,8 @@ class ChordNote(BasicNote):
 class ArpeggioNote(BasicNote):
     """A class representing an arpeggio chart note."""
 
+    __slots__ = ("notes",)
+
     notes: list[BasicNote]
 
     def __init__(self, notes: list[BasicNote]) -> None:
@@ -191,6 +201,8 @@ class ArpeggioNote(BasicNote):
 class TupletNote(BasicNote):
     """A class representing a tuplet chart note."""
 
+    __slots__ = ("notes",)
+
     notes: list[BasicNote]
 
     def __init__(self, notes: list[BasicNote]) -> None:
@@ -1,5 +1,6 @@
 from chart.beat import Beat, BeatParseError
 from chart.utils import is_command_line, is_beat_line
+from shared import tracing
 
 from abc import ABC, abstractmethod
 
@@ -52,11 +53,14 @@ class Line(ABC):
     raw_text: The raw text of the line.
     """
 
+    __slots__ = ("raw_text", "line_number")  # charts hold many lines, skip the __dict__
+
     raw_text: str
     line_number: int | None  # available when parsing a full chart
 
     def __init__(self, raw_text: str) -> None:
         self.raw_text = raw_text
+        self.line_number = None
 
     @abstractmethod
     def __str__(self) -> str:
@@ -73,6 +77,8 @@ class Line(ABC):
 class TextLine(Line):
     """A class representing a text line in the chart."""
 
+    __slots__ = ()
+
     def __str__(self) -> str:
         return self.raw_text
 
@@ -83,11 +89,13 @@ class TextLine(Line):
 class BeatLine(Line):
     """A class representing a beat line in the chart."""
 
+    __slots__ = ("beats",)
+
     beats: list[Beat]
     raw_text: str
 
     def __init__(self, raw_text: str) -> None:
-        self.raw_text = raw_text
+        super().__init__(raw_text)
         self.beats = []
 
     def set_beats(self, beats: list[Beat]) -> None:
@@ -135,6 +143,8 @@ class BeatLine(Line):
 class CommandLine(Line):
     """A class representing a command line in the chart."""
 
+    __slots__ = ("command", "args")
+
     command: str
     args: list[str]
 
@@ -172,6 +182,8 @@ def parse_line(line_str: str, line_number: int) -> Line:
     else:
         result_line = TextLine(line_str)
     result_line.set_line_number(line_number)
+    if isinstance(result_line, BeatLine):
+        result_line.set_beat_positions()
     return result_line
 
 
@@ -180,18 +192,19 @@ def parse_chart(chart_str: str) -> list[Line]:
     lines: list[Line] = []
     line_strs = chart_str.splitlines()
     exception_list: list[ParseErrorInfo] = []
-    for line_number, line_str in enumerate(line_strs, start=1):
-        try:
-            line = parse_line(line_str, line_number)
-            lines.append(line)
-        except ParseError as e:
-            exception_list.append(
-                ParseErrorInfo(
-                    line_number=line_number,
-                    position=e.position,
-                    message=str(e),
+    with tracing.span("parse_chart", "parse", lines=len(line_strs)):
+        for line_number, line_str in enumerate(line_strs, start=1):
+            try:
+                line = parse_line(line_str, line_number)
+                lines.append(line)
+            except ParseError as e:
+                exception_list.append(
+                    ParseErrorInfo(
+                        line_number=line_number,
+                        position=e.position,
+                        message=str(e),
+                    )
                 )
-            )
     if exception_list:
         raise ChartParseException(exception_list)
     return lines
@@ -0,0 +1,669 @@
+import argparse
+import json
+import os
+import sys
+
+from typing import Any, Callable, Iterable
+
+from chart.constants import CHART_EXTENSIONS
+from chart.parser import ChartParseException, parse_chart
+from player.command import CommandParseError
+from player.interal import InternalProperty
+from player.pattern import PatternMismatchException, PatternMismatchWarning
+from player.runtime import BeatContainer, ChartRuntime
+from shared import tracing
+from shared.utils import AUDIO_DIR
+
+
+def expand_paths(
+    paths: list[str], extensions: tuple[str, ...] = CHART_EXTENSIONS
+) -> list[str]:
+    """Replace every directory by the charts, or other files with extensions, below it."""
+    result: list[str] = []
+    for path in paths:
+        if not os.path.isdir(path):
+            result.append(path)
+            continue
+        for root, _, files in os.walk(path):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(extensions):
+                    result.append(os.path.join(root, file_name))
+    return result
+
+
+def compile_path(
+    path: str, bpm: float, time_signature: int
+) -> tuple[list[BeatContainer], ChartRuntime]:
+    with open(path, "r", encoding="utf-8") as f:
+        lines = parse_chart(f.read())
+    runtime = ChartRuntime(InternalProperty(bpm, time_signature), lines)  # type: ignore
+    runtime.caculate_playlist()
+    return runtime.get_playlist(), runtime
+
+
+def describe_error(error: Exception) -> list[dict[str, Any]]:
+    """Turn the errors of a chart into JSON friendly dicts."""
+    if isinstance(error, ChartParseException):
+        return [
+            {"line": e.line_number, "position": e.position, "message": e.message}
+            for e in error.errors
+        ]
+    if isinstance(error, PatternMismatchException):
+        return [
+            {"begin": w.begin_str, "end": w.end_str, "message": w.message}
+            for w in error.warnings
+        ]
+    if isinstance(error, CommandParseError):
+        return [{"line": error.line_number, "message": str(error)}]
+    if isinstance(error, PatternMismatchWarning):
+        return [{"begin": error.begin_str, "end": error.end_str, "message": str(error)}]
+    return [{"message": str(error)}]
+
+
+CHART_ERRORS = (
+    ChartParseException,
+    CommandParseError,
+    PatternMismatchException,
+    PatternMismatchWarning,
+    ValueError,
+    UnicodeDecodeError,
+    OSError,
+)
+
+
+def playlist_summary(playlist: list[BeatContainer]) -> dict[str, Any]:
+    notes = [nc for beat in playlist for nc in beat.notes]
+    return {
+        "beats": len(playlist),
+        "notes": len(notes),
+        "duration": max(
+            (nc.play_time + nc.duration for nc in notes),
+            default=0.0,
+        ),
+    }
+
+
+def compile_file(
+    path: str, bpm: float, time_signature: int, output_dir: str | None
+) -> dict[str, Any]:
+    result: dict[str, Any] = {"path": path}
+    try:
+        playlist, _ = compile_path(path, bpm, time_signature)
+    except CHART_ERRORS as e:
+        result.update(ok=False, errors=describe_error(e))
+        return result
+    result.update(ok=True, **playlist_summary(playlist))
+    if output_dir is not None:
+        from player.cache import dump_playlist
+
+        os.makedirs(output_dir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(path))[0] + ".gcpc"
+        result["output"] = os.path.join(output_dir, name)
+        with open(result["output"], "wb") as f:
+            f.write(dump_playlist(playlist))
+    return result
+
+
+def validate_file(path: str, bpm: float, time_signature: int) -> dict[str, Any]:
+    return compile_file(path, bpm, time_signature, None)
+
+
+def render_file(
+    path: str,
+    bpm: float,
+    time_signature: int,
+    output: str,
+    audio_dir: str,
+    instrument: str | None,
+    sample_rate: int | None,
+) -> dict[str, Any]:
+    from player.render import render_to_wav
+    from player.samplebank import InstrumentLibrary, SampleBankError
+
+    result: dict[str, Any] = {"path": path, "output": output}
+    try:
+        playlist, _ = compile_path(path, bpm, time_signature)
+        bank = InstrumentLibrary(audio_dir).get_bank(instrument)
+        result.update(
+            ok=True, length=render_to_wav(playlist, bank, output, sample_rate)
+        )
+    except (*CHART_ERRORS, SampleBankError, KeyError) as e:
+        result.update(ok=False, errors=describe_error(e))
+    return result
+
+
+def run_parallel(
+    function: Callable[..., dict[str, Any]],
+    jobs: int | None,
+    argument_lists: Iterable[tuple[Any, ...]],
+) -> list[dict[str, Any]]:
+    """Run function for every argument tuple, on several processes for many files."""
+    argument_lists = list(argument_lists)
+    if jobs == 1 or len(argument_lists) < 2:
+        return [function(*arguments) for arguments in argument_lists]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(function, *zip(*argument_lists)))
+
+
+def print_results(args: argparse.Namespace, results: list[dict[str, Any]]) -> int:
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        for result in results:
+            if result["ok"]:
+                details = ", ".join(
+                    (
+                        f"{key}={value:.3f}"
+                        if isinstance(value, float)
+                        else f"{key}={value}"
+                    )
+                    for key, value in result.items()
+                    if key not in ("path", "ok")
+                )
+                print(f"ok    {result['path']}  {details}")
+            else:
+                print(f"error {result['path']}")
+                for error in result["errors"]:
+                    where = error.get("line", error.get("begin"))
+                    prefix = "" if where is None else f"{where}: "
+                    print(f"      {prefix}{error['message']}")
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+def command_compile(args: argparse.Namespace) -> int:
+    paths = expand_paths(args.paths)
+    return print_results(
+        args,
+        run_parallel(
+            compile_file,
+            args.jobs,
+            ((path, args.bpm, args.ts, args.output) for path in paths),
+        ),
+    )
+
+
+def command_validate(args: argparse.Namespace) -> int:
+    paths = expand_paths(args.paths)
+    results = run_parallel(
+        validate_file, args.jobs, ((path, args.bpm, args.ts) for path in paths)
+    )
+    if args.errors_only:
+        results = [result for result in results if not result["ok"]]
+        if not args.json:
+            print(f"{len(paths) - len(results)} of {len(paths)} charts are valid")
+    return print_results(args, results) if results else 0
+
+
+def command_render(args: argparse.Namespace) -> int:
+    paths = expand_paths(args.paths)
+    if len(paths) == 1 and args.output.lower().endswith(".wav"):
+        outputs = [args.output]
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        outputs = [
+            os.path.join(
+                args.output, os.path.splitext(os.path.basename(path))[0] + ".wav"
+            )
+            for path in paths
+        ]
+    return print_results(
+        args,
+        run_parallel(
+            render_file,
+            args.jobs,
+            (
+                (
+                    path,
+                    args.bpm,
+                    args.ts,
+                    output,
+                    args.audio_dir,
+                    args.instrument,
+                    args.sample_rate,
+                )
+                for path, output in zip(paths, outputs)
+            ),
+        ),
+    )
+
+
+def command_play(args: argparse.Namespace) -> int:
+    from player.calibration import output_latency
+    from player.clock import VirtualClock, real_clock
+    from player.handlers.base import backend_registry
+    from player.handlers.recording_h import RecordingBackend
+    from player.runtime import PlayerThreadingPool
+    from player.sections import BeatRangeIndex
+    from player.live import LiveChart
+
+    live: LiveChart | None = None
+    try:
+        if args.watch:
+            live = LiveChart(
+                args.path,
+                InternalProperty(args.bpm, args.ts),
+                # stdout is kept for the result, e.g. the --json document
+                on_reload=lambda beat_id: print(
+                    f"reloaded from beat {beat_id}", file=sys.stderr
+                ),
+                on_error=lambda e: print(
+                    f"not reloaded: {describe_error(e)[0]['message']}",
+                    file=sys.stderr,
+                ),
+            )
+            playlist = live.runtime.get_playlist()
+        else:
+            playlist, _ = compile_path(args.path, args.bpm, args.ts)
+        if args.lines is not None:
+            begin, end = BeatRangeIndex(playlist).by_lines(*args.lines)
+            playlist = playlist[begin:end]
+    except CHART_ERRORS as e:
+        return print_results(
+            args, [{"path": args.path, "ok": False, "errors": describe_error(e)}]
+        )
+
+    clock = VirtualClock() if args.virtual else real_clock
+    recorder = RecordingBackend(clock)
+    outputs: list[Any] = [recorder]
+    if not args.dry_run and not args.virtual:
+        outputs.append(backend_registry.create_backend(args.backend))
+    # the recorder reports the lateness against the chart, the real output is
+    # fired its calibrated latency earlier
+    latencies = [0.0] + [output_latency(output) for output in outputs[1:]]
+    pool = PlayerThreadingPool(playlist, outputs, latencies=latencies, clock=clock)
+    if live is not None:
+        live.attach(pool)
+        live.start()
+    try:
+        pool.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
+        if live is not None:
+            live.stop()
+    note_count = sum(len(beat.notes) for beat in pool.beats)
+
+    summary = recorder.summary()
+    result = {"path": args.path, "ok": True, "scheduled": note_count, **summary}
+    if live is not None:
+        result["reloads"] = live.reloads
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"played {summary['count']} of {note_count} notes")
+        for key in ("mean", "median", "p99", "max"):
+            if key in summary:
+                print(f"{key:<8}{summary[key] * 1000:8.3f} ms late")
+    if live is not None:
+        return 0  # notes of the replaced beats were played but are not counted
+    return 0 if summary["count"] == note_count else 1
+
+
+def command_stream(args: argparse.Namespace) -> int:
+    from player.calibration import output_latency
+    from player.handlers.base import backend_registry
+    from player.handlers.recording_h import RecordingBackend
+    from player.stream import StreamPlayer
+
+    recorder = RecordingBackend()
+    outputs: list[Any] = [recorder]
+    if not args.dry_run:
+        outputs.append(backend_registry.create_backend(args.backend))
+    player = StreamPlayer(
+        outputs,
+        # like play: the recorder reports against the chart, the real output
+        # is fired its calibrated latency earlier
+        latencies=[0.0] + [output_latency(output) for output in outputs[1:]],
+        internal_property=InternalProperty(args.bpm, args.ts),  # type: ignore
+        latency=args.latency,
+        max_ahead=args.max_ahead,
+        # stdout is kept for the result, the --json result lists both as well
+        on_underrun=lambda beat_id, lateness: print(
+            f"underrun at beat {beat_id}: {lateness * 1000:.1f} ms late",
+            file=sys.stderr,
+        ),
+        on_error=lambda line_number, e: print(
+            f"line {line_number} skipped: {e}", file=sys.stderr
+        ),
+    )
+    source = sys.stdin if args.path == "-" else open(args.path, "r", encoding="utf-8")
+    try:
+        player.run(source)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        player.stop()
+        if source is not sys.stdin:
+            source.close()
+    note_count = sum(len(beat.notes) for beat in player.pool.beats)
+
+    summary = recorder.summary()
+    result = {
+        "path": args.path,
+        "ok": not player.errors,
+        "lines": player.compiler.line_count,
+        "scheduled": note_count,
+        "underruns": player.underruns,
+        "postponed": player.underrun_time,
+        "skipped": [line_number for line_number, _ in player.errors],
+        **summary,
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"played {summary['count']} of {note_count} notes")
+        print(f"{player.underruns} underruns, postponed {player.underrun_time:.3f} s")
+        for key in ("mean", "median", "p99", "max"):
+            if key in summary:
+                print(f"{key:<8}{summary[key] * 1000:8.3f} ms late")
+    return 0 if result["ok"] else 1
+
+
+def command_calibrate(args: argparse.Namespace) -> int:
+    from player.calibration import calibrate
+    from player.handlers.base import backend_registry
+
+    names = args.backend or ["keyboard"]
+    try:
+        backends = [backend_registry.create_backend(name) for name in names]
+    except KeyError as e:
+        print(f"error {e.args[0]}", file=sys.stderr)
+        return 1
+    profile = calibrate(backends, args.trials)
+    offsets = {name: profile.offsets.get(name) for name in names}
+    if args.json:
+        print(json.dumps({"path": profile.path, "offsets": offsets}, indent=2))
+    else:
+        for name, latency in offsets.items():
+            if latency is None:
+                print(f"{name:<12}not observable, played without offset")
+            else:
+                print(f"{name:<12}{latency * 1000:8.3f} ms")
+        print(f"saved to {profile.path}")
+    return 0
+
+
+def command_import(args: argparse.Namespace) -> int:
+    from chart.midi_import import MIDI_EXTENSIONS, convert_file
+
+    paths = expand_paths(args.paths, MIDI_EXTENSIONS)
+    return print_results(
+        args,
+        run_parallel(
+            convert_file,
+            args.jobs,
+            ((path, args.output, args.drums, args.transpose) for path in paths),
+        ),
+    )
+
+
+def command_daemon(args: argparse.Namespace) -> int:
+    from player.daemon import DAEMON_SOCKET_PATH, DaemonError, PlayerDaemon
+
+    daemon = PlayerDaemon(args.socket or DAEMON_SOCKET_PATH)
+    try:
+        daemon.warm(args.warm, args.charts)
+    except (*CHART_ERRORS, KeyError) as e:
+        print(f"not warmed: {describe_error(e)[0]['message']}")
+    try:
+        daemon.serve()
+    except DaemonError as e:
+        print(e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def command_remote(args: argparse.Namespace) -> int:
+    from player.daemon import DAEMON_SOCKET_PATH, send_request
+
+    socket_path = args.socket or DAEMON_SOCKET_PATH
+    request: dict[str, Any] = {"command": args.action}
+    if args.path is not None:
+        # the daemon may run in another folder
+        request.update(path=os.path.abspath(args.path), bpm=args.bpm, ts=args.ts)
+    for key in ("time", "beat", "line"):
+        if getattr(args, key) is not None:
+            request[key] = getattr(args, key)
+    if args.backend:
+        request["backends"] = args.backend
+    try:
+        answer = send_request(request, socket_path)
+    except OSError as e:
+        answer = {"ok": False, "error": f"No daemon at {socket_path}: {e}"}
+    if args.json:
+        print(json.dumps(answer, indent=2, ensure_ascii=False))
+    elif answer["ok"]:
+        print(
+            ", ".join(
+                f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in answer.items()
+                if key != "ok"
+            )
+            or "ok"
+        )
+    else:
+        print(f"error {answer['error']}")
+    return 0 if answer["ok"] else 1
+
+
+def command_bench(args: argparse.Namespace) -> int:
+    from bench.cli import main as bench_main
+
+    return bench_main(args.bench_args, prog="main.py bench")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="main.py", description="Compile, check, render and play charts."
+    )
+    parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace to FILE")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    chart_options = argparse.ArgumentParser(add_help=False)
+    chart_options.add_argument("--bpm", type=float, default=120.0, help="initial bpm")
+    chart_options.add_argument(
+        "--ts", type=int, choices=(3, 4), default=4, help="initial time signature"
+    )
+    chart_options.add_argument("--json", action="store_true", help="print JSON")
+    batch_options = argparse.ArgumentParser(add_help=False)
+    batch_options.add_argument("paths", nargs="+", help="chart files or folders")
+    batch_options.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="worker processes, all cores by default",
+    )
+
+    compile_parser = subparsers.add_parser(
+        "compile", parents=[chart_options, batch_options], help="compile charts"
+    )
+    compile_parser.add_argument(
+        "-o", "--output", metavar="DIR", help="write the compiled playlists to DIR"
+    )
+    compile_parser.set_defaults(handler=command_compile)
+
+    validate_parser = subparsers.add_parser(
+        "validate",
+        parents=[chart_options, batch_options],
+        help="check charts for errors",
+    )
+    validate_parser.add_argument(
+        "--errors-only", action="store_true", help="only report invalid charts"
+    )
+    validate_parser.set_defaults(handler=command_validate)
+
+    render_parser = subparsers.add_parser(
+        "render", parents=[chart_options, batch_options], help="render charts to wav"
+    )
+    render_parser.add_argument(
+        "-o", "--output", required=True, help="wav file, or folder for several charts"
+    )
+    render_parser.add_argument(
+        "--audio-dir", default=AUDIO_DIR, help="folder of the sample library"
+    )
+    render_parser.add_argument("--instrument", help="instrument of the sample library")
+    render_parser.add_argument(
+        "--sample-rate", type=int, help="sample rate of the output"
+    )
+    render_parser.set_defaults(handler=command_render)
+
+    play_parser = subparsers.add_parser(
+        "play", parents=[chart_options], help="play a chart and report its timing"
+    )
+    play_parser.add_argument("path", help="chart file")
+    play_parser.add_argument(
+        "--dry-run", action="store_true", help="only record the notes, emit nothing"
+    )
+    play_parser.add_argument(
+        "--virtual",
+        action="store_true",
+        help="dry run on a simulated clock, finishes at once",
+    )
+    play_parser.add_argument("--backend", default="keyboard", help="output backend")
+    play_range = play_parser.add_mutually_exclusive_group()
+    play_range.add_argument(
+        "--lines",
+        type=int,
+        nargs=2,
+        metavar=("FIRST", "LAST"),
+        help="chart lines to play",
+    )
+    play_range.add_argument(
+        "--watch",
+        action="store_true",
+        help="apply edits of the chart file while it plays",
+    )
+    play_parser.set_defaults(handler=command_play)
+
+    stream_parser = subparsers.add_parser(
+        "stream",
+        parents=[chart_options],
+        help="play chart lines as they are read, e.g. from a pipe",
+    )
+    stream_parser.add_argument(
+        "path", nargs="?", default="-", help="file or pipe to read, stdin by default"
+    )
+    stream_parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="seconds between a beat arriving and it being played",
+    )
+    stream_parser.add_argument(
+        "--max-ahead",
+        type=float,
+        default=30.0,
+        help="seconds of input to read ahead of the playback at most",
+    )
+    stream_parser.add_argument(
+        "--dry-run", action="store_true", help="only record the notes, emit nothing"
+    )
+    stream_parser.add_argument("--backend", default="keyboard", help="output backend")
+    stream_parser.set_defaults(handler=command_stream)
+
+    calibrate_parser = subparsers.add_parser(
+        "calibrate", help="measure the latency of output backends and save it"
+    )
+    calibrate_parser.add_argument(
+        "--backend",
+        action="append",
+        help="output backend to measure, may be repeated, keyboard by default",
+    )
+    calibrate_parser.add_argument(
+        "--trials", type=int, default=10, help="probes per backend, the median is used"
+    )
+    calibrate_parser.add_argument("--json", action="store_true", help="print JSON")
+    calibrate_parser.set_defaults(handler=command_calibrate)
+
+    import_parser = subparsers.add_parser(
+        "import", parents=[batch_options], help="convert MIDI files to charts"
+    )
+    import_parser.add_argument(
+        "-o",
+        "--output",
+        metavar="DIR",
+        help="write the charts to DIR, not next to the files",
+    )
+    import_parser.add_argument(
+        "--drums", action="store_true", help="keep the notes of the percussion channel"
+    )
+    import_parser.add_argument(
+        "--transpose",
+        type=int,
+        help="octaves to move the songs by, fits the keys by default",
+    )
+    import_parser.add_argument("--json", action="store_true", help="print JSON")
+    import_parser.set_defaults(handler=command_import)
+
+    daemon_parser = subparsers.add_parser(
+        "daemon", help="keep a player running, controlled over a local socket"
+    )
+    daemon_parser.add_argument(
+        "--socket", help="the socket to listen on, cache/player.sock by default"
+    )
+    daemon_parser.add_argument(
+        "--warm",
+        action="append",
+        default=[],
+        metavar="BACKEND",
+        help="output backend to load at start, may be repeated",
+    )
+    daemon_parser.add_argument("charts", nargs="*", help="charts to compile at start")
+    daemon_parser.set_defaults(handler=command_daemon)
+
+    remote_parser = subparsers.add_parser(
+        "remote", parents=[chart_options], help="send a command to the daemon"
+    )
+    remote_parser.add_argument(
+        "action", choices=("compile", "play", "stop", "seek", "status", "shutdown")
+    )
+    remote_parser.add_argument("path", nargs="?", help="chart file")
+    remote_parser.add_argument(
+        "--socket", help="the socket of the daemon, cache/player.sock by default"
+    )
+    remote_parser.add_argument(
+        "--backend",
+        action="append",
+        help="output backend to play on, may be repeated, keyboard by default",
+    )
+    remote_position = remote_parser.add_mutually_exclusive_group()
+    remote_position.add_argument(
+        "--time", type=float, help="start at a time in seconds"
+    )
+    remote_position.add_argument("--beat", type=int, help="start at a beat id")
+    remote_position.add_argument("--line", type=int, help="start at a chart line")
+    remote_parser.set_defaults(handler=command_remote)
+
+    # the options of bench are parsed by bench.cli, imported only when it is run
+    bench_parser = subparsers.add_parser(
+        "bench", add_help=False, help="run the benchmarks"
+    )
+    bench_parser.set_defaults(handler=command_bench)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args, extra_args = parser.parse_known_args(argv)
+    if args.command == "bench":
+        args.bench_args = extra_args
+    elif extra_args:
+        parser.error(f"unrecognized arguments: {' '.join(extra_args)}")
+    if args.trace:
+        tracing.start_tracing()
+    try:
+        return args.handler(args)
+    finally:
+        tracer = tracing.stop_tracing()
+        if tracer is not None:
+            tracer.write(args.trace)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
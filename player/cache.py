@@ -0,0 +1,214 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from chart.constants import NOTATION_INDEX_TABLE
+from chart.note import SingleNote
+from chart.parser import parse_chart
+from player.interal import InternalProperty
+from player.pattern import NoteContainer
+from player.runtime import BeatContainer, ChartRuntime
+from shared import tracing
+from shared.utils import CACHE_DIR
+
+CHART_CACHE_DIR = os.path.join(CACHE_DIR, "charts")
+
+CACHE_FORMAT_VERSION = 1  # bump when the layout or the compiler output changes
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024  # bytes
+
+# Layout, all little endian:
+#   header: magic, format version, beat count, note count
+#   beats:  beat_id, begin_time, first note index, note count, line number (-1 if unknown)
+#   notes:  play_time, duration, token index in NOTATION_INDEX_TABLE
+_MAGIC = b"GCPC"
+_HEADER = struct.Struct("<4sIII")
+_BEAT = struct.Struct("<IdIIi")
+_NOTE = struct.Struct("<ddB")
+
+_SHARED_NOTES = [SingleNote(token) for token in NOTATION_INDEX_TABLE]
+_TOKEN_INDEX = {token: index for index, token in enumerate(NOTATION_INDEX_TABLE)}
+
+
+def cache_key(chart_text: str, internal_property: InternalProperty) -> str:
+    """The content address of a compiled chart."""
+    digest = hashlib.sha256()
+    digest.update(
+        f"{CACHE_FORMAT_VERSION}|{internal_property.bpm!r}|{internal_property.time_signature}|".encode()
+    )
+    digest.update(chart_text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def compile_chart(
+    chart_text: str, internal_property: InternalProperty
+) -> list[BeatContainer]:
+    """Parse a chart and calculate its playlist."""
+    runtime = ChartRuntime(internal_property, parse_chart(chart_text))
+    runtime.caculate_playlist()
+    return runtime.get_playlist()
+
+
+def dump_playlist(playlist: list[BeatContainer]) -> bytes:
+    note_count = sum(len(beat.notes) for beat in playlist)
+    chunks = [_HEADER.pack(_MAGIC, CACHE_FORMAT_VERSION, len(playlist), note_count)]
+    note_index = 0
+    for beat in playlist:
+        chunks.append(
+            _BEAT.pack(
+                beat.beat_id,
+                beat.begin_time,
+                note_index,
+                len(beat.notes),
+                -1 if beat.line_number is None else beat.line_number,
+            )
+        )
+        note_index += len(beat.notes)
+    for beat in playlist:
+        for nc in beat.notes:
+            chunks.append(
+                _NOTE.pack(nc.play_time, nc.duration, _TOKEN_INDEX[nc.note.token])
+            )
+    return b"".join(chunks)
+
+
+def load_playlist(buffer: bytes | memoryview | mmap.mmap) -> list[BeatContainer]:
+    """Read a playlist written by dump_playlist, raises ValueError if it is not one."""
+    if len(buffer) < _HEADER.size:
+        raise ValueError("Truncated playlist cache")
+    magic, version, beat_count, note_count = _HEADER.unpack_from(buffer, 0)
+    if magic != _MAGIC or version != CACHE_FORMAT_VERSION:
+        raise ValueError("Unsupported playlist cache format")
+    notes_offset = _HEADER.size + beat_count * _BEAT.size
+    if len(buffer) != notes_offset + note_count * _NOTE.size:
+        raise ValueError("Truncated playlist cache")
+
+    notes = [
+        NoteContainer(_SHARED_NOTES[token_index], play_time, duration)
+        for play_time, duration, token_index in _NOTE.iter_unpack(
+            memoryview(buffer)[notes_offset:]
+        )
+    ]
+    playlist: list[BeatContainer] = []
+    for beat_id, begin_time, first, count, line_number in _BEAT.iter_unpack(
+        memoryview(buffer)[_HEADER.size : notes_offset]
+    ):
+        playlist.append(
+            BeatContainer(
+                beat_id,
+                notes[first : first + count],
+                begin_time,
+                None if line_number < 0 else line_number,
+            )
+        )
+    return playlist
+
+
+class ChartCache:
+    """
+    A content addressed on-disk cache of compiled playlists.
+
+    Entries are keyed by the chart text and the initial InternalProperty, so an
+    edited chart never hits a stale entry. Files are memory mapped when loaded,
+    and the least recently used ones are removed when the cache grows over
+    max_size.
+    Attributes:
+    cache_dir: The folder the entries are stored in.
+    max_size: The largest total size of the entries, in bytes.
+    hits: The number of lookups served from the cache.
+    misses: The number of lookups that compiled the chart.
+    """
+
+    cache_dir: str
+    max_size: int
+    hits: int
+    misses: int
+
+    def __init__(
+        self, cache_dir: str = CHART_CACHE_DIR, max_size: int = DEFAULT_CACHE_SIZE
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def path_of(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".gcpc")
+
+    def get(self, key: str) -> list[BeatContainer] | None:
+        path = self.path_of(key)
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    playlist = load_playlist(mm)
+            os.utime(path)  # marks the entry as recently used
+        except (OSError, ValueError):
+            return None
+        return playlist
+
+    def put(self, key: str, playlist: list[BeatContainer]) -> None:
+        path = self.path_of(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(dump_playlist(playlist))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def get_or_compile(
+        self, chart_text: str, internal_property: InternalProperty | None = None
+    ) -> list[BeatContainer]:
+        """Get the playlist of a chart, compiling and storing it on a miss."""
+        if internal_property is None:
+            internal_property = InternalProperty()
+        key = cache_key(chart_text, internal_property)
+        playlist = self.get(key)
+        if playlist is not None:
+            self.hits += 1
+            tracing.counter("cache_hits", self.hits)
+            return playlist
+        self.misses += 1
+        tracing.counter("cache_misses", self.misses)
+        playlist = compile_chart(chart_text, internal_property)
+        self.put(key, playlist)
+        return playlist
+
+    def entries(self) -> list[tuple[str, int, float]]:
+        """List (path, size, last use) of all entries."""
+        result: list[tuple[str, int, float]] = []
+        if not os.path.isdir(self.cache_dir):
+            return result
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".gcpc"):
+                    stat = entry.stat()
+                    result.append((entry.path, stat.st_size, stat.st_mtime))
+        return result
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache fits max_size."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        for path, size, _ in sorted(entries, key=lambda e: e[2]):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def clear(self) -> None:
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,123 @@
+import json
+import os
+import statistics
+import time
+
+from chart.note import SingleNote
+from player.handlers.base import OutputBackend
+from player.pattern import NoteContainer
+from shared.utils import CONFIG_DIR
+
+LATENCY_PROFILE_PATH = os.path.join(CONFIG_DIR, "latency.json")
+
+CALIBRATION_NOTE = NoteContainer(note=SingleNote("C4"), play_time=0.0, duration=0.1)
+
+
+class LatencyProfile:
+    """
+    The measured latency of every output backend on this machine.
+    Attributes:
+    offsets: The latency in seconds by registered backend name.
+    path: The file the profile is stored in.
+    """
+
+    offsets: dict[str, float]
+    path: str
+
+    def __init__(
+        self, offsets: dict[str, float] | None = None, path: str = LATENCY_PROFILE_PATH
+    ) -> None:
+        self.offsets = offsets if offsets is not None else {}
+        self.path = path
+
+    def get(self, backend: OutputBackend | str, default: float = 0.0) -> float:
+        name = backend if isinstance(backend, str) else backend._registered_name
+        return self.offsets.get(name, default)
+
+    def set(self, backend: OutputBackend | str, latency: float) -> None:
+        name = backend if isinstance(backend, str) else backend._registered_name
+        self.offsets[name] = latency
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"offsets": self.offsets}, f, indent=2)
+
+    @staticmethod
+    def load(path: str = LATENCY_PROFILE_PATH) -> "LatencyProfile":
+        """Load a profile, an empty one if the file is missing or broken."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            offsets = {str(k): float(v) for k, v in data["offsets"].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            offsets = {}
+        return LatencyProfile(offsets, path)
+
+
+_latency_profile: LatencyProfile | None = None
+
+
+def latency_profile() -> LatencyProfile:
+    """Get the latency profile of this machine, loaded once per session."""
+    global _latency_profile
+    if _latency_profile is None:
+        _latency_profile = LatencyProfile.load()
+    return _latency_profile
+
+
+def output_latency(backend: OutputBackend) -> float:
+    """Get the latency offset the player should use for a backend."""
+    if backend.latency is not None:
+        return backend.latency
+    return latency_profile().get(backend)
+
+
+def measure_latency(
+    backend: OutputBackend,
+    trials: int = 10,
+    interval: float = 0.2,
+    note_container: NoteContainer = CALIBRATION_NOTE,
+) -> float | None:
+    """
+    Measure the dispatch-to-effect latency of a backend.
+    Args:
+        backend: The backend to measure.
+        trials: The number of probes, the median is used.
+        interval: Pause between probes in seconds, so the effects don't overlap.
+        note_container: The note used for probing.
+    Returns:
+    The latency in seconds, None if the backend can't observe its own effect.
+    """
+    samples: list[float] = []
+    for index in range(trials):
+        if index:
+            time.sleep(interval)
+        sample = backend.probe(note_container)
+        if sample is not None:
+            samples.append(sample)
+    backend.close()
+    if not samples:
+        return None
+    return statistics.median(samples)
+
+
+def calibrate(
+    backends: list[OutputBackend],
+    trials: int = 10,
+    profile: LatencyProfile | None = None,
+) -> LatencyProfile:
+    """
+    Measure every backend and store the results in the profile. A backend whose
+    effect can't be observed gets no offset, it is played without compensation.
+    """
+    if profile is None:
+        profile = latency_profile()
+    for backend in backends:
+        latency = measure_latency(backend, trials)
+        if latency is not None:
+            profile.set(backend, latency)
+        else:
+            profile.offsets.pop(backend._registered_name, None)
+    profile.save()
+    return profile
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from abc import ABC, abstractmethod
+
+from player.utils import FlagBoolean, wait_until_or_cancel
+
+
+class Clock(ABC):
+    """
+    The time source of the player, in seconds.
+
+    Everything that reads the time or waits for it takes a clock, so the same
+    scheduling code runs in real time or on a VirtualClock.
+    Attributes:
+    virtual: Whether the clock jumps to deadlines instead of waiting for them.
+    """
+
+    virtual: bool = False
+
+    @abstractmethod
+    def now(self) -> float:
+        """The time since the epoch, comparable with the times of input events."""
+        pass
+
+    @abstractmethod
+    def perf_now(self) -> float:
+        """A high resolution monotonic time, to measure intervals; its origin is arbitrary."""
+        pass
+
+    @abstractmethod
+    def sleep_until(
+        self, target_time: float, cancel_flag: FlagBoolean | None = None
+    ) -> bool:
+        """
+        Wait until target_time, or until cancel_flag is set.
+        Returns True if the wait completed, False if it was canceled.
+        """
+        pass
+
+    @abstractmethod
+    def wait(self, condition: threading.Condition, timeout: float) -> bool:
+        """Wait on a condition the caller holds, for at most timeout seconds of this clock."""
+        pass
+
+
+class RealClock(Clock):
+    """The wall clock, time.time with real sleeps; intervals are measured on time.perf_counter."""
+
+    def now(self) -> float:
+        return time.time()
+
+    def perf_now(self) -> float:
+        return time.perf_counter()
+
+    def sleep_until(
+        self, target_time: float, cancel_flag: FlagBoolean | None = None
+    ) -> bool:
+        return wait_until_or_cancel(
+            target_time, cancel_flag if cancel_flag is not None else FlagBoolean()
+        )
+
+    def wait(self, condition: threading.Condition, timeout: float) -> bool:
+        return condition.wait(timeout)
+
+
+class VirtualClock(Clock):
+    """
+    A simulated clock that only moves when something waits for it.
+
+    Waiting for a deadline sets the clock to the deadline at once, so a chart is
+    played as fast as the code runs and always with the same timestamps. Meant
+    to be driven from a single thread, see PlayerThreadingPool.run.
+    Attributes:
+    current_time: The current simulated time.
+    """
+
+    virtual = True
+    current_time: float
+
+    def __init__(self, start_time: float = 0.0) -> None:
+        self.current_time = start_time
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        return self.current_time
+
+    def perf_now(self) -> float:
+        return self.current_time
+
+    def advance_to(self, target_time: float) -> None:
+        """Move the clock forward to target_time, never backwards."""
+        with self._lock:
+            if target_time > self.current_time:
+                self.current_time = target_time
+
+    def advance(self, seconds: float) -> None:
+        self.advance_to(self.current_time + seconds)
+
+    def sleep_until(
+        self, target_time: float, cancel_flag: FlagBoolean | None = None
+    ) -> bool:
+        if cancel_flag is not None and cancel_flag.get():
+            return False
+        self.advance_to(target_time)
+        return True
+
+    def wait(self, condition: threading.Condition, timeout: float) -> bool:
+        # nothing else runs on simulated time, so nobody could notify us before the timeout
+        self.advance(timeout)
+        return False
+
+
+real_clock = RealClock()  # the clock used when none is given
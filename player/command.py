@@ -1,4 +1,5 @@
 from player.interal import InternalProperty
+from shared import tracing
 from abc import ABC, abstractmethod
 
 
@@ -54,16 +55,23 @@ class CommandRegistry:
         return cls._commands.get(name, None)
 
     def execute_command(
-        self, name: str, args: list[str], internal_property: InternalProperty
+        self,
+        name: str,
+        args: list[str],
+        internal_property: InternalProperty,
+        line_number: int = -1,
     ) -> None:
-        command_cls = self.get_command_class(name)
-        if command_cls is None:
-            raise CommandParseError(f"Unknown command: {name}", -1)
-        command_instance = command_cls(internal_property)
-        command_instance.pass_args(args)
-        if not command_instance.check_valid():
-            raise CommandParseError(f"Invalid arguments for command: {name}", -1)
-        command_instance.execute()
+        with tracing.span("execute_command", "compile", command=name):
+            command_cls = self.get_command_class(name)
+            if command_cls is None:
+                raise CommandParseError(f"Unknown command: {name}", line_number)
+            command_instance = command_cls(internal_property)
+            command_instance.pass_args(args)
+            if not command_instance.check_valid():
+                raise CommandParseError(
+                    f"Invalid arguments for command: {name}", line_number
+                )
+            command_instance.execute()
 
 
 class CMD_Set(Command):
@@ -0,0 +1,446 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Any, Callable
+
+from player.cache import ChartCache, cache_key
+from player.calibration import output_latency
+from player.clock import Clock, real_clock
+from player.handlers.base import OutputBackend, backend_registry
+from player.interal import InternalProperty
+from player.live import RELOAD_ERRORS
+from player.runtime import BeatContainer, DensityProfile, PlayerThreadingPool
+from player.sections import BeatRangeIndex
+from shared import tracing
+from shared.utils import CACHE_DIR
+
+DAEMON_SOCKET_PATH = os.path.join(CACHE_DIR, "player.sock")
+
+DAEMON_START_DELAY = 0.005  # seconds from a play request to the first beat
+DAEMON_MAX_CHARTS = 32  # compiled charts kept in memory
+DAEMON_TIMEOUT = 5.0  # seconds a client waits for an answer
+DAEMON_BACKLOG = 64  # connections waiting to be accepted
+
+# Protocol: one JSON object per line in both directions, a connection may send
+# any number of requests and gets the answers in order.
+#   request:  {"command": "play", "path": "/abs/chart.txt", "time": 12.5, ...}
+#   answer:   {"ok": true, ...} or {"ok": false, "error": "..."}
+REQUEST_ERRORS = (*RELOAD_ERRORS, KeyError, TypeError)
+
+
+class DaemonError(Exception):
+    def __init__(self, message: str, command: str | None) -> None:
+        super().__init__(message)
+        self.command = command  # the command of the failed request
+
+
+class CompiledChart:
+    """
+    A chart compiled by the daemon, ready to be played.
+    Attributes:
+    path: The chart file.
+    key: The content address of the chart text and initial properties.
+    stat: The (mtime, size) of the file when it was read.
+    playlist: The compiled playlist.
+    density_profile: The note density of the playlist.
+    index: Finds the beat to start from by time, beat id or line.
+    duration: When the last note ends, in seconds.
+    """
+
+    path: str
+    key: str
+    stat: tuple[float, int]
+    playlist: list[BeatContainer]
+    density_profile: DensityProfile
+    index: BeatRangeIndex
+    duration: float
+
+    def __init__(
+        self,
+        path: str,
+        key: str,
+        stat: tuple[float, int],
+        playlist: list[BeatContainer],
+    ) -> None:
+        self.path = path
+        self.key = key
+        self.stat = stat
+        self.playlist = playlist
+        self.density_profile = DensityProfile(playlist)
+        self.index = BeatRangeIndex(playlist)
+        self.duration = max(
+            (nc.play_time + nc.duration for beat in playlist for nc in beat.notes),
+            default=0.0,
+        )
+
+    def start_index(self, request: dict[str, Any]) -> int:
+        """The playlist index a request starts from: its time, beat or line, else 0."""
+        if not self.playlist:
+            raise ValueError(f"{self.path} has no beats")
+        if request.get("time") is not None:
+            time_point = float(request["time"])
+            return self.index.by_time(time_point, time_point + 1e-9)[0]
+        if request.get("beat") is not None:
+            beat_id = int(request["beat"])
+            return self.index.by_beat_ids(beat_id, beat_id)[0]
+        if request.get("line") is not None:
+            line = int(request["line"])
+            return self.index.by_lines(line, line)[0]
+        return 0
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "path": self.path,
+            "beats": len(self.playlist),
+            "notes": sum(len(beat.notes) for beat in self.playlist),
+            "duration": self.duration,
+        }
+
+
+class _DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True  # a client left connected doesn't keep the daemon alive
+    block_on_close = False
+    request_queue_size = DAEMON_BACKLOG
+
+
+class PlayerDaemon:
+    """
+    A long-lived player controlled over a Unix domain socket.
+
+    Compiled charts stay in memory, keyed by file, until the file changes; a
+    changed file is looked up in the on-disk ChartCache before it is compiled
+    again. Output backends are created once, with their calibrated latency, and
+    prefetch the notes of every chart compiled, so their samples are loaded
+    before the first play. A play request then only stages the first beat, which
+    starts DAEMON_START_DELAY after the request.
+
+    Every client connection is served on its own thread. One chart plays at a
+    time, a play or seek request replaces the current playback and stops its
+    pool, so the threads of the daemon stay the same after a stop.
+    Attributes:
+    socket_path: The socket the daemon listens on.
+    charts: The compiled charts by (path, bpm, time signature), least recently used first.
+    backends: The created output backends by name.
+    pool: The pool of the current playback, None when stopped.
+    chart: The chart of the current playback.
+    clock: The clock playback is timed on.
+    start_delay: Seconds from a play request to the first beat.
+    """
+
+    socket_path: str
+    charts: "OrderedDict[tuple[str, float, int], CompiledChart]"
+    backends: dict[str, OutputBackend]
+    pool: PlayerThreadingPool | None
+    chart: CompiledChart | None
+    clock: Clock
+    start_delay: float
+
+    def __init__(
+        self,
+        socket_path: str = DAEMON_SOCKET_PATH,
+        cache: ChartCache | None = None,
+        clock: Clock = real_clock,
+        start_delay: float = DAEMON_START_DELAY,
+        max_charts: int = DAEMON_MAX_CHARTS,
+    ) -> None:
+        self.socket_path = socket_path
+        self.cache = cache if cache is not None else ChartCache()
+        self.clock = clock
+        self.start_delay = start_delay
+        self.max_charts = max_charts
+        self.charts = OrderedDict()
+        self.backends = {}
+        self.latencies: dict[str, float] = {}
+        self.pool = None
+        self.chart = None
+        self.server: _DaemonServer | None = None
+        self._charts_lock = threading.Lock()
+        self._play_lock = threading.Lock()  # held while the playback changes
+        self.commands: dict[str, Callable[[dict[str, Any]], dict[str, Any]]] = {
+            "ping": self.command_ping,
+            "compile": self.command_compile,
+            "play": self.command_play,
+            "stop": self.command_stop,
+            "seek": self.command_seek,
+            "status": self.command_status,
+            "shutdown": self.command_shutdown,
+        }
+
+    def get_backend(self, name: str) -> OutputBackend:
+        """The backend called name, created and calibrated on first use."""
+        with self._charts_lock:
+            backend = self.backends.get(name)
+            if backend is None:
+                if not backend_registry.is_available(name):
+                    raise ValueError(f"Output backend {name} is not available")
+                backend = backend_registry.create_backend(name)
+                self.latencies[name] = output_latency(backend)
+                self.backends[name] = backend
+                for chart in self.charts.values():
+                    self._prefetch(backend, chart)
+            return backend
+
+    @staticmethod
+    def _prefetch(backend: OutputBackend, chart: CompiledChart) -> None:
+        # one note per token is enough to load its sample
+        first_notes = {
+            nc.note.token: nc for beat in chart.playlist for nc in beat.notes
+        }
+        backend.prefetch(list(first_notes.values()))
+
+    def get_chart(
+        self, path: str, bpm: float = 120.0, time_signature: int = 4
+    ) -> tuple[CompiledChart, bool]:
+        """
+        The compiled chart of a file, compiled again only if the file changed.
+        Returns:
+        The chart and whether it was already in memory.
+        """
+        path = os.path.abspath(path)
+        entry = (path, bpm, time_signature)
+        stat_result = os.stat(path)
+        stat = (stat_result.st_mtime, stat_result.st_size)
+        with self._charts_lock:
+            chart = self.charts.get(entry)
+            if chart is not None and chart.stat == stat:
+                self.charts.move_to_end(entry)
+                return chart, True
+
+        with open(path, "r", encoding="utf-8") as f:
+            chart_text = f.read()
+        internal_property = InternalProperty(bpm, time_signature)  # type: ignore
+        key = cache_key(chart_text, internal_property)
+        if chart is not None and chart.key == key:
+            chart.stat = stat  # touched, not changed
+            return chart, True
+        with tracing.span("daemon_compile", "daemon", path=path):
+            playlist = self.cache.get_or_compile(chart_text, internal_property)
+        chart = CompiledChart(path, key, stat, playlist)
+        with self._charts_lock:
+            self.charts[entry] = chart
+            self.charts.move_to_end(entry)
+            while len(self.charts) > self.max_charts:
+                self.charts.popitem(last=False)
+            backends = list(self.backends.values())
+        for backend in backends:
+            self._prefetch(backend, chart)
+        return chart, False
+
+    def _request_chart(self, request: dict[str, Any]) -> tuple[CompiledChart, bool]:
+        if not isinstance(request.get("path"), str):
+            raise ValueError("The request needs the path of a chart")
+        return self.get_chart(
+            request["path"], float(request.get("bpm", 120.0)), int(request.get("ts", 4))
+        )
+
+    def _start(
+        self,
+        chart: CompiledChart,
+        index: int,
+        outputs: list[OutputBackend],
+        latencies: list[float],
+    ) -> PlayerThreadingPool:
+        # the caller holds _play_lock; stopping the replaced pool also ends its
+        # dispatch threads, so seeking doesn't pile up threads
+        if self.pool is not None:
+            self.pool.stop()
+        pool = PlayerThreadingPool(
+            chart.playlist,
+            outputs,
+            latencies=latencies,
+            density_profile=chart.density_profile,
+            clock=self.clock,
+        )
+        pool.START_DELAY = self.start_delay
+        pool.current_beat_index = index
+        pool.play()
+        self.pool = pool
+        self.chart = chart
+        return pool
+
+    def _playback(self, pool: PlayerThreadingPool, index: int) -> dict[str, Any]:
+        beat = pool.beats[index]
+        return {
+            "beat": beat.beat_id,
+            "line": beat.line_number,
+            "time": beat.begin_time,
+            "first_note_in": pool.begin_time + beat.begin_time - self.clock.now(),
+        }
+
+    def command_ping(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"pid": os.getpid()}
+
+    def command_compile(self, request: dict[str, Any]) -> dict[str, Any]:
+        chart, cached = self._request_chart(request)
+        return {**chart.summary(), "cached": cached}
+
+    def command_play(self, request: dict[str, Any]) -> dict[str, Any]:
+        chart, cached = self._request_chart(request)
+        index = chart.start_index(request)
+        backend_names = request.get("backends")
+        if backend_names is None:
+            backend_names = [request.get("backend", "keyboard")]
+        if (
+            not isinstance(backend_names, list)
+            or not backend_names
+            or not all(isinstance(name, str) for name in backend_names)
+        ):
+            raise ValueError("backends must be a non-empty list of backend names")
+        outputs = [self.get_backend(name) for name in backend_names]
+        latencies = [self.latencies[name] for name in backend_names]
+        with self._play_lock:
+            pool = self._start(chart, index, outputs, latencies)
+            return {**self._playback(pool, index), "cached": cached}
+
+    def command_stop(self, request: dict[str, Any]) -> dict[str, Any]:
+        with self._play_lock:
+            was_playing = self.pool is not None
+            if self.pool is not None:
+                self.pool.stop()
+            self.pool = None
+            self.chart = None
+        return {"stopped": was_playing}
+
+    def command_seek(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Continue the current playback from another time, beat or line."""
+        with self._play_lock:
+            if self.pool is None or self.chart is None:
+                raise ValueError("Nothing is playing")
+            chart = self.chart
+            index = chart.start_index(request)
+            pool = self._start(chart, index, self.pool.outputs, self.pool.latencies)
+            return self._playback(pool, index)
+
+    def command_status(self, request: dict[str, Any]) -> dict[str, Any]:
+        with self._play_lock:
+            pool, chart = self.pool, self.chart
+            status: dict[str, Any] = {"playing": False}
+            if pool is not None and chart is not None:
+                position = self.clock.now() - pool.begin_time
+                status.update(
+                    playing=position <= chart.duration,
+                    path=chart.path,
+                    position=position,
+                    staged=pool.current_beat_index,
+                )
+        with self._charts_lock:
+            status["charts"] = [chart.path for chart in self.charts.values()]
+            status["backends"] = list(self.backends)
+        status["cache_hits"] = self.cache.hits
+        status["cache_misses"] = self.cache.misses
+        return status
+
+    def command_shutdown(self, request: dict[str, Any]) -> dict[str, Any]:
+        self.command_stop(request)
+        if self.server is not None:
+            # shutdown waits for serve_forever, which runs on another thread
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        return {}
+
+    def handle(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Answer a request, errors are returned instead of raised."""
+        command = request.get("command")
+        function = self.commands.get(command)  # type: ignore
+        if function is None:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        try:
+            with tracing.span(command, "daemon"):  # type: ignore
+                return {"ok": True, **function(request)}
+        except REQUEST_ERRORS as e:
+            return {"ok": False, "error": str(e)}
+
+    def warm(self, backend_names: list[str], paths: list[str]) -> None:
+        """Create backends and compile charts before the first request."""
+        for name in backend_names:
+            self.get_backend(name)
+        for path in paths:
+            self.get_chart(path)
+
+    def serve(self) -> None:
+        """Listen on socket_path until a shutdown request, replaces a stale socket."""
+        if os.path.exists(self.socket_path):
+            if is_running(self.socket_path):
+                raise DaemonError(
+                    f"A daemon already listens on {self.socket_path}", None
+                )
+            os.remove(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+
+        daemon = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                        if not isinstance(request, dict):
+                            raise ValueError("A request must be a JSON object")
+                    except ValueError as e:
+                        answer = {"ok": False, "error": f"Invalid request: {e}"}
+                    else:
+                        answer = daemon.handle(request)
+                    self.wfile.write(json.dumps(answer).encode() + b"\n")
+                    self.wfile.flush()
+
+        server = _DaemonServer(self.socket_path, RequestHandler)
+        os.chmod(self.socket_path, 0o600)  # only the user may play
+        self.server = server
+        try:
+            server.serve_forever()
+        finally:
+            self.server = None
+            server.server_close()
+            with self._play_lock:
+                if self.pool is not None:
+                    self.pool.stop()
+                self.pool = None
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+
+def send_request(
+    request: dict[str, Any],
+    socket_path: str = DAEMON_SOCKET_PATH,
+    timeout: float = DAEMON_TIMEOUT,
+) -> dict[str, Any]:
+    """
+    Send one request to a daemon and wait for its answer.
+    Raises OSError if no daemon listens on socket_path.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b"\n")
+        with client.makefile("rb") as answers:
+            answer = answers.readline()
+    if not answer:
+        raise DaemonError("The daemon closed the connection", request.get("command"))
+    return json.loads(answer)
+
+
+def is_running(socket_path: str = DAEMON_SOCKET_PATH) -> bool:
+    try:
+        return send_request({"command": "ping"}, socket_path, timeout=1.0)["ok"]
+    except (OSError, ValueError, DaemonError):
+        return False
+
+
+def wait_until_running(
+    socket_path: str = DAEMON_SOCKET_PATH, timeout: float = DAEMON_TIMEOUT
+) -> bool:
+    """Wait for a daemon that is starting, returns whether it answers."""
+    deadline = time.monotonic() + timeout
+    while not is_running(socket_path):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
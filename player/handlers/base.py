@@ -0,0 +1,420 @@
+import heapq
+import importlib
+import itertools
+import sys
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from typing import Any, Callable
+
+from player.clock import Clock, real_clock
+from player.pattern import NoteContainer
+from player.utils import FlagBoolean
+from shared.lazy import is_installed
+
+
+class EventDispatcher:
+    """
+    Runs callbacks at given times from a small pool of threads.
+
+    Events are kept in a heap ordered by fire time; events with the same fire time
+    are taken in the order they were scheduled. One thread is started on first
+    use; set_workers adds threads so a slow callback in a dense passage doesn't
+    hold back the next events, or retires them again. On a virtual clock no
+    thread is started, the owner runs the events with run_due instead. An
+    exception raised by a callback is counted and printed to stderr, the thread
+    goes on with the next event. close drops the pending events and ends the
+    threads, scheduling again starts new ones.
+    Attributes:
+    clock: The clock the fire times are read on.
+    errors: The number of callbacks that raised an exception.
+    """
+
+    clock: Clock
+    errors: int
+
+    def __init__(self, clock: Clock = real_clock) -> None:
+        self.clock = clock
+        # (fire_time, order, callback, args, cancel_flag)
+        self._events: list[
+            tuple[float, int, Callable[..., None], tuple[Any, ...], FlagBoolean | None]
+        ] = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._threads: list[threading.Thread] = []
+        self._workers = 1
+        self._closed = False
+        self.errors = 0
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def set_workers(self, workers: int) -> None:
+        """Change the number of dispatch threads, at least one."""
+        with self._condition:
+            self._workers = max(1, workers)
+            if self._threads and not self.clock.virtual:
+                self._start_threads()
+            self._condition.notify_all()
+
+    def _start_threads(self) -> None:
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def schedule(
+        self,
+        fire_time: float,
+        callback: Callable[..., None],
+        *args: Any,
+        cancel_flag: FlagBoolean | None = None,
+    ) -> None:
+        """Run callback(*args) at fire_time, unless cancel_flag is set by then."""
+        with self._condition:
+            heapq.heappush(
+                self._events,
+                (fire_time, next(self._counter), callback, args, cancel_flag),
+            )
+            self._closed = False
+            if not self._threads and not self.clock.virtual:
+                self._start_threads()
+            self._condition.notify()
+
+    def pending(self) -> int:
+        return len(self._events)
+
+    def next_fire_time(self) -> float | None:
+        with self._condition:
+            return self._events[0][0] if self._events else None
+
+    def run_due(self) -> int:
+        """Run every event that is due on the clock in the calling thread, returns their number."""
+        count = 0
+        while True:
+            with self._condition:
+                if not self._events or self._events[0][0] > self.clock.now():
+                    return count
+                _, _, callback, args, cancel_flag = heapq.heappop(self._events)
+            if cancel_flag is None or not cancel_flag.get():
+                self._run(callback, args)
+                count += 1
+
+    def _dispatch_loop(self) -> None:
+        current = threading.current_thread()
+        while True:
+            with self._condition:
+                if self._closed or len(self._threads) > self._workers:
+                    self._threads.remove(current)
+                    return
+                if not self._events:
+                    self._condition.wait()
+                    continue
+                fire_time = self._events[0][0]
+                remaining = fire_time - self.clock.now()
+                if remaining > 0.02:
+                    # wake up early for new earlier events, then finish the wait precisely
+                    self._condition.wait(remaining - 0.01)
+                    continue
+                if remaining > 0:
+                    event = None
+                else:
+                    event = heapq.heappop(self._events)
+            if event is None:
+                time.sleep(min(remaining / 2, 0.001))
+                continue
+            _, _, callback, args, cancel_flag = event
+            if cancel_flag is not None and cancel_flag.get():
+                continue
+            self._run(callback, args)
+
+    def _run(self, callback: Callable[..., None], args: tuple[Any, ...]) -> None:
+        try:
+            callback(*args)
+        except Exception as e:
+            # one failing output must not end the thread serving every output
+            self.report_error(getattr(callback, "__qualname__", repr(callback)), e)
+
+    def report_error(self, source: str, error: Exception) -> None:
+        """Count and print an exception raised while firing, without raising it."""
+        with self._condition:
+            self.errors += 1
+        print(f"{source} failed: {error!r}", file=sys.stderr)
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Drop the pending events and end the dispatch threads, waiting up to timeout for them."""
+        with self._condition:
+            self._events.clear()
+            self._closed = True
+            threads = list(self._threads)
+            self._condition.notify_all()
+        current = threading.current_thread()
+        for thread in threads:
+            if thread is not current:
+                thread.join(timeout)
+
+    def is_running(self) -> bool:
+        """Whether a dispatch thread is alive to fire the pending events."""
+        with self._condition:
+            return any(thread.is_alive() for thread in self._threads)
+
+
+class OutputBackend(ABC):
+    """
+    An abstract base class for outputs the player sends notes to.
+
+    A backend only has to implement fire, which emits a group of notes sharing a
+    play time right away. The default dispatch schedules every group of a beat on
+    the backend's EventDispatcher, so one thread serves the whole playback.
+    """
+
+    _registered_name: str = ""
+    latency: float | None  # seconds from fire to effect, None to use the calibrated one
+
+    def __init__(self) -> None:
+        self.dispatcher = EventDispatcher()
+        self.latency = None
+
+    @classmethod
+    @abstractmethod
+    def name(cls) -> str:
+        """The display name of the backend."""
+        pass
+
+    @classmethod
+    def available(cls) -> bool:
+        """Check whether the backend can be used on this machine."""
+        return True
+
+    def prefetch(self, note_containers: list[NoteContainer]) -> None:
+        """Prepare the notes of a beat that is about to be played."""
+        pass
+
+    @abstractmethod
+    def fire(self, note_containers: list[NoteContainer], begin_time: float) -> None:
+        """
+        Emit notes that share a play time, now.
+        Args:
+            note_containers: The notes to emit.
+            begin_time: The begin time of the playback, play_time + begin_time is the intended time.
+        """
+        pass
+
+    def probe(self, note_container: NoteContainer) -> float | None:
+        """
+        Fire a note and measure the time until it takes effect, in seconds.
+        Returns None if the effect can't be observed. By default only the time
+        spent in fire is measured.
+        """
+        start = time.perf_counter()
+        self.fire([note_container], time.time() - note_container.play_time)
+        return time.perf_counter() - start
+
+    def dispatch(
+        self,
+        note_containers: list[NoteContainer],
+        cancel_flag: FlagBoolean,
+        begin_time: float,
+    ) -> None:
+        """Schedule the notes of a beat, returns immediately."""
+        for play_time, group in group_by_play_time(note_containers).items():
+            self.dispatcher.schedule(
+                play_time + begin_time,
+                self.fire,
+                group,
+                begin_time,
+                cancel_flag=cancel_flag,
+            )
+
+    def close(self) -> None:
+        """Release everything the backend holds, e.g. pressed keys."""
+        pass
+
+
+class FunctionBackend(OutputBackend):
+    """
+    Wraps a function playing a single note, as used by the handler modules.
+
+    The function is run on its own thread for every note, like the player always
+    did for handlers.
+    Attributes:
+    handler: The wrapped function, called with (note_container, cancel_flag, begin_time).
+    """
+
+    _registered_name = "function"
+    handler: Callable[[NoteContainer, FlagBoolean, float], None]
+
+    def __init__(
+        self, handler: Callable[[NoteContainer, FlagBoolean, float], None]
+    ) -> None:
+        super().__init__()
+        self.handler = handler
+        self.cancel_flag = FlagBoolean(False)
+
+    @classmethod
+    def name(cls) -> str:
+        return "函数"
+
+    def fire(self, note_containers: list[NoteContainer], begin_time: float) -> None:
+        for nc in note_containers:
+            threading.Thread(
+                target=self.handler, args=(nc, self.cancel_flag, begin_time)
+            ).start()
+
+    def dispatch(
+        self,
+        note_containers: list[NoteContainer],
+        cancel_flag: FlagBoolean,
+        begin_time: float,
+    ) -> None:
+        # the handler waits for the play time by itself
+        for nc in note_containers:
+            threading.Thread(
+                target=self.handler, args=(nc, cancel_flag, begin_time)
+            ).start()
+
+    def close(self) -> None:
+        # notes already handed to the function wait on the old flag
+        self.cancel_flag.modify(True)
+        self.cancel_flag = FlagBoolean(False)
+
+
+def group_by_play_time(
+    note_containers: list[NoteContainer],
+) -> dict[float, list[NoteContainer]]:
+    groups: dict[float, list[NoteContainer]] = {}
+    for nc in note_containers:
+        groups.setdefault(nc.play_time, []).append(nc)
+    return groups
+
+
+class BackendInfo:
+    """
+    What the registry knows about a backend without importing it.
+    Attributes:
+    name: The registered name of the backend.
+    module: The module defining the backend, imported on first use.
+    display_name: The name shown to the user.
+    requires: The third party modules the backend needs.
+    """
+
+    name: str
+    module: str
+    display_name: str
+    requires: tuple[str, ...]
+
+    def __init__(
+        self,
+        name: str,
+        module: str,
+        display_name: str,
+        requires: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.module = module
+        self.display_name = display_name
+        self.requires = requires
+
+    def __repr__(self) -> str:
+        return f"BackendInfo(name={self.name!r}, module={self.module!r})"
+
+
+class BackendRegistry:
+    """
+    The output backends known to the player.
+
+    Backends are described by a BackendInfo, their module is imported the first
+    time the backend class is needed. Whether a backend is available is checked
+    once per session; a backend whose required modules aren't installed is
+    reported unavailable without importing anything.
+    """
+
+    _backends: dict[str, type[OutputBackend]] = {}
+    _infos: dict[str, BackendInfo] = {}
+    _probes: dict[str, bool] = {}
+    BUILTIN_BACKENDS: tuple[BackendInfo, ...] = (
+        BackendInfo(
+            "keyboard", "player.handlers.keyboard_h", "键盘输入", ("keyboard",)
+        ),
+        BackendInfo(
+            "sound", "player.handlers.sound_h", "音频播放", ("playsound", "numpy")
+        ),
+        BackendInfo("recording", "player.handlers.recording_h", "记录"),
+    )
+
+    @classmethod
+    def register_backend(cls, name: str, backend_cls: type[OutputBackend]) -> None:
+        cls._backends[name] = backend_cls
+        if name not in cls._infos:
+            cls._infos[name] = BackendInfo(
+                name, backend_cls.__module__, backend_cls.name()
+            )
+
+    @classmethod
+    def register_backend_info(cls, info: BackendInfo) -> None:
+        """Make a backend known without importing its module."""
+        cls._infos[info.name] = info
+
+    @classmethod
+    def get_backend_info(cls, name: str) -> BackendInfo | None:
+        return cls._infos.get(name, None)
+
+    @classmethod
+    def get_backend_class(cls, name: str) -> type[OutputBackend] | None:
+        backend_cls = cls._backends.get(name, None)
+        if backend_cls is None and name in cls._infos:
+            try:
+                importlib.import_module(cls._infos[name].module)  # registers it
+            except ImportError:
+                return None
+            backend_cls = cls._backends.get(name, None)
+        return backend_cls
+
+    @classmethod
+    def load_builtin_backends(cls) -> None:
+        """Import the built-in backends, skipping those whose dependencies are missing."""
+        for info in cls.BUILTIN_BACKENDS:
+            cls.get_backend_class(info.name)
+
+    @classmethod
+    def clear_probes(cls) -> None:
+        """Forget the availability checks, e.g. after a device was plugged in."""
+        cls._probes.clear()
+
+    def names(self) -> list[str]:
+        return list(dict.fromkeys([*self._infos, *self._backends]))
+
+    def display_name(self, name: str) -> str:
+        info = self.get_backend_info(name)
+        return info.display_name if info is not None else name
+
+    def is_available(self, name: str) -> bool:
+        probe = self._probes.get(name)
+        if probe is None:
+            info = self.get_backend_info(name)
+            if info is not None and not all(map(is_installed, info.requires)):
+                probe = False
+            else:
+                backend_cls = self.get_backend_class(name)
+                probe = backend_cls is not None and backend_cls.available()
+            self._probes[name] = probe
+        return probe
+
+    def available_names(self) -> list[str]:
+        return [name for name in self.names() if self.is_available(name)]
+
+    def create_backend(self, name: str) -> OutputBackend:
+        backend_cls = self.get_backend_class(name)
+        if backend_cls is None:
+            raise KeyError(f"Unknown output backend: {name}")
+        return backend_cls()
+
+
+for _info in BackendRegistry.BUILTIN_BACKENDS:
+    BackendRegistry.register_backend_info(_info)
+
+default_backend_registry = BackendRegistry()
+
+backend_registry = default_backend_registry  # exported registry instance
@@ -1,7 +1,172 @@
-import keyboard
+import itertools
+import threading
+import time
 
+from player.handlers.base import OutputBackend, backend_registry, group_by_play_time
 from player.pattern import NoteContainer
 from player.utils import FlagBoolean, wait_until_or_cancel
+from shared.lazy import lazy_import
+
+keyboard = lazy_import("keyboard")  # imported when the first key is sent
+
+
+class KeyboardBackend(OutputBackend):
+    """
+    Sends notes as simulated key presses.
+
+    Notes sharing a play time are pressed and released together with a single
+    keyboard call, and all key events are sent from the dispatcher thread. Chords
+    therefore always register together, in a fixed order.
+    Attributes:
+    hold: Whether keys are held for the duration of the note (including continuous notes), instead of tapped.
+    HOLD_RELEASE_GAP: Time in seconds a held key is released before the note ends, so repeated notes can be pressed again.
+    """
+
+    _registered_name = "keyboard"
+    hold: bool
+    HOLD_RELEASE_GAP: float = 0.02
+
+    def __init__(self, hold: bool = False) -> None:
+        super().__init__()
+        self.hold = hold
+        self._counter = itertools.count()
+        self._held: dict[str, int] = {}  # key -> sequence of the press holding it
+        self._lock = threading.Lock()
+
+    @classmethod
+    def name(cls) -> str:
+        return name()
+
+    @classmethod
+    def available(cls) -> bool:
+        return available()
+
+    def dispatch(
+        self,
+        note_containers: list[NoteContainer],
+        cancel_flag: FlagBoolean,
+        begin_time: float,
+    ) -> None:
+        for play_time, group in group_by_play_time(note_containers).items():
+            keys = self._keys_of(group)
+            if not keys:
+                continue
+            sequence = next(self._counter)
+            self.dispatcher.schedule(
+                play_time + begin_time,
+                self._press,
+                keys,
+                sequence,
+                cancel_flag=cancel_flag,
+            )
+            if self.hold:
+                # releases are never cancelled, so stopping never leaves keys down
+                self.dispatcher.schedule(
+                    self._release_time(group, begin_time),
+                    self._release,
+                    keys,
+                    sequence,
+                )
+
+    def fire(self, note_containers: list[NoteContainer], begin_time: float) -> None:
+        keys = self._keys_of(note_containers)
+        if not keys:
+            return
+        sequence = next(self._counter)
+        self._press(keys, sequence)
+        if self.hold:
+            self.dispatcher.schedule(
+                self._release_time(note_containers, begin_time),
+                self._release,
+                keys,
+                sequence,
+            )
+
+    def probe(self, note_container: NoteContainer) -> float | None:
+        """
+        Loopback test: press the key of the note and wait for the input hook to
+        report it. Focus a harmless window while calibrating.
+        """
+        keys = self._keys_of([note_container])
+        if not keys:
+            return None
+        seen = threading.Event()
+        seen_at = [0.0]
+
+        def on_key(event: "keyboard.KeyboardEvent") -> None:
+            if event.event_type == keyboard.KEY_DOWN and event.name == keys[0]:
+                seen_at[0] = time.perf_counter()
+                seen.set()
+
+        try:
+            hook = keyboard.hook(on_key)
+        except Exception:
+            return None  # no input hook on this machine
+        try:
+            start = time.perf_counter()
+            keyboard.send(keys[0])
+            if not seen.wait(1.0):
+                return None
+            return seen_at[0] - start
+        finally:
+            keyboard.unhook(hook)
+
+    def close(self) -> None:
+        with self._lock:
+            held = list(self._held)
+            self._held.clear()
+        if held:
+            keyboard.release("+".join(held))
+
+    def _release_time(
+        self, note_containers: list[NoteContainer], begin_time: float
+    ) -> float:
+        duration = max(nc.duration for nc in note_containers)
+        return (
+            note_containers[0].play_time
+            + begin_time
+            + max(duration - self.HOLD_RELEASE_GAP, 0.0)
+        )
+
+    @staticmethod
+    def _keys_of(note_containers: list[NoteContainer]) -> tuple[str, ...]:
+        return tuple(
+            dict.fromkeys(
+                nc.note.keyboard.lower()
+                for nc in note_containers
+                if nc.note.keyboard is not None
+            )
+        )
+
+    def _press(self, keys: tuple[str, ...], sequence: int) -> None:
+        with self._lock:
+            held = [key for key in keys if key in self._held]
+            for key in held:
+                del self._held[key]
+            if self.hold:
+                for key in keys:
+                    self._held[key] = sequence
+        if held:
+            # a held key is pressed again before its release
+            keyboard.release("+".join(held))
+        if self.hold:
+            keyboard.press("+".join(keys))
+        else:
+            keyboard.send("+".join(keys))
+
+    def _release(self, keys: tuple[str, ...], sequence: int) -> None:
+        # only release the keys that are still held by this press
+        with self._lock:
+            owned = [key for key in keys if self._held.get(key) == sequence]
+            for key in owned:
+                del self._held[key]
+        if owned:
+            keyboard.release("+".join(owned))
+
+
+backend_registry.register_backend(KeyboardBackend._registered_name, KeyboardBackend)
+
+keyboard_backend = KeyboardBackend()
 
 
 def handler(
@@ -14,12 +179,30 @@ def handler(
             keyboard.press_and_release(kb)
 
 
+def batch_handler(
+    note_containers: list[NoteContainer], cancel_flag: FlagBoolean, begin_time: float
+) -> None:
+    keyboard_backend.dispatch(note_containers, cancel_flag, begin_time)
+
+
+def set_hold(hold: bool) -> None:
+    """Hold keys for the duration of the notes instead of tapping them."""
+    keyboard_backend.hold = hold
+
+
+_available: bool | None = None
+
+
 def available() -> bool:
-    try:
-        keyboard.write("")  # Test if keyboard module is functional
-        return True
-    except Exception:
-        return False
+    """Check once per session that keys can be sent, without sending any."""
+    global _available
+    if _available is None:
+        try:
+            keyboard.key_to_scan_codes("z")  # needs the platform backend to be usable
+            _available = True
+        except Exception:
+            _available = False
+    return _available
 
 
 def name() -> str:
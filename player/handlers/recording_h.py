@@ -0,0 +1,103 @@
+import threading
+
+from player.clock import Clock, real_clock
+from player.handlers.base import OutputBackend, backend_registry
+from player.pattern import NoteContainer
+
+
+class PlaybackRecord:
+    """
+    A note emitted by the RecordingBackend.
+    Attributes:
+    note_container: The emitted note.
+    intended_time: The time the note should have been emitted at, in seconds since the epoch.
+    actual_time: The time the note was emitted at, in seconds since the epoch.
+    """
+
+    note_container: NoteContainer
+    intended_time: float
+    actual_time: float
+
+    def __init__(
+        self, note_container: NoteContainer, intended_time: float, actual_time: float
+    ) -> None:
+        self.note_container = note_container
+        self.intended_time = intended_time
+        self.actual_time = actual_time
+
+    @property
+    def lateness(self) -> float:
+        return self.actual_time - self.intended_time
+
+    def __repr__(self) -> str:
+        return f"PlaybackRecord(note_container={self.note_container!r}, intended_time={self.intended_time}, actual_time={self.actual_time})"
+
+
+class RecordingBackend(OutputBackend):
+    """
+    An output backend that only records what it is asked to play.
+
+    It needs neither a keyboard hook nor an audio device, so the scheduler can be
+    benchmarked and regression tested on headless machines.
+    Attributes:
+    records: The emitted notes in emission order.
+    clock: The clock the emission times are read on.
+    """
+
+    _registered_name = "recording"
+    records: list[PlaybackRecord]
+    clock: Clock
+
+    def __init__(self, clock: Clock = real_clock) -> None:
+        super().__init__()
+        self.records = []
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    @classmethod
+    def name(cls) -> str:
+        return "记录"
+
+    def fire(self, note_containers: list[NoteContainer], begin_time: float) -> None:
+        self._record(note_containers, begin_time)
+
+    def _record(self, note_containers: list[NoteContainer], begin_time: float) -> float:
+        """Append the records of the notes, returns their actual time."""
+        actual_time = self.clock.now()
+        with self._lock:
+            for nc in note_containers:
+                self.records.append(
+                    PlaybackRecord(nc, nc.play_time + begin_time, actual_time)
+                )
+        return actual_time
+
+    def probe(self, note_container: NoteContainer) -> float | None:
+        # the recorded actual time is the effect of a recording backend; the probe
+        # is timed like a fire but not recorded, playback may be recording too
+        start = self.clock.now()
+        return self._record([], start - note_container.play_time) - start
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+
+    def latenesses(self) -> list[float]:
+        with self._lock:
+            return [record.lateness for record in self.records]
+
+    def summary(self) -> dict[str, float]:
+        """Get timing statistics of the recorded notes, in seconds."""
+        latenesses = sorted(self.latenesses())
+        if not latenesses:
+            return {"count": 0}
+        return {
+            "count": len(latenesses),
+            "mean": sum(latenesses) / len(latenesses),
+            "min": latenesses[0],
+            "median": latenesses[len(latenesses) // 2],
+            "p99": latenesses[min(len(latenesses) - 1, int(len(latenesses) * 0.99))],
+            "max": latenesses[-1],
+        }
+
+
+backend_registry.register_backend(RecordingBackend._registered_name, RecordingBackend)
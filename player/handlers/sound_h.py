@@ -1,12 +1,75 @@
-import os
+import sys
+import threading
 
-from chart.constants import NOTATION_INDEX_TABLE
+from chart.constants import ChartNotation
+from player.handlers.base import OutputBackend, backend_registry
 from player.pattern import NoteContainer
+from player.samplebank import InstrumentLibrary, SampleBank, SampleBankError
 from player.utils import FlagBoolean, wait_until_or_cancel
-
-from playsound import playsound
+from shared.lazy import lazy_import
 from shared.utils import AUDIO_DIR
 
+playsound = lazy_import("playsound")  # imported when the first sample is played
+
+instruments = InstrumentLibrary(AUDIO_DIR)
+
+
+class SoundBackend(OutputBackend):
+    """
+    Plays the samples of the current instrument.
+
+    playsound only takes a file, so every note plays the sample file of its
+    bank; prefetch makes sure synthesized notes have one before they are due.
+    The decoded pcm of the bank's PCMCache is not used here.
+    Attributes:
+    instruments: The instrument library the samples are taken from.
+    """
+
+    _registered_name = "sound"
+    instruments: InstrumentLibrary
+
+    def __init__(self, instruments: InstrumentLibrary = instruments) -> None:
+        super().__init__()
+        self.instruments = instruments
+
+    @classmethod
+    def name(cls) -> str:
+        return name()
+
+    @classmethod
+    def available(cls) -> bool:
+        return available()
+
+    def prefetch(self, note_containers: list[NoteContainer]) -> None:
+        self.instruments.prefetch([nc.note.token for nc in note_containers])
+
+    def fire(self, note_containers: list[NoteContainer], begin_time: float) -> None:
+        bank = self.instruments.get_bank()
+        for nc in note_containers:
+            # playsound blocks until the sample ends, samples of a chord overlap
+            threading.Thread(
+                target=self._play, args=(bank, nc.note.token), daemon=True
+            ).start()
+
+    @staticmethod
+    def _play(bank: SampleBank, token: ChartNotation) -> None:
+        # on the note's own thread: a sample prefetch hasn't synthesized yet only
+        # delays this note, not the dispatcher firing the other outputs
+        try:
+            path = bank.get_path(token)
+        except SampleBankError as e:
+            print(f"not played: {e}", file=sys.stderr)
+            return
+        playsound.playsound(path)
+
+    def probe(self, note_container: NoteContainer) -> float | None:
+        # without a microphone loopback the sound can't be observed, and the time
+        # playsound takes to return says nothing about when it is heard
+        return None
+
+
+backend_registry.register_backend(SoundBackend._registered_name, SoundBackend)
+
 
 def handler(
     note_container: NoteContainer, cancel_flag: FlagBoolean, begin_time: float
@@ -14,21 +77,34 @@ def handler(
     status = wait_until_or_cancel(note_container.play_time + begin_time, cancel_flag)
     if status:
         # print(f"Playing sound for note: {note_container.note}")
-        basename = note_container.note.token + ".mp3"
-        audio_path = os.path.join(AUDIO_DIR, basename)
-        playsound(audio_path)
+        audio_path = instruments.get_bank().get_path(note_container.note.token)
+        playsound.playsound(audio_path)
+
+
+def prefetch(note_containers: list[NoteContainer]) -> None:
+    """Prepare the samples of notes that are about to be played."""
+    instruments.prefetch([nc.note.token for nc in note_containers])
+
+
+def prepare() -> None:
+    """Synthesize the missing samples ahead of time, so no note waits for them."""
+    instruments.get_bank().build()
+
+
+def set_instrument(instrument: str) -> SampleBank:
+    return instruments.select(instrument)
+
+
+_available: dict[str, bool] = {}  # by audio folder, checked once per session
 
 
 def available() -> bool:
-    # check file existence
-    for token in NOTATION_INDEX_TABLE:
-        basename = token + ".mp3"
-        audio_path = os.path.join(AUDIO_DIR, basename)
-        if not os.path.isfile(audio_path):
-            return False
-    return True
+    # every note needs a recorded sample or a recorded neighbour to be synthesized from
+    bank = instruments.get_bank()
+    if bank.audio_dir not in _available:
+        _available[bank.audio_dir] = bank.available()
+    return _available[bank.audio_dir]
 
 
 def name() -> str:
     return "音频播放"
-
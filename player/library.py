@@ -0,0 +1,282 @@
+import hashlib
+import os
+import sqlite3
+from typing import Any
+
+from chart.constants import CHART_EXTENSIONS
+from chart.parser import ChartParseException, TextLine, parse_chart
+from player.command import CommandParseError
+from player.interal import InternalProperty
+from player.pattern import PatternMismatchException, PatternMismatchWarning
+from player.runtime import ChartRuntime
+from shared.utils import CACHE_DIR
+
+LIBRARY_DB_PATH = os.path.join(CACHE_DIR, "library.sqlite3")
+
+LIBRARY_SCHEMA_VERSION = 1
+
+_COLUMNS = (
+    "path",
+    "mtime",
+    "size",
+    "hash",
+    "title",
+    "bpm_initial",
+    "bpm_min",
+    "bpm_max",
+    "time_signatures",
+    "duration",
+    "beat_count",
+    "note_count",
+    "density",
+    "peak_density",
+    "error",
+)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS charts (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    title TEXT,
+    bpm_initial REAL,
+    bpm_min REAL,
+    bpm_max REAL,
+    time_signatures TEXT,
+    duration REAL,
+    beat_count INTEGER,
+    note_count INTEGER,
+    density REAL,
+    peak_density REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS charts_bpm ON charts (bpm_min, bpm_max);
+CREATE INDEX IF NOT EXISTS charts_duration ON charts (duration);
+CREATE INDEX IF NOT EXISTS charts_note_count ON charts (note_count);
+CREATE INDEX IF NOT EXISTS charts_density ON charts (density);
+PRAGMA user_version = {LIBRARY_SCHEMA_VERSION};
+"""
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def extract_metadata(path: str) -> dict[str, Any]:
+    """
+    Read the metadata of a chart file through the parser and the runtime.
+
+    Charts that fail to compile are still indexed, with the error message set.
+    """
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        raw = f.read()
+    metadata: dict[str, Any] = {column: None for column in _COLUMNS}
+    metadata.update(
+        path=os.path.abspath(path),
+        mtime=stat.st_mtime,
+        size=stat.st_size,
+        hash=hashlib.sha256(raw).hexdigest(),
+    )
+    try:
+        lines = parse_chart(raw.decode("utf-8"))
+        internal_property = InternalProperty()
+        runtime = ChartRuntime(internal_property, lines)
+        runtime.caculate_playlist()
+    except UnicodeDecodeError as e:
+        metadata["error"] = f"Not an utf-8 text file: {e}"
+        return metadata
+    except ChartParseException as e:
+        first = e.errors[0]
+        metadata["error"] = f"line {first.line_number}: {first.message}"
+        return metadata
+    except CommandParseError as e:
+        metadata["error"] = f"line {e.line_number}: {e}"
+        return metadata
+    except (
+        PatternMismatchException,
+        PatternMismatchWarning,
+        ValueError,
+    ) as e:
+        metadata["error"] = str(e)
+        return metadata
+
+    for line in lines:
+        if isinstance(line, TextLine) and line.raw_text.strip():
+            metadata["title"] = line.raw_text.strip()
+            break
+
+    tempo_map = runtime.get_tempo_map()
+    playlist = runtime.get_playlist()
+    note_count = sum(len(beat.notes) for beat in playlist)
+    duration = tempo_map.duration
+    metadata.update(
+        bpm_initial=internal_property.bpm,
+        bpm_min=min(tempo_map.bpms),
+        bpm_max=max(tempo_map.bpms),
+        time_signatures=",".join(str(ts) for ts in tempo_map.time_signatures),
+        duration=duration,
+        beat_count=len(playlist),
+        note_count=note_count,
+        density=note_count / duration if duration > 0 else 0.0,
+        peak_density=runtime.get_density_profile().peak_rate(),
+    )
+    return metadata
+
+
+class ChartLibrary:
+    """
+    An index of chart files with their metadata, stored in SQLite.
+
+    Only files whose size, mtime or content changed since the last scan are
+    parsed again, using several processes.
+    Attributes:
+    db_path: The SQLite database file.
+    """
+
+    db_path: str
+
+    def __init__(self, db_path: str = LIBRARY_DB_PATH) -> None:
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, LIBRARY_SCHEMA_VERSION):
+            self.connection.execute("DROP TABLE IF EXISTS charts")
+        self.connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def scan(
+        self,
+        directory: str,
+        workers: int | None = None,
+        extensions: tuple[str, ...] = CHART_EXTENSIONS,
+    ) -> dict[str, int]:
+        """
+        Index every chart below directory.
+        Returns:
+        The number of "indexed", "unchanged" and "removed" files.
+        """
+        directory = os.path.abspath(directory)
+        prefix = os.path.join(directory, "")
+        # an exact, case sensitive prefix; LIKE would read _ and % in folder names
+        known = {
+            row["path"]: (row["mtime"], row["size"], row["hash"])
+            for row in self.connection.execute(
+                "SELECT path, mtime, size, hash FROM charts"
+                " WHERE substr(path, 1, length(?)) = ?",
+                (prefix, prefix),
+            )
+        }
+        found: set[str] = set()
+        changed: list[str] = []
+        touched: list[tuple[float, str]] = []
+        for root, _, files in os.walk(directory):
+            for file_name in files:
+                if not file_name.lower().endswith(extensions):
+                    continue
+                path = os.path.join(root, file_name)
+                found.add(path)
+                stat = os.stat(path)
+                previous = known.get(path)
+                if previous is not None and previous[:2] == (
+                    stat.st_mtime,
+                    stat.st_size,
+                ):
+                    continue
+                if previous is not None and previous[1] == stat.st_size:
+                    # touched but maybe not edited, the hash decides
+                    if file_hash(path) == previous[2]:
+                        touched.append((stat.st_mtime, path))
+                        continue
+                changed.append(path)
+
+        removed = [path for path in known if path not in found]
+        rows = self._extract_all(changed, workers)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO charts ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})",
+                [tuple(row[column] for column in _COLUMNS) for row in rows],
+            )
+            self.connection.executemany(
+                "UPDATE charts SET mtime = ? WHERE path = ?", touched
+            )
+            self.connection.executemany(
+                "DELETE FROM charts WHERE path = ?", [(path,) for path in removed]
+            )
+        return {
+            "indexed": len(rows),
+            "unchanged": len(found) - len(rows),
+            "removed": len(removed),
+        }
+
+    @staticmethod
+    def _extract_all(paths: list[str], workers: int | None) -> list[dict[str, Any]]:
+        if len(paths) < 8 or workers == 1:
+            return [extract_metadata(path) for path in paths]
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(extract_metadata, paths, chunksize=16))
+
+    def get(self, path: str) -> dict[str, Any] | None:
+        row = self.connection.execute(
+            "SELECT * FROM charts WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        return dict(row) if row is not None else None
+
+    def search(
+        self,
+        min_bpm: float | None = None,
+        max_bpm: float | None = None,
+        min_duration: float | None = None,
+        max_duration: float | None = None,
+        min_notes: int | None = None,
+        max_notes: int | None = None,
+        time_signature: int | None = None,
+        min_density: float | None = None,
+        max_density: float | None = None,
+        include_errors: bool = False,
+        order_by: str = "path",
+        limit: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """Find charts by their metadata. A bpm bound matches if any tempo of the chart is in range."""
+        if order_by not in _COLUMNS:
+            raise ValueError(f"Unknown column: {order_by}")
+        conditions: list[str] = []
+        params: list[Any] = []
+        for column, operator, value in (
+            ("bpm_max", ">=", min_bpm),
+            ("bpm_min", "<=", max_bpm),
+            ("duration", ">=", min_duration),
+            ("duration", "<=", max_duration),
+            ("note_count", ">=", min_notes),
+            ("note_count", "<=", max_notes),
+            ("density", ">=", min_density),
+            ("density", "<=", max_density),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        if time_signature is not None:
+            conditions.append("(',' || time_signatures || ',') LIKE ?")
+            params.append(f"%,{time_signature},%")
+        if not include_errors:
+            conditions.append("error IS NULL")
+        query = "SELECT * FROM charts"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {order_by}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.connection.execute(query, params)]
+
+    def count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM charts").fetchone()[0]
@@ -0,0 +1,194 @@
+import os
+import threading
+
+from typing import Callable
+
+from chart.parser import (
+    ChartParseException,
+    Line,
+    ParseError,
+    ParseErrorInfo,
+    parse_chart,
+    parse_line,
+)
+from player.clock import real_clock
+from player.command import CommandParseError
+from player.interal import InternalProperty
+from player.pattern import PatternMismatchException, PatternMismatchWarning
+from player.runtime import ChartRuntime, PlayerThreadingPool
+from player.utils import FlagBoolean
+
+LIVE_POLL_INTERVAL = 0.2  # seconds between two checks of the chart file
+
+# errors that leave the last good version of the chart playing
+RELOAD_ERRORS = (
+    ChartParseException,
+    CommandParseError,
+    PatternMismatchException,
+    PatternMismatchWarning,
+    ValueError,
+    UnicodeDecodeError,
+    OSError,
+)
+
+
+def diff_lines(
+    old_lines: list[str], new_lines: list[str]
+) -> tuple[int, int, list[str]]:
+    """
+    The changed region between two versions of a chart.
+    Returns:
+    The first changed line counted from 1, how many old lines it replaces, and the new lines.
+    """
+    prefix = 0
+    limit = min(len(old_lines), len(new_lines))
+    while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while (
+        suffix < limit
+        and old_lines[len(old_lines) - 1 - suffix]
+        == new_lines[len(new_lines) - 1 - suffix]
+    ):
+        suffix += 1
+    return (
+        prefix + 1,
+        len(old_lines) - prefix - suffix,
+        new_lines[prefix : len(new_lines) - suffix],
+    )
+
+
+def parse_lines(line_strs: list[str], first_line: int) -> list[Line]:
+    """Parse some lines of a chart, numbered from first_line."""
+    lines: list[Line] = []
+    exception_list: list[ParseErrorInfo] = []
+    for line_number, line_str in enumerate(line_strs, start=first_line):
+        try:
+            lines.append(parse_line(line_str, line_number))
+        except ParseError as e:
+            exception_list.append(ParseErrorInfo(line_number, e.position, str(e)))
+    if exception_list:
+        raise ChartParseException(exception_list)
+    return lines
+
+
+class LiveChart:
+    """
+    Keeps a compiled chart, and the pool playing it, in sync with the chart file.
+
+    When the file changes, only the changed lines are parsed again and the playlist
+    is recompiled from the first beat they touch, then the beats the pool has not
+    staged yet are swapped for the new ones. Notes already staged keep playing.
+    An edit that does not compile is reported and the last good version keeps
+    playing.
+    Attributes:
+    path: The chart file.
+    runtime: The compiled chart.
+    pool: The pool playing the chart, if any.
+    poll_interval: Seconds between two checks of the file.
+    reloads: How many edits were applied.
+    last_error: The error of the last edit that did not compile, None once one compiles.
+    """
+
+    path: str
+    runtime: ChartRuntime
+    pool: PlayerThreadingPool | None
+    poll_interval: float
+    reloads: int
+    last_error: Exception | None
+
+    def __init__(
+        self,
+        path: str,
+        internal_property: InternalProperty | None = None,
+        poll_interval: float = LIVE_POLL_INTERVAL,
+        on_reload: Callable[[int], None] | None = None,
+        on_error: Callable[[Exception], None] | None = None,
+    ) -> None:
+        """
+        Args:
+            path: The chart file, compiled right away.
+            internal_property: The initial bpm and time signature.
+            poll_interval: Seconds between two checks of the file.
+            on_reload: Called with the first changed beat id after an edit was applied.
+            on_error: Called with the error of an edit that does not compile.
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.on_reload = on_reload
+        self.on_error = on_error
+        self.pool = None
+        self.reloads = 0
+        self.last_error = None
+        self.stop_flag = FlagBoolean(False)
+        self._stat = self._read_stat()
+        text = self._read_text()
+        self.line_strs = text.splitlines()
+        self.runtime = ChartRuntime(
+            internal_property if internal_property is not None else InternalProperty(),
+            parse_chart(text),
+        )
+        self.runtime.caculate_playlist()
+
+    def attach(self, pool: PlayerThreadingPool) -> None:
+        """Send the edits to pool, which should play runtime's playlist."""
+        self.pool = pool
+
+    def _read_stat(self) -> tuple[float, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime, stat.st_size
+
+    def _read_text(self) -> str:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def reload(self) -> bool:
+        """Apply the changes of the file, returns whether anything changed."""
+        try:
+            line_strs = self._read_text().splitlines()
+            first_line, removed_count, new_strs = diff_lines(self.line_strs, line_strs)
+            if removed_count == 0 and not new_strs:
+                return False
+            first_beat_id = self.runtime.replace_lines(
+                first_line, removed_count, parse_lines(new_strs, first_line)
+            )
+        except RELOAD_ERRORS as e:
+            self.last_error = e
+            if self.on_error is not None:
+                self.on_error(e)
+            return False
+        self.line_strs = line_strs
+        self.last_error = None
+        self.reloads += 1
+        if self.pool is not None:
+            self.pool.swap_beats(
+                self.runtime.get_playlist(), self.runtime.get_density_profile()
+            )
+        if self.on_reload is not None:
+            self.on_reload(first_beat_id)
+        return True
+
+    def check(self) -> bool:
+        """Reload if the file was modified since the last check."""
+        try:
+            stat = self._read_stat()
+        except OSError:
+            return False  # replaced by an editor, the next check sees the new file
+        if stat == self._stat:
+            return False
+        self._stat = stat
+        return self.reload()
+
+    def watch(self) -> None:
+        """Check the file until stop is called."""
+        while real_clock.sleep_until(
+            real_clock.now() + self.poll_interval, self.stop_flag
+        ):
+            self.check()
+
+    def start(self) -> None:
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def stop(self) -> None:
+        self.stop_flag.modify(True)
@@ -15,14 +15,21 @@ class NoteContainerRelative:
     Attributes:
     note: The BasicNote object.
     play_time: The time when the note should be played, in seconds.
+    duration: How long the note lasts including its continuous notes, in seconds.
     """
 
+    __slots__ = ("note", "relative_play_time", "duration")
+
     note: SingleNote
     relative_play_time: float  # in seconds
+    duration: float  # in seconds
 
-    def __init__(self, note: SingleNote, relative_play_time: float) -> None:
+    def __init__(
+        self, note: SingleNote, relative_play_time: float, duration: float = 0.0
+    ) -> None:
         self.note = note
         self.relative_play_time = relative_play_time
+        self.duration = duration
 
     def __gt__(self, value: object) -> bool:
         if not isinstance(value, NoteContainerRelative):
@@ -44,14 +51,21 @@ class NoteContainer:
     Attributes:
     note: The BasicNote object.
     play_time: The time when the note should be played, in seconds.
+    duration: How long the note lasts including its continuous notes, in seconds.
     """
 
+    __slots__ = ("note", "play_time", "duration")
+
     note: SingleNote
     play_time: float  # in seconds
+    duration: float  # in seconds
 
-    def __init__(self, note: SingleNote, play_time: float) -> None:
+    def __init__(
+        self, note: SingleNote, play_time: float, duration: float = 0.0
+    ) -> None:
         self.note = note
         self.play_time = play_time
+        self.duration = duration
 
     def __gt__(self, value: object) -> bool:
         if not isinstance(value, NoteContainer):
@@ -113,7 +127,11 @@ def get_notes_patterns_in_multiple_cords(
 ) -> list[NoteContainerRelative]:
     result: list[NoteContainerRelative] = []
     if isinstance(note, SingleNote):
-        result.append(NoteContainerRelative(note=note, relative_play_time=begin_time))
+        result.append(
+            NoteContainerRelative(
+                note=note, relative_play_time=begin_time, duration=full_duration
+            )
+        )
     elif isinstance(note, ChordNote):
         for sub_note in note.notes:
             sub_patterns = get_notes_patterns_in_multiple_cords(
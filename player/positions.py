@@ -0,0 +1,179 @@
+import bisect
+
+from chart.parser import BeatLine, Line
+from player.tempo import TempoMap
+
+# (line number, first column, end column) of a beat in the chart text
+SourceSpan = tuple[int, int, int]
+
+
+class SourceIndex:
+    """
+    A two-way index between text positions in a chart and beat ids.
+
+    Lines are numbered from 1 like parse_chart does, columns from 0 like tkinter.
+    Beat ids count the beats of the whole chart, the same as the playlist and the
+    TempoMap, so play times are one tempo map lookup away. Only beat lines are
+    stored, every lookup is a binary search. After an edit, replace_lines swaps
+    the changed lines and the beat ids after them are recounted on the next
+    lookup.
+    Attributes:
+    line_numbers: The beat lines of the chart, in order.
+    beat_starts: The first column of every beat, per beat line.
+    beat_ends: The column after the last character of every beat, per beat line.
+    """
+
+    line_numbers: list[int]
+    beat_starts: list[list[int]]
+    beat_ends: list[list[int]]
+
+    def __init__(self) -> None:
+        self.line_numbers = []
+        self.beat_starts = []
+        self.beat_ends = []
+        self._first_beats: list[int] = []  # beat id of the first beat, per beat line
+        self._counted = 0  # how many entries of _first_beats are up to date
+
+    @staticmethod
+    def from_lines(lines: list[Line]) -> "SourceIndex":
+        """Index parsed lines, lines without a line number count from 1."""
+        index = SourceIndex()
+        for offset, line in enumerate(lines):
+            if isinstance(line, BeatLine) and line.beats:
+                starts, ends = SourceIndex._columns(line)
+                line_number = line.line_number
+                index.line_numbers.append(
+                    line_number if line_number is not None else offset + 1
+                )
+                index.beat_starts.append(starts)
+                index.beat_ends.append(ends)
+        index._first_beats = [0] * len(index.line_numbers)
+        return index
+
+    @staticmethod
+    def _columns(line: BeatLine) -> tuple[list[int], list[int]]:
+        starts: list[int] = []
+        ends: list[int] = []
+        begin_index = 0
+        for beat in line.beats:
+            starts.append(begin_index)
+            ends.append(begin_index + len(beat.raw_text))
+            begin_index += len(beat.raw_text) + 1  # +1 for the '/' character
+        return starts, ends
+
+    def replace_lines(
+        self, first_line: int, removed_count: int, new_lines: list[Line]
+    ) -> None:
+        """
+        Replace removed_count lines starting at first_line by new_lines.
+
+        The new lines are numbered from first_line, the lines after them are
+        shifted by the difference in length.
+        """
+        begin = bisect.bisect_left(self.line_numbers, first_line)
+        end = bisect.bisect_left(self.line_numbers, first_line + removed_count)
+        shift = len(new_lines) - removed_count
+
+        line_numbers: list[int] = []
+        starts: list[list[int]] = []
+        ends: list[list[int]] = []
+        for offset, line in enumerate(new_lines):
+            line.set_line_number(first_line + offset)
+            if isinstance(line, BeatLine):
+                line.set_beat_positions()
+                if line.beats:
+                    line_starts, line_ends = self._columns(line)
+                    line_numbers.append(first_line + offset)
+                    starts.append(line_starts)
+                    ends.append(line_ends)
+
+        if shift:
+            self.line_numbers[end:] = [
+                line_number + shift for line_number in self.line_numbers[end:]
+            ]
+        self.line_numbers[begin:end] = line_numbers
+        self.beat_starts[begin:end] = starts
+        self.beat_ends[begin:end] = ends
+        self._first_beats[begin:end] = [0] * len(line_numbers)
+        self._counted = min(self._counted, begin)
+
+    def _count_beats(self) -> list[int]:
+        first_beats = self._first_beats
+        if self._counted < len(first_beats):
+            index = self._counted
+            beat_id = (
+                first_beats[index - 1] + len(self.beat_starts[index - 1])
+                if index > 0
+                else 0
+            )
+            for index in range(index, len(first_beats)):
+                first_beats[index] = beat_id
+                beat_id += len(self.beat_starts[index])
+            self._counted = len(first_beats)
+        return first_beats
+
+    @property
+    def beat_count(self) -> int:
+        first_beats = self._count_beats()
+        if not first_beats:
+            return 0
+        return first_beats[-1] + len(self.beat_starts[-1])
+
+    def beat_at(self, line_number: int, column: int) -> int | None:
+        """The beat under a text position, a cursor right after a beat is on it."""
+        entry = bisect.bisect_left(self.line_numbers, line_number)
+        if entry == len(self.line_numbers) or self.line_numbers[entry] != line_number:
+            return None
+        k = bisect.bisect_right(self.beat_starts[entry], column) - 1
+        if k < 0 or column > self.beat_ends[entry][k]:
+            return None
+        return self._count_beats()[entry] + k
+
+    def beat_from(self, line_number: int, column: int) -> int | None:
+        """The beat under a text position or the first one after it, None at the end."""
+        entry = bisect.bisect_left(self.line_numbers, line_number)
+        if entry < len(self.line_numbers) and self.line_numbers[entry] == line_number:
+            k = bisect.bisect_left(self.beat_ends[entry], column)
+            if k < len(self.beat_ends[entry]):
+                return self._count_beats()[entry] + k
+            entry += 1
+        if entry == len(self.line_numbers):
+            return None
+        return self._count_beats()[entry]
+
+    def span_of(self, beat_id: int) -> SourceSpan:
+        """The line and the columns of a beat."""
+        first_beats = self._count_beats()
+        if not 0 <= beat_id < self.beat_count:
+            raise ValueError(f"Unknown beat id {beat_id}")
+        entry = bisect.bisect_right(first_beats, beat_id) - 1
+        k = beat_id - first_beats[entry]
+        return (
+            self.line_numbers[entry],
+            self.beat_starts[entry][k],
+            self.beat_ends[entry][k],
+        )
+
+    def text_range(self, beat_id: int) -> tuple[str, str]:
+        """The begin and end of a beat as tkinter text positions."""
+        line_number, begin, end = self.span_of(beat_id)
+        return f"{line_number}.{begin}", f"{line_number}.{end}"
+
+    def time_at(
+        self, line_number: int, column: int, tempo_map: TempoMap
+    ) -> float | None:
+        """When the beat at or after a text position begins, to start playback from a cursor."""
+        beat_id = self.beat_from(line_number, column)
+        return None if beat_id is None else tempo_map.beat_to_time(beat_id)
+
+    def beat_at_time(self, time: float, tempo_map: TempoMap) -> int | None:
+        """The beat playing at a time in seconds, None before the start or after the end."""
+        if time < 0.0:
+            return None
+        beat_id = int(tempo_map.time_to_beat(time))
+        return beat_id if beat_id < self.beat_count else None
+
+    def span_at_time(self, time: float, tempo_map: TempoMap) -> SourceSpan | None:
+        """The text of the beat playing at a time, to highlight the playhead."""
+        beat_id = self.beat_at_time(time, tempo_map)
+        return None if beat_id is None else self.span_of(beat_id)
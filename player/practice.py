@@ -1,12 +1,42 @@
-import time
-
-import keyboard
+import heapq
+import itertools
+import threading
 
+from collections import deque
 from typing import Callable
 
 from chart.constants import KEYBOARD_INDEX_TABLE, ChartKey
+from player.clock import Clock, real_clock
 from player.pattern import NoteContainer
 from player.runtime import BeatContainer, FlagBoolean
+from player.scoring import TimingReport, TimingSession
+from player.sections import BeatRangeIndex
+from shared.lazy import lazy_import
+
+keyboard = lazy_import("keyboard")  # imported when the listeners are registered
+
+KEY_INDEX: dict[ChartKey, int] = {
+    key: index for index, key in enumerate(KEYBOARD_INDEX_TABLE)
+}
+
+
+def build_input_tables() -> tuple[dict[int, int], dict[str, int]]:
+    """
+    Map the scan codes and names of the chart keys to their index.
+    Returns:
+    A tuple of (scan code table, key name table). The name table is a fallback for
+    events whose scan code isn't known, e.g. on other keyboard layouts.
+    """
+    scan_code_table: dict[int, int] = {}
+    name_table: dict[str, int] = {}
+    for key, index in KEY_INDEX.items():
+        name_table[key.lower()] = index
+        try:
+            for scan_code in keyboard.key_to_scan_codes(key.lower()):
+                scan_code_table.setdefault(scan_code, index)
+        except (ValueError, ImportError, OSError):
+            pass  # no keyboard mapping on this machine, names still work
+    return scan_code_table, name_table
 
 
 class PracticeController:
@@ -14,124 +44,319 @@ class PracticeController:
     A class to control the practice mode of the chart player.
     Attributes:
     beat_containers: A list of BeatContainer instances representing the beats in the chart.
-    current_beat_index: The index of the current beat being processed. Can be used to track progress.
+    current_beat_index: The index of the next beat to be loaded into the note queue. Can be used to track progress.
+    begin_index: The index of the first beat of the practiced section.
+    end_index: The index after the last beat of the practiced section.
     current_playing_time: The current playing time in seconds.
-    note_queue: A list of NoteContainer instances that are queued to be played.
-    waiting_keys: A list of ChartKey instances that are waiting to be pressed by the user
-    pressed_keys: A list of ChartKey instances that have been pressed by the user and are waiting for release.
+    note_queue: A heap of (play_time, order, NoteContainer) of the loaded notes that are not played yet.
+    waiting_mask: A bitmask (by KEY_INDEX) of the keys that are waiting to be pressed by the user.
+    pressed_mask: A bitmask of the keys that have been pressed by the user and are waiting for release.
     should_stop: A FlagBoolean instance to signal when the practice mode should stop.
+    input_latencies: The time from the most recent key events to their judgement, in seconds.
+    timing: The session recording key presses in timed practice, None otherwise.
+    clock: The clock presses are timestamped (perf_now) and timed passes are waited on.
     """
 
     beat_containers: list[BeatContainer]
-    current_beat_index: int = 0
-    current_playing_time: float = 0.0
-    note_queue: list[NoteContainer] = []
-    waiting_keys: list[ChartKey] = []  # keys that are waiting to be pressed
-    pressed_keys: list[ChartKey] = []  # keys that have been pressed, wait for release
-    should_stop: FlagBoolean = FlagBoolean(False)
-    hooks: list[Callable[[], None]] = []
+    current_beat_index: int
+    begin_index: int
+    end_index: int
+    current_playing_time: float
+    note_queue: list[tuple[float, int, NoteContainer]]
+    waiting_mask: int  # keys that are waiting to be pressed
+    pressed_mask: int  # keys that have been pressed, wait for release
+    should_stop: FlagBoolean
+    hooks: list[Callable[[], None]]
+    input_latencies: deque[float]
+    timing: TimingSession | None
+    clock: Clock
+    INPUT_LATENCY_HISTORY: int = 1024
 
     def __init__(
         self,
         beat_containers: list[BeatContainer],
         should_stop: FlagBoolean | None = None,
+        clock: Clock = real_clock,
     ) -> None:
         """
         Initialize the PracticeController with beat containers and an optional stop flag.
         Args:
             beat_containers (list[BeatContainer]): A list of BeatContainer instances.
             should_stop (FlagBoolean | None): An optional FlagBoolean to signal when to stop. If None, a new FlagBoolean is created.
+            clock (Clock): The clock of the practice, a VirtualClock makes timed passes return at once.
         """
         self.beat_containers = beat_containers
+        self.current_beat_index = 0
+        self.begin_index = 0
+        self.end_index = len(beat_containers)
+        self.current_playing_time = 0.0
+        self.note_queue = []
+        self._range_index: BeatRangeIndex | None = None
+        self.waiting_mask = 0
+        self.pressed_mask = 0
+        self.hooks = []
+        self.input_latencies = deque(maxlen=self.INPUT_LATENCY_HISTORY)
+        self.scan_code_table: dict[int, int] = {}
+        self.name_table: dict[str, int] = {}
+        self.timing = None
+        self.clock = clock
+        self.condition = threading.Condition()
+        self._order = itertools.count()  # keeps the heap from comparing notes
         if should_stop is None:
             self.should_stop = FlagBoolean(False)
         else:
             self.should_stop = should_stop
 
     def update(self, time_slice: float = 0.5) -> None:
+        """Load the notes of every beat beginning up to time_slice after the current time."""
         end_time = self.current_playing_time + time_slice
-        if self.current_beat_index < len(self.beat_containers):
-            while (
-                self.current_beat_index < len(self.beat_containers)
-                and self.beat_containers[self.current_beat_index].begin_time <= end_time
-            ):
-                beat_container = self.beat_containers[self.current_beat_index]
-                self.note_queue.extend(beat_container.notes)
-                self.current_beat_index += 1
+        while (
+            self.current_beat_index < self.end_index
+            and self.beat_containers[self.current_beat_index].begin_time <= end_time
+        ):
+            self.load_beat(self.beat_containers[self.current_beat_index])
+            self.current_beat_index += 1
+
+    def load_beat(self, beat_container: BeatContainer) -> None:
+        for nc in beat_container.notes:
+            heapq.heappush(self.note_queue, (nc.play_time, next(self._order), nc))
+
+    def is_finished(self) -> bool:
+        return self.current_beat_index >= self.end_index and not self.note_queue
+
+    @property
+    def range_index(self) -> BeatRangeIndex:
+        """The section index of the chart, built on first use."""
+        if self._range_index is None:
+            self._range_index = BeatRangeIndex(self.beat_containers)
+        return self._range_index
+
+    def set_range(self, begin_index: int, end_index: int) -> None:
+        """
+        Restrict the practice to the beats begin_index to end_index (exclusive), from its start.
+        Raises ValueError if the range is empty or outside the chart.
+        """
+        if not 0 <= begin_index < end_index <= len(self.beat_containers):
+            raise ValueError(f"Empty section: beats {begin_index} to {end_index}")
+        with self.condition:
+            self.begin_index = begin_index
+            self.end_index = end_index
+            self.current_beat_index = begin_index
+            self.current_playing_time = self.beat_containers[begin_index].begin_time
+            self.note_queue = []
+            self.waiting_mask = 0
+            self.pressed_mask = 0
 
     def partice_loop(self) -> None:
         self.key_listener_register()
+        self.should_stop.subscribe(self._on_stop_changed)
+        try:
+            self._practice_pass()
+        finally:
+            self.should_stop.unsubscribe(self._on_stop_changed)
+            self.release_all_listeners()
+
+    def _practice_pass(self) -> None:
         while not self.should_stop.get():
-            while len(self.waiting_keys) > 0:
-                time.sleep(0.01)
-            if (
-                self.current_beat_index >= len(self.beat_containers)
-                and len(self.note_queue) == 0
-            ):
+            with self.condition:
+                # key callbacks and stop() wake us up, no polling
+                self.condition.wait_for(
+                    lambda: not self.waiting_mask or self.should_stop.get()
+                )
+            if self.should_stop.get() or self.is_finished():
                 break
             next_notes = self.get_next_notes()
+            mask = 0
             for note in next_notes:
                 if note.note.keyboard is not None:
-                    self.waiting_keys.append(note.note.keyboard)
-            self.remove_note_before_time(self.current_playing_time)
-        self.release_all_listeners()
+                    mask |= 1 << KEY_INDEX[note.note.keyboard]
+            with self.condition:
+                self.waiting_mask |= mask
+
+    def timed_loop(
+        self, lead_in: float = 1.0, hit_window: float | None = None
+    ) -> TimingReport:
+        """
+        Practice along with the chart at its tempo, instead of waiting for each note.
+
+        Every key press is timestamped with the clock and matched to the
+        expected notes afterwards.
+        Args:
+            lead_in: Seconds between the start and the first beat.
+            hit_window: The largest offset in seconds a press may have to count for a note.
+        Returns:
+        The timing of every note.
+        """
+        self.key_listener_register()
+        self.should_stop.subscribe(self._on_stop_changed)
+        try:
+            return self._timed_pass(lead_in, hit_window)
+        finally:
+            self.should_stop.unsubscribe(self._on_stop_changed)
+            self.release_all_listeners()
+
+    def _timed_pass(
+        self, lead_in: float, hit_window: float | None, tempo: float = 1.0
+    ) -> TimingReport:
+        timing = TimingSession(self.beat_containers[self.begin_index : self.end_index])
+        if hit_window is not None:
+            timing.hit_window = hit_window
+        timing.begin(
+            self.clock.perf_now() + lead_in,
+            self.beat_containers[self.begin_index].begin_time,
+            tempo,
+        )
+        self.timing = timing
+        deadline = timing.end_time
+        with self.condition:
+            # sleeps until the section is over, stop() wakes us up earlier
+            while not self.should_stop.get():
+                remaining = deadline - self.clock.perf_now()
+                if remaining <= 0:
+                    break
+                self.clock.wait(self.condition, remaining)
+        self.timing = None
+        return timing.evaluate()
+
+    def loop_section(
+        self,
+        begin_index: int,
+        end_index: int,
+        iterations: int,
+        timed: bool = False,
+        tempo: float = 1.0,
+        tempo_step: float = 0.0,
+        max_tempo: float = 1.0,
+        lead_in: float = 1.0,
+    ) -> list[TimingReport]:
+        """
+        Practice a section repeatedly. Find the section with range_index, e.g.
+        controller.loop_section(*controller.range_index.by_lines(10, 13), 100).
+        Args:
+            begin_index: The index of the first beat of the section.
+            end_index: The index after the last beat of the section.
+            iterations: How often the section is played.
+            timed: Practice along at tempo instead of waiting for each note.
+            tempo: The speed of the first iteration in timed practice, relative to the chart.
+            tempo_step: Added to the tempo after every iteration, up to max_tempo.
+            max_tempo: The highest tempo of the ramp.
+            lead_in: Seconds before every timed iteration starts.
+        Returns:
+        The timing report of every iteration in timed practice, an empty list otherwise.
+        """
+        reports: list[TimingReport] = []
+        self.key_listener_register()
+        self.should_stop.subscribe(self._on_stop_changed)
+        try:
+            for _ in range(iterations):
+                if self.should_stop.get():
+                    break
+                self.set_range(begin_index, end_index)
+                if timed:
+                    reports.append(self._timed_pass(lead_in, None, tempo))
+                    tempo = min(tempo + tempo_step, max_tempo)
+                else:
+                    self._practice_pass()
+        finally:
+            self.should_stop.unsubscribe(self._on_stop_changed)
+            self.release_all_listeners()
+            if self.beat_containers:
+                self.set_range(0, len(self.beat_containers))
+        return reports
+
+    def stop(self) -> None:
+        self.should_stop.modify(True)
+
+    def _on_stop_changed(self, condition: bool) -> None:
+        with self.condition:
+            self.condition.notify_all()
 
     def remove_note_before_time(self, time_limit: float) -> None:
-        self.note_queue = [nc for nc in self.note_queue if nc.play_time > time_limit]
+        while self.note_queue and self.note_queue[0][0] <= time_limit:
+            heapq.heappop(self.note_queue)
 
     def get_next_notes(self) -> list[NoteContainer]:
-        # get notes from queue, if empty, update first
+        """Pop all notes sharing the earliest play time, loading beats as needed."""
         self.update()
-        if len(self.note_queue) == 0:
-            self.current_playing_time += 0.5
-        else:
-            min_play_time = min(nc.play_time for nc in self.note_queue)
-            self.current_playing_time = min_play_time
-        while len(self.note_queue) == 0 and self.current_beat_index < len(
-            self.beat_containers
-        ):
-            if len(self.note_queue) == 0:
-                self.current_playing_time += 0.5
-            else:
-                min_play_time = min(nc.play_time for nc in self.note_queue)
-                self.current_playing_time = min_play_time
-            print(1)
-            self.update()
-
-        # get all notes that should be played at current_playing_time
-        if len(self.note_queue) == 0:
+        # skip over beats without notes directly
+        while not self.note_queue and self.current_beat_index < self.end_index:
+            self.load_beat(self.beat_containers[self.current_beat_index])
+            self.current_beat_index += 1
+        if not self.note_queue:
             return []
-        notes_to_play = [
-            nc for nc in self.note_queue if nc.play_time <= self.current_playing_time
-        ]
-        # remove them from the queue
-        self.note_queue = [
-            nc for nc in self.note_queue if nc.play_time > self.current_playing_time
-        ]
+
+        self.current_playing_time = self.note_queue[0][0]
+        # notes of later beats may share the play time
+        self.update(0.0)
+        notes_to_play: list[NoteContainer] = []
+        while self.note_queue and self.note_queue[0][0] <= self.current_playing_time:
+            notes_to_play.append(heapq.heappop(self.note_queue)[2])
         return notes_to_play
 
+    @property
+    def waiting_keys(self) -> set[ChartKey]:
+        return {
+            key for key, index in KEY_INDEX.items() if self.waiting_mask >> index & 1
+        }
+
+    @property
+    def pressed_keys(self) -> set[ChartKey]:
+        return {
+            key for key, index in KEY_INDEX.items() if self.pressed_mask >> index & 1
+        }
+
     def on_key_press(self, key: ChartKey) -> None:
-        if key in self.waiting_keys:
-            if key not in self.pressed_keys:
-                self.pressed_keys.append(key)
-                self.waiting_keys.remove(key)
+        self.on_index_press(KEY_INDEX[key])
 
     def on_key_release(self, key: ChartKey) -> None:
-        if key in self.pressed_keys:
-            self.pressed_keys.remove(key)
+        self.on_index_release(KEY_INDEX[key])
+
+    def on_index_press(self, index: int, event_time: float | None = None) -> None:
+        """Judge a key press. event_time is when the key went down, if known."""
+        bit = 1 << index
+        with self.condition:
+            if self.waiting_mask & bit and not self.pressed_mask & bit:
+                self.pressed_mask |= bit
+                self.waiting_mask &= ~bit
+                if not self.waiting_mask:
+                    self.condition.notify_all()
+        if event_time is not None:
+            # keyboard stamps its events with time.time
+            self.input_latencies.append(self.clock.now() - event_time)
+
+    def on_index_release(self, index: int) -> None:
+        with self.condition:
+            self.pressed_mask &= ~(1 << index)
+
+    def on_input_event(self, event: "keyboard.KeyboardEvent") -> None:
+        """The single input hook, maps the event to a key index through the tables."""
+        index = self.scan_code_table.get(event.scan_code)
+        if index is None:
+            index = self.name_table.get(event.name)  # type: ignore
+            if index is None:
+                return
+        if event.event_type == keyboard.KEY_DOWN:
+            if self.timing is not None:
+                self.timing.record_press(index, self.clock.perf_now())
+            self.on_index_press(index, event.time)
+        else:
+            self.on_index_release(index)
+
+    def input_latency_stats(self) -> dict[str, float]:
+        """Get statistics of the key-down to judgement latency, in seconds."""
+        latencies = sorted(self.input_latencies)
+        if not latencies:
+            return {"count": 0}
+        return {
+            "count": len(latencies),
+            "mean": sum(latencies) / len(latencies),
+            "median": latencies[len(latencies) // 2],
+            "max": latencies[-1],
+        }
 
     def key_listener_register(self) -> None:
-        for key in KEYBOARD_INDEX_TABLE:
-            self.hooks.append(
-                keyboard.on_press_key(
-                    key.lower(), lambda _, k=key: self.on_key_press(k)
-                )
-            )
-            self.hooks.append(
-                keyboard.on_release_key(
-                    key.lower(), lambda _, k=key: self.on_key_release(k)
-                )
-            )
+        self.scan_code_table, self.name_table = build_input_tables()
+        self.hooks.append(keyboard.hook(self.on_input_event))
 
     def release_all_listeners(self) -> None:
         for hook in self.hooks:
@@ -139,4 +364,4 @@ class PracticeController:
         self.hooks.clear()
 
     def __del__(self):
-        self.release_all_listeners() # Ensure listeners are released upon deletion
+        self.release_all_listeners()  # Ensure listeners are released upon deletion
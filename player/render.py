@@ -0,0 +1,87 @@
+import numpy as np
+
+from player.runtime import BeatContainer
+from player.samplebank import PCMSample, SampleBank, write_wav
+
+RENDER_TAIL = 1.5  # seconds kept after the last note for the samples to ring out
+
+HEADROOM = 0.98  # the largest absolute value of a rendered mix
+
+
+def match_format(
+    pcm: np.ndarray, sample_rate: int, target_rate: int, channels: int
+) -> np.ndarray:
+    """Convert a sample to the sample rate and channel count of the mix."""
+    if sample_rate != target_rate:
+        frames = int(round(pcm.shape[0] * target_rate / sample_rate))
+        positions = np.arange(frames, dtype=np.float64) * (sample_rate / target_rate)
+        pcm = np.stack(
+            [
+                np.interp(positions, np.arange(pcm.shape[0]), pcm[:, channel])
+                for channel in range(pcm.shape[1])
+            ],
+            axis=1,
+        ).astype(np.float32)
+    if pcm.shape[1] == channels:
+        return pcm
+    if pcm.shape[1] == 1:
+        return np.repeat(pcm, channels, axis=1)
+    return pcm.mean(axis=1, keepdims=True).repeat(channels, axis=1)
+
+
+def render_playlist(
+    playlist: list[BeatContainer],
+    bank: SampleBank,
+    sample_rate: int | None = None,
+    tail: float = RENDER_TAIL,
+) -> tuple[np.ndarray, int]:
+    """
+    Mix the samples of every note of a playlist into one pcm array.
+
+    Every sample is converted once and added at the frame of its play time; the
+    mix is scaled down only if it would clip.
+    Returns:
+    A tuple of (pcm, sample_rate), pcm has shape (frames, channels).
+    """
+    notes = [nc for beat in playlist for nc in beat.notes]
+    samples: dict[str, PCMSample] = {}
+    channels = 1
+    for nc in notes:
+        if nc.note.token in samples:
+            continue
+        pcm, rate = samples[nc.note.token] = bank.get_pcm(nc.note.token)
+        if sample_rate is None:
+            sample_rate = rate
+        channels = max(channels, pcm.shape[1])
+    if sample_rate is None:
+        sample_rate = 44100
+    converted = {
+        token: match_format(pcm, rate, sample_rate, channels)
+        for token, (pcm, rate) in samples.items()
+    }
+
+    end_time = max((nc.play_time for nc in notes), default=0.0)
+    longest = max((len(pcm) for pcm in converted.values()), default=0)
+    frames = int((end_time + tail) * sample_rate) + longest
+    mix = np.zeros((frames, channels), dtype=np.float32)
+    for nc in notes:
+        pcm = converted[nc.note.token]
+        start = int(round(nc.play_time * sample_rate))
+        mix[start : start + len(pcm)] += pcm
+    mix = mix[: int((end_time + tail) * sample_rate) + 1]
+    peak = float(np.max(np.abs(mix))) if len(mix) else 0.0
+    if peak > HEADROOM:
+        mix *= HEADROOM / peak
+    return mix, sample_rate
+
+
+def render_to_wav(
+    playlist: list[BeatContainer],
+    bank: SampleBank,
+    path: str,
+    sample_rate: int | None = None,
+) -> float:
+    """Render a playlist to a wav file, returns its length in seconds."""
+    mix, sample_rate = render_playlist(playlist, bank, sample_rate)
+    write_wav(path, mix, sample_rate)
+    return len(mix) / sample_rate
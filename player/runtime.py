@@ -1,29 +1,130 @@
-import time
+import bisect
+import math
 
 from typing import Callable
 
-from chart.parser import Line, BeatLine, CommandLine
+from chart.beat import Beat
+from chart.parser import Line, BeatLine
 
 # from chart.note import SingleNote
 from player.interal import InternalProperty
 from player.pattern import get_notes_pattern_in_beat, NoteContainer
-from player.command import command_registry
-from player.utils import FlagBoolean, wait_until_or_cancel
+from player.calibration import output_latency
+from player.clock import Clock, real_clock
+from player.positions import SourceIndex
+from player.tempo import TempoMap, TempoSegment
+from player.handlers.base import (
+    EventDispatcher,
+    FunctionBackend,
+    OutputBackend,
+    group_by_play_time,
+)
+from player.utils import FlagBoolean
+from shared import tracing
 
 import threading
 
 
 class BeatContainer:
+    __slots__ = ("beat_id", "notes", "begin_time", "line_number")
+
     beat_id: int
     notes: list[NoteContainer]
-    begin_time: float = 0.0  # in seconds
+    begin_time: float  # in seconds
+    line_number: int | None  # the chart line of the beat
 
     def __init__(
-        self, beat_id: int, notes: list[NoteContainer], begin_time: float = 0.0
+        self,
+        beat_id: int,
+        notes: list[NoteContainer],
+        begin_time: float = 0.0,
+        line_number: int | None = None,
     ) -> None:
         self.beat_id = beat_id
         self.notes = notes
         self.begin_time = begin_time
+        self.line_number = line_number
+
+
+DENSITY_WINDOW = 1.0  # seconds
+
+
+class DensityProfile:
+    """
+    The note density of a playlist, in notes per second over a sliding window.
+
+    Attributes:
+    window: The length of the sliding window in seconds.
+    begin_times: The begin time of every beat.
+    rates: For every beat, the notes per second in the window starting at the beat.
+    """
+
+    window: float
+    begin_times: list[float]
+    rates: list[float]
+
+    def __init__(
+        self, beat_containers: list[BeatContainer], window: float = DENSITY_WINDOW
+    ) -> None:
+        self.window = window
+        self.begin_times = [beat.begin_time for beat in beat_containers]
+        play_times = sorted(
+            nc.play_time for beat in beat_containers for nc in beat.notes
+        )
+        self.rates = []
+        first = 0
+        for begin_time in self.begin_times:
+            # beats are in time order, so both ends of the window only move forward
+            while first < len(play_times) and play_times[first] < begin_time:
+                first += 1
+            last = bisect.bisect_left(play_times, begin_time + window, lo=first)
+            self.rates.append((last - first) / window)
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def rate_at(self, time_point: float) -> float:
+        """The density of the window starting at the last beat before time_point."""
+        index = bisect.bisect_right(self.begin_times, time_point) - 1
+        return self.rates[index] if index >= 0 else 0.0
+
+    def peak_rate(
+        self, start_time: float | None = None, end_time: float | None = None
+    ) -> float:
+        """The highest density of the beats beginning in [start_time, end_time), the whole chart by default."""
+        start = (
+            0
+            if start_time is None
+            else bisect.bisect_left(self.begin_times, start_time)
+        )
+        end = (
+            len(self.rates)
+            if end_time is None
+            else bisect.bisect_left(self.begin_times, end_time)
+        )
+        return max(self.rates[start:end], default=0.0)
+
+
+def layout_beat(
+    beat: Beat, beat_id: int, segment: TempoSegment, line_number: int | None
+) -> BeatContainer:
+    """Time the notes of a beat, segment is the tempo segment the beat is in."""
+    current_time = segment.beat_to_time(beat_id)
+    note_containers = get_notes_pattern_in_beat(beat, segment.internal_property)
+    ncs: list[NoteContainer] = []
+    for nc in note_containers:
+        nc_absolute = NoteContainer(
+            note=nc.note,
+            play_time=current_time + nc.relative_play_time,
+            duration=nc.duration,
+        )
+        ncs.append(nc_absolute)
+    return BeatContainer(
+        beat_id=beat_id,
+        notes=ncs,
+        begin_time=current_time,
+        line_number=line_number,
+    )
 
 
 class ChartRuntime:
@@ -31,107 +132,456 @@ class ChartRuntime:
     A class representing the runtime environment for chart playback.
     Attributes:
     internal_property: An instance of InternalProperty containing internal properties for playback.
+    tempo_map: The tempo map of the lines, built on first use.
+    source_index: The index between text positions and beat ids, built on first use.
     """
 
     internal_property: InternalProperty
     lines: list[Line]
-    playlist: list[BeatContainer] = []
+    playlist: list[BeatContainer]
+    density_profile: DensityProfile
+    tempo_map: TempoMap | None
+    source_index: SourceIndex | None
 
     def __init__(self, internal_property: InternalProperty, lines: list[Line]) -> None:
         self.internal_property = internal_property
         self.lines = lines
+        self.playlist = []
+        self.density_profile = DensityProfile([])
+        self.tempo_map = None
+        self.source_index = None
 
     def update_lines(self, lines: list[Line]) -> None:
         self.lines = lines
+        self.tempo_map = None
+        self.source_index = None
         self.caculate_playlist()
 
+    def get_tempo_map(self) -> TempoMap:
+        """The tempo map of the lines, raises CommandParseError for an invalid command."""
+        if self.tempo_map is None:
+            self.tempo_map = TempoMap.from_lines(self.lines, self.internal_property)
+        return self.tempo_map
+
+    def get_source_index(self) -> SourceIndex:
+        if self.source_index is None:
+            self.source_index = SourceIndex.from_lines(self.lines)
+        return self.source_index
+
     def caculate_playlist(self) -> None:
         """Calculate the playlist based on the current lines and internal properties."""
-        current_time = 0.0  # in seconds
-        current_ip = self.internal_property.copy()
-        for line in self.lines:
-            if isinstance(line, BeatLine):
+        with tracing.span("caculate_playlist", "compile", lines=len(self.lines)):
+            self.playlist = self._layout(self.lines, self.get_tempo_map(), 0)
+        self.density_profile = DensityProfile(self.playlist)
+
+    def replace_lines(
+        self, first_line: int, removed_count: int, new_lines: list[Line]
+    ) -> int:
+        """
+        Replace removed_count lines starting at first_line (counted from 1) by new_lines
+        and recompile the playlist from the first beat the edit touches.
+
+        The beats before it are kept as they are. Nothing changes if the edited chart
+        fails to compile.
+        Returns:
+        The beat id of the first beat that may have changed.
+        """
+        begin = first_line - 1
+        lines = self.lines[:begin] + new_lines + self.lines[begin + removed_count :]
+        first_beat_id = sum(
+            len(line.beats) for line in self.lines[:begin] if isinstance(line, BeatLine)
+        )
+        with tracing.span("replace_lines", "compile", lines=len(new_lines)):
+            self._number_lines(lines[begin:], first_line)
+            try:
+                tempo_map = TempoMap.from_lines(lines, self.internal_property)
+                playlist = self.playlist[:first_beat_id] + self._layout(
+                    lines, tempo_map, first_beat_id
+                )
+            except Exception:
+                self._number_lines(self.lines[begin:], first_line)
+                raise
+        if self.source_index is not None:
+            self.source_index.replace_lines(first_line, removed_count, new_lines)
+        self.lines = lines
+        self.tempo_map = tempo_map
+        self.playlist = playlist
+        self.density_profile = DensityProfile(playlist)
+        return first_beat_id
+
+    @staticmethod
+    def _number_lines(lines: list[Line], first_line: int) -> None:
+        for line_number, line in enumerate(lines, start=first_line):
+            if line.line_number != line_number:
+                line.set_line_number(line_number)
+                if isinstance(line, BeatLine):
+                    line.set_beat_positions()
+
+    @staticmethod
+    def _layout(
+        lines: list[Line], tempo_map: TempoMap, first_beat_id: int
+    ) -> list[BeatContainer]:
+        """The beats of the lines from first_beat_id on, timed by tempo_map."""
+        segments = tempo_map.segments
+        segment_index = tempo_map.segment_index_at_beat(first_beat_id)
+        segment = segments[segment_index]
+        playlist: list[BeatContainer] = []
+        beat_id = 0
+        for line in lines:
+            if not isinstance(line, BeatLine):
+                continue
+            if beat_id + len(line.beats) <= first_beat_id:
+                beat_id += len(line.beats)
+                continue
+            with tracing.span("layout_line", "compile", line=line.line_number):
                 for beat in line.beats:
-                    note_containers = get_notes_pattern_in_beat(beat, current_ip)
-                    ncs: list[NoteContainer] = []
-                    for nc in note_containers:
-                        nc_absolute = NoteContainer(
-                            note=nc.note,
-                            play_time=current_time + nc.relative_play_time,
-                        )
-                        ncs.append(nc_absolute)
-                    beat_container = BeatContainer(
-                        beat_id=len(self.playlist),
-                        notes=ncs,
-                        begin_time=current_time,
+                    if beat_id < first_beat_id:
+                        beat_id += 1
+                        continue
+                    while (
+                        segment_index + 1 < len(segments)
+                        and segments[segment_index + 1].start_beat <= beat_id
+                    ):
+                        segment_index += 1
+                        segment = segments[segment_index]
+                    playlist.append(
+                        layout_beat(beat, beat_id, segment, line.line_number)
                     )
-                    self.playlist.append(beat_container)
-                    beat_duration = 60.0 / current_ip.bpm
-                    current_time += beat_duration
-            elif isinstance(line, CommandLine):
-                command_registry.execute_command(line.command, line.args, current_ip)
+                    beat_id += 1
+        return playlist
 
     def get_playlist(self) -> list[BeatContainer]:
         return self.playlist
 
+    def get_density_profile(self) -> DensityProfile:
+        return self.density_profile
+
 
 NotePlayHandler = Callable[[NoteContainer, FlagBoolean, float], None]
+NotePrefetchHandler = Callable[[list[NoteContainer]], None]
+# schedules all notes of a beat at once and returns immediately
+NoteBatchHandler = Callable[[list[NoteContainer], FlagBoolean, float], None]
 
 
 class PlayerThreadingPool:
+    """
+    Plays a playlist on one or more outputs.
+
+    Beats are staged ahead of their begin time by a lookahead sized from the
+    density profile: between MIN_ADVANCE_TIME for sparse passages and
+    ADVANCE_TIME when a burst of DENSE_RATE notes per second or more is coming.
+    Every group of notes sharing a play time becomes one event on the pool's
+    dispatcher, which fires it on all outputs; outputs with a latency offset get
+    their own, earlier event. The dispatcher gets one more thread for every
+    NOTES_PER_WORKER notes per second of the coming passage.
+
+    play runs on its own thread in real time. run plays in the calling thread and,
+    on a VirtualClock, jumps from one deadline to the next, so a whole chart is
+    played in the time it takes to schedule it. swap_beats replaces the beats not
+    staged yet while playing, e.g. after the chart was edited. While
+    awaiting_beats is set, play waits at the end of the beats for append_beats
+    instead of returning, so a chart can be played as it streams in; this needs
+    a real clock.
+    Attributes:
+    outputs: The outputs the notes are sent to.
+    latencies: The latency offset of every output in seconds, the output is fired that much earlier.
+    density_profile: The note density of the beats.
+    clock: The clock the playback is timed on.
+    awaiting_beats: Whether more beats will be appended, see end_beats.
+    """
+
     stop_flag: FlagBoolean
     begin_time: float
     current_beat_index: int
     beats: list[BeatContainer]
-    ADVANCE_TIME: float = 3.0
-    handler: NotePlayHandler
+    awaiting_beats: bool
+    ADVANCE_TIME: float = 3.0  # the longest lookahead
+    MIN_ADVANCE_TIME: float = 0.5
+    DENSE_RATE: float = 16.0  # notes per second that get the longest lookahead
+    NOTES_PER_WORKER: float = 8.0
+    MAX_WORKERS: int = 4
+    START_DELAY: float = 0.5  # seconds from play to the first beat
+    outputs: list[OutputBackend]
+    latencies: list[float]
+    batch_handler: NoteBatchHandler | None  # called with every staged beat
+    prefetch: NotePrefetchHandler | None  # called when a beat is staged
 
-    def __init__(self, beats: list[BeatContainer], handler: NotePlayHandler) -> None:
+    def __init__(
+        self,
+        beats: list[BeatContainer],
+        handler: (
+            NotePlayHandler
+            | OutputBackend
+            | list[NotePlayHandler | OutputBackend]
+            | None
+        ) = None,
+        prefetch: NotePrefetchHandler | None = None,
+        batch_handler: NoteBatchHandler | None = None,
+        latencies: list[float] | None = None,
+        density_profile: DensityProfile | None = None,
+        clock: Clock = real_clock,
+    ) -> None:
+        """
+        Args:
+            beats: The playlist to play.
+            handler: A function playing a single note, an OutputBackend, or a list of them to play on all at once.
+            prefetch: Called with the notes of every beat when it is staged, in addition to the outputs' prefetch.
+            batch_handler: A function scheduling all notes of a beat by itself.
+            latencies: The latency offset of every output, defaults to the calibrated latency of each backend.
+            density_profile: The density profile of beats, calculated if not given.
+            clock: The clock to play on, e.g. a VirtualClock for checks that shouldn't take real time.
+        """
+        if handler is None:
+            handlers = []
+        elif isinstance(handler, list):
+            handlers = handler
+        else:
+            handlers = [handler]
+        if not handlers and batch_handler is None:
+            raise ValueError("Either handler or batch_handler must be given.")
+        self.outputs = [
+            h if isinstance(h, OutputBackend) else FunctionBackend(h) for h in handlers
+        ]
+        if latencies is None:
+            latencies = [output_latency(output) for output in self.outputs]
+        if len(latencies) != len(self.outputs):
+            raise ValueError("One latency offset is needed for every output.")
+        self.latencies = latencies
         self.beats = beats
-        self.handler = handler
+        if density_profile is None:
+            density_profile = DensityProfile(beats)
+        self.density_profile = density_profile
+        self.batch_handler = batch_handler
+        self.prefetch = prefetch
+        self.clock = clock
+        self.dispatcher = EventDispatcher(clock)
         self.stop_flag = FlagBoolean(False)
         self.begin_time = 0.0
         self.current_beat_index = 0
+        self.awaiting_beats = False
+        self._stage_lock = threading.Lock()  # held while beats are read or staged
+        self._wake_flag = FlagBoolean(False)  # ends the wait for the next beat
 
     def reset(self) -> None:
-        self.stop_flag.modify(False)
+        self.stop_flag = FlagBoolean(False)  # events of the last run keep their flag
         self.begin_time = 0.0
         self.current_beat_index = 0
 
     def play_loop(self):
-        while self.current_beat_index < len(self.beats):
-            if self.stop_flag.get():
-                break
-            beat_container = self.beats[self.current_beat_index]
-            status = wait_until_or_cancel(
-                beat_container.begin_time + self.begin_time - self.ADVANCE_TIME,
-                self.stop_flag,
+        while not self.stop_flag.get():
+            with self._stage_lock:
+                if self.current_beat_index < len(self.beats):
+                    beat_container = self.beats[self.current_beat_index]
+                elif self.awaiting_beats:
+                    beat_container = None
+                else:
+                    break
+                self._wake_flag.modify(False)
+            if beat_container is None:
+                self.clock.sleep_until(math.inf, self._wake_flag)  # until appended
+                continue
+            lookahead, workers = self.plan_ahead(beat_container.begin_time)
+            status = self.clock.sleep_until(
+                beat_container.begin_time + self.begin_time - lookahead,
+                self._wake_flag,
+            )
+            if not status:
+                continue  # stopped, or the beats were swapped
+            with self._stage_lock:
+                if (
+                    self.current_beat_index >= len(self.beats)
+                    or self.beats[self.current_beat_index] is not beat_container
+                ):
+                    continue
+                if workers != self.dispatcher.workers:
+                    self.dispatcher.set_workers(workers)
+                with tracing.span("stage_beat", "player", beat=beat_container.beat_id):
+                    self.stage_beat(beat_container)
+                self.current_beat_index += 1
+            if tracing.active_tracer() is not None:
+                tracing.increment("notes_scheduled", len(beat_container.notes))
+                tracing.counter("threads_alive", threading.active_count())
+                tracing.counter("pending_events", self.dispatcher.pending())
+
+    def swap_beats(
+        self,
+        beats: list[BeatContainer],
+        density_profile: DensityProfile | None = None,
+    ) -> int:
+        """
+        Replace the beats that are not staged yet, without interrupting playback.
+
+        Staged beats keep playing as they were. The new playlist continues after the
+        begin time of the last staged beat, on the same chart time.
+        Returns:
+        The index in beats of the next beat to stage.
+        """
+        if density_profile is None:
+            density_profile = DensityProfile(beats)
+        with self._stage_lock:
+            if self.current_beat_index > 0:
+                staged_until = self.beats[self.current_beat_index - 1].begin_time
+                index = bisect.bisect_right(
+                    [beat.begin_time for beat in beats], staged_until
+                )
+            else:
+                index = 0
+            self.beats = beats
+            self.density_profile = density_profile
+            self.current_beat_index = index
+            self._wake_flag.modify(True)
+        return index
+
+    def append_beats(self, beats: list[BeatContainer]) -> None:
+        """
+        Add beats after the last one, while playing or not.
+
+        The beats are added to the pool's list in place. The density profile is
+        recalculated over the beats not staged yet only, so appending stays cheap
+        however long the pool has been playing.
+        """
+        with self._stage_lock:
+            self.beats.extend(beats)
+            self.density_profile = DensityProfile(
+                self.beats[max(self.current_beat_index - 1, 0) :]
             )
-            if status:
-                threading.Thread(
-                    target=self.beat_handler, args=(beat_container,)
-                ).start()
-            self.current_beat_index += 1
-
-    def beat_handler(self, beat_container: BeatContainer) -> None:
-        status = wait_until_or_cancel(
-            beat_container.begin_time + self.begin_time - 0.5, self.stop_flag
+            self._wake_flag.modify(True)
+
+    def postpone(self, seconds: float) -> None:
+        """Play the beats not staged yet seconds later, staged notes keep their time."""
+        with self._stage_lock:
+            self.begin_time += seconds
+            self._wake_flag.modify(True)
+
+    def end_beats(self) -> None:
+        """No more beats will be appended, play returns after the last one."""
+        with self._stage_lock:
+            self.awaiting_beats = False
+            self._wake_flag.modify(True)
+
+    def plan_ahead(self, begin_time: float) -> tuple[float, int]:
+        """Get the lookahead and the dispatcher threads for the beat beginning at begin_time."""
+        peak = self.density_profile.peak_rate(
+            begin_time, begin_time + self.ADVANCE_TIME
         )
-        if status:
-            for note_container in beat_container.notes:
-                threading.Thread(
-                    target=self.handler,
-                    args=(note_container, self.stop_flag, self.begin_time),
-                ).start()
+        lookahead = self.MIN_ADVANCE_TIME + (
+            self.ADVANCE_TIME - self.MIN_ADVANCE_TIME
+        ) * min(peak / self.DENSE_RATE, 1.0)
+        workers = min(1 + int(peak / self.NOTES_PER_WORKER), self.MAX_WORKERS)
+        return lookahead, workers
+
+    def stage_beat(self, beat_container: BeatContainer) -> None:
+        """Schedule the notes of a beat on every output."""
+        if self.prefetch is not None:
+            self.prefetch(beat_container.notes)
+        for output in self.outputs:
+            output.prefetch(beat_container.notes)
+        if self.batch_handler is not None:
+            self.batch_handler(beat_container.notes, self.stop_flag, self.begin_time)
+        if not self.outputs:
+            return
+
+        # outputs sharing a latency offset share one event
+        outputs_by_latency: dict[float, list[OutputBackend]] = {}
+        for output, latency in zip(self.outputs, self.latencies):
+            outputs_by_latency.setdefault(latency, []).append(output)
+        for play_time, group in group_by_play_time(beat_container.notes).items():
+            for latency, outputs in outputs_by_latency.items():
+                self.dispatcher.schedule(
+                    play_time + self.begin_time - latency,
+                    self.fire_outputs,
+                    outputs,
+                    group,
+                    self.begin_time - latency,
+                    cancel_flag=self.stop_flag,
+                )
+
+    def fire_outputs(
+        self,
+        outputs: list[OutputBackend],
+        note_containers: list[NoteContainer],
+        begin_time: float,
+    ) -> None:
+        traced = tracing.active_tracer() is not None
+        for output in outputs:
+            # a failing output is reported, the others still play the notes
+            try:
+                if not traced:
+                    output.fire(note_containers, begin_time)
+                    continue
+                with tracing.span(
+                    output.name(),
+                    "output",
+                    notes=len(note_containers),
+                    time=begin_time,
+                ):
+                    output.fire(note_containers, begin_time)
+            except Exception as e:
+                self.dispatcher.report_error(output.name(), e)
 
     def stop(self) -> None:
         self.stop_flag.modify(True)
+        self._wake_flag.modify(True)
+        self.dispatcher.close()
+        for output in self.outputs:
+            output.close()
 
     def play(self) -> float:  # return: the begin time
         if len(self.beats) == 0:
             return 0.0
         self.begin_time = (
-            time.time() + 0.5 - self.beats[self.current_beat_index].begin_time
+            self.clock.now()
+            + self.START_DELAY
+            - self.beats[self.current_beat_index].begin_time
         )
         threading.Thread(target=self.play_loop).start()
         return self.begin_time
+
+    def run(self) -> float:
+        """
+        Play in the calling thread until every note was fired or the pool is stopped.
+        Returns:
+        The begin time.
+        """
+        if len(self.beats) == 0:
+            return 0.0
+        self.begin_time = (
+            self.clock.now()
+            + self.START_DELAY
+            - self.beats[self.current_beat_index].begin_time
+        )
+        try:
+            if not self.clock.virtual:
+                # the dispatcher threads fire the events, wait for the last one
+                self.play_loop()
+                while (
+                    self.dispatcher.pending()
+                    and self.dispatcher.is_running()
+                    and not self.stop_flag.get()
+                ):
+                    self.clock.sleep_until(self.clock.now() + 0.01, self.stop_flag)
+                return self.begin_time
+
+            # step from deadline to deadline, staging beats and firing events in order
+            while not self.stop_flag.get():
+                stage_time: float | None = None
+                if self.current_beat_index < len(self.beats):
+                    beat_container = self.beats[self.current_beat_index]
+                    lookahead, _ = self.plan_ahead(beat_container.begin_time)
+                    stage_time = beat_container.begin_time + self.begin_time - lookahead
+                fire_time = self.dispatcher.next_fire_time()
+                if stage_time is not None and (
+                    fire_time is None or stage_time <= fire_time
+                ):
+                    self.clock.sleep_until(stage_time, self.stop_flag)
+                    self.stage_beat(beat_container)
+                    self.current_beat_index += 1
+                elif fire_time is not None:
+                    self.clock.sleep_until(fire_time, self.stop_flag)
+                    self.dispatcher.run_due()
+                else:
+                    break
+            return self.begin_time
+        finally:
+            # every event was fired or canceled, end the dispatch threads
+            self.dispatcher.close()
@@ -0,0 +1,426 @@
+import os
+import wave
+import queue
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+from chart.constants import ChartNotation, NOTATION_INDEX_TABLE
+from shared.lazy import lazy_import
+from shared.utils import AUDIO_DIR, CACHE_DIR
+
+np = lazy_import("numpy")  # imported when the first sample is decoded or resampled
+
+SAMPLE_CACHE_DIR = os.path.join(CACHE_DIR, "samples")
+
+SAMPLE_FORMAT_VERSION = 1  # bump when the synthesis changes, invalidates cached samples
+
+RECORDED_EXTENSIONS = (".wav", ".mp3")  # in order of preference
+
+DECODABLE_EXTENSIONS = (".wav",)  # formats that can be used as resampling sources
+
+DEFAULT_INSTRUMENT = "default"  # the samples directly inside the audio folder
+
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # bytes of decoded pcm kept in memory
+
+_SCALE_SEMITONES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+
+NOTE_SEMITONES: dict[ChartNotation, int] = {
+    token: _SCALE_SEMITONES[token[0]] + 12 * int(token[1:])
+    for token in NOTATION_INDEX_TABLE
+}
+
+
+class SampleBankError(Exception):
+    def __init__(self, message: str, token: str) -> None:
+        super().__init__(message)
+        self.token = token
+
+
+PCMSample = tuple["np.ndarray", int]  # (pcm, sample_rate)
+
+
+def read_wav(path: str) -> tuple["np.ndarray", int]:
+    """Read a PCM wav file.
+    Returns:
+    A tuple of (pcm, sample_rate). pcm is a float32 array of shape (frames, channels) in [-1, 1].
+    """
+    with wave.open(path, "rb") as wf:
+        channels = wf.getnchannels()
+        width = wf.getsampwidth()
+        sample_rate = wf.getframerate()
+        raw = wf.readframes(wf.getnframes())
+
+    if width == 1:
+        pcm = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        pcm = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        pcm = values.astype(np.float32) / float(1 << 23)
+    elif width == 4:
+        pcm = np.frombuffer(raw, dtype="<i4").astype(np.float32) / float(1 << 31)
+    else:
+        raise ValueError(f"Unsupported sample width {width} in {path}")
+    return pcm.reshape(-1, channels), sample_rate
+
+
+def write_wav(path: str, pcm: "np.ndarray", sample_rate: int) -> None:
+    """Write a float pcm array of shape (frames, channels) as a 16-bit wav file."""
+    if pcm.ndim == 1:
+        pcm = pcm.reshape(-1, 1)
+    data = (np.clip(pcm, -1.0, 1.0) * 32767.0).astype("<i2")
+    tmp_path = path + ".tmp"
+    with wave.open(tmp_path, "wb") as wf:
+        wf.setnchannels(pcm.shape[1])
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(data.tobytes())
+    os.replace(tmp_path, path)  # never leave a half written sample in the cache
+
+
+def pitch_shift(pcm: "np.ndarray", semitones: int) -> "np.ndarray":
+    """Shift the pitch of a sample by resampling it.
+
+    The sample is read back at 2 ** (semitones / 12) times the original speed with
+    linear interpolation, for all frames and channels at once. Like a real
+    instrument sampler, the duration changes together with the pitch.
+    """
+    if semitones == 0 or len(pcm) < 2:
+        return pcm.copy()
+    ratio = 2.0 ** (semitones / 12.0)
+    num_frames = int((len(pcm) - 1) / ratio) + 1
+    positions = np.arange(num_frames, dtype=np.float64) * ratio
+    left = positions.astype(np.int64)
+    right = np.minimum(left + 1, len(pcm) - 1)
+    frac = (positions - left).astype(np.float32)[:, None]
+    return pcm[left] * (1.0 - frac) + pcm[right] * frac
+
+
+class PCMCache:
+    """
+    A thread safe LRU cache of decoded samples, limited by memory.
+
+    The decoded pcm feeds pitch shifting, offline rendering and the benchmarks.
+    Live playback goes through playsound, which only plays files, so it reads
+    the sample files instead and is not served from this cache.
+    Attributes:
+    memory_budget: The maximum number of bytes of pcm kept, the least recently used samples are evicted first.
+    """
+
+    memory_budget: int
+
+    def __init__(self, memory_budget: int = DEFAULT_MEMORY_BUDGET) -> None:
+        self.memory_budget = memory_budget
+        self._entries: OrderedDict[tuple[str, str], PCMSample] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple[str, str]) -> PCMSample | None:
+        with self._lock:
+            sample = self._entries.get(key)
+            if sample is not None:
+                self._entries.move_to_end(key)
+            return sample
+
+    def put(self, key: tuple[str, str], sample: PCMSample) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[0].nbytes
+            self._entries[key] = sample
+            self._nbytes += sample[0].nbytes
+            self._evict()
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        with self._lock:
+            self.memory_budget = memory_budget
+            self._evict()
+
+    def discard(self, prefix: str) -> None:
+        """Drop every sample whose key starts with the given bank folder."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == prefix]:
+                self._nbytes -= self._entries.pop(key)[0].nbytes
+
+    def _evict(self) -> None:
+        # the newest entry is always kept, even if it is larger than the budget alone
+        while self._nbytes > self.memory_budget and len(self._entries) > 1:
+            _, sample = self._entries.popitem(last=False)
+            self._nbytes -= sample[0].nbytes
+
+
+class SampleBank:
+    """
+    A bank of note samples loaded from one audio folder.
+
+    Notes without a recorded sample are synthesized from the nearest recorded
+    (decodable) note by pitch shifting, and cached as wav files so they are only
+    computed once. Samples are loaded lazily, decoded pcm lives in a PCMCache that
+    may be shared between banks.
+    Attributes:
+    audio_dir: The folder containing the recorded samples, named after the chart notation (e.g. C4.wav).
+    cache_dir: The folder where synthesized samples are stored.
+    pcm_cache: The cache holding the decoded samples.
+    """
+
+    audio_dir: str
+    cache_dir: str
+    pcm_cache: PCMCache
+
+    def __init__(
+        self,
+        audio_dir: str = AUDIO_DIR,
+        cache_dir: str = SAMPLE_CACHE_DIR,
+        pcm_cache: PCMCache | None = None,
+    ) -> None:
+        self.audio_dir = audio_dir
+        self.cache_dir = cache_dir
+        self.pcm_cache = pcm_cache if pcm_cache is not None else PCMCache()
+        self._recorded: dict[ChartNotation, str] | None = None
+        self._ready: set[ChartNotation] = set()
+        self._lock = threading.RLock()
+
+    def rescan(self) -> None:
+        """Forget the known recorded samples, e.g. after files were added."""
+        self._recorded = None
+        self._ready.clear()
+        self.pcm_cache.discard(self.audio_dir)
+
+    def recorded_samples(self) -> dict[ChartNotation, str]:
+        """Get the recorded sample path of every note that has one."""
+        if self._recorded is None:
+            recorded: dict[ChartNotation, str] = {}
+            try:
+                file_names = set(os.listdir(self.audio_dir))
+            except OSError:
+                file_names = set()
+            for token in NOTATION_INDEX_TABLE:
+                for ext in RECORDED_EXTENSIONS:
+                    if token + ext in file_names:
+                        recorded[token] = os.path.join(self.audio_dir, token + ext)
+                        break
+            self._recorded = recorded
+        return self._recorded
+
+    def source_for(self, token: ChartNotation) -> ChartNotation | None:
+        """Get the recorded note a sample can be synthesized from, None if there is none."""
+        candidates = [
+            source
+            for source, path in self.recorded_samples().items()
+            if path.endswith(DECODABLE_EXTENSIONS)
+        ]
+        if not candidates:
+            return None
+        # nearest in pitch; on a tie prefer shifting down, which keeps the sample longer
+        return min(
+            candidates,
+            key=lambda source: (
+                abs(NOTE_SEMITONES[source] - NOTE_SEMITONES[token]),
+                NOTE_SEMITONES[source] < NOTE_SEMITONES[token],
+            ),
+        )
+
+    def is_recorded(self, token: ChartNotation) -> bool:
+        return token in self.recorded_samples()
+
+    def available(self) -> bool:
+        """Check whether every note can be played, recorded or synthesized."""
+        recorded = self.recorded_samples()
+        if len(recorded) == len(NOTATION_INDEX_TABLE):
+            return True
+        return any(path.endswith(DECODABLE_EXTENSIONS) for path in recorded.values())
+
+    def _synthesized_path(self, token: ChartNotation, source: ChartNotation) -> str:
+        source_path = self.recorded_samples()[source]
+        stat = os.stat(source_path)
+        key = f"{SAMPLE_FORMAT_VERSION}|{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{token}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{token}-{digest}.wav")
+
+    def is_ready(self, token: ChartNotation) -> bool:
+        """Check whether the note can be played without synthesizing it first."""
+        if token in self._ready or self.is_recorded(token):
+            return True
+        source = self.source_for(token)
+        if source is not None and os.path.isfile(self._synthesized_path(token, source)):
+            self._ready.add(token)
+            return True
+        return False
+
+    def get_path(self, token: ChartNotation) -> str:
+        """Get a playable file for the note, synthesizing it on first use."""
+        recorded = self.recorded_samples().get(token)
+        if recorded is not None:
+            return recorded
+        source = self.source_for(token)
+        if source is None:
+            raise SampleBankError(f"No sample available for note {token}", token)
+        path = self._synthesized_path(token, source)
+        if not os.path.isfile(path):
+            with self._lock:  # the prefetcher may be synthesizing the same note
+                if not os.path.isfile(path):
+                    pcm, sample_rate = self.get_pcm(token)
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    write_wav(path, pcm, sample_rate)
+        self._ready.add(token)
+        return path
+
+    def get_pcm(self, token: ChartNotation) -> PCMSample:
+        """Get the decoded sample of the note as (pcm, sample_rate)."""
+        key = (self.audio_dir, token)
+        cached = self.pcm_cache.get(key)
+        if cached is not None:
+            return cached
+        recorded = self.recorded_samples().get(token)
+        if recorded is not None and recorded.endswith(DECODABLE_EXTENSIONS):
+            result = read_wav(recorded)
+        else:
+            # mp3 samples can't be decoded here, resample the nearest wav instead
+            source = self.source_for(token)
+            if source is None:
+                raise SampleBankError(f"No decodable sample for note {token}", token)
+            synthesized = self._synthesized_path(token, source)
+            if os.path.isfile(synthesized):
+                result = read_wav(synthesized)
+            else:
+                source_pcm, sample_rate = self.get_pcm(source)
+                shift = NOTE_SEMITONES[token] - NOTE_SEMITONES[source]
+                result = (pitch_shift(source_pcm, shift), sample_rate)
+        self.pcm_cache.put(key, result)
+        return result
+
+    def build(self) -> list[ChartNotation]:
+        """Synthesize every missing note ahead of time.
+        Returns:
+        The notes that are synthesized rather than recorded.
+        """
+        synthesized: list[ChartNotation] = []
+        for token in NOTATION_INDEX_TABLE:
+            if not self.is_recorded(token):
+                self.get_path(token)
+                synthesized.append(token)
+        return synthesized
+
+
+class InstrumentLibrary:
+    """
+    A collection of named instrument sample banks.
+
+    The samples directly in the root folder form the default instrument, every sub
+    folder containing samples is another instrument named after the folder. Banks
+    are created on first use and share one PCMCache, so switching instruments never
+    keeps more decoded pcm than the memory budget allows.
+    Attributes:
+    root_dir: The folder containing the instruments.
+    current: The name of the selected instrument.
+    pcm_cache: The cache shared by all banks.
+    """
+
+    root_dir: str
+    current: str
+    pcm_cache: PCMCache
+
+    def __init__(
+        self,
+        root_dir: str = AUDIO_DIR,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        cache_dir: str = SAMPLE_CACHE_DIR,
+    ) -> None:
+        self.root_dir = root_dir
+        self.cache_dir = cache_dir
+        self.current = DEFAULT_INSTRUMENT
+        self.pcm_cache = PCMCache(memory_budget)
+        self._banks: dict[str, SampleBank] = {}
+        self._prefetch_queue: queue.Queue[tuple[SampleBank, ChartNotation]] = (
+            queue.Queue()
+        )
+        self._prefetch_thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def names(self) -> list[str]:
+        """List the instruments available in the root folder."""
+        names = [DEFAULT_INSTRUMENT]
+        try:
+            entries = sorted(os.listdir(self.root_dir))
+        except OSError:
+            return names
+        for entry in entries:
+            path = os.path.join(self.root_dir, entry)
+            if os.path.isdir(path) and SampleBank(path).recorded_samples():
+                names.append(entry)
+        return names
+
+    def get_bank(self, name: str | None = None) -> SampleBank:
+        """Get the bank of an instrument, the current one if name is None."""
+        if name is None:
+            name = self.current
+        with self._lock:
+            bank = self._banks.get(name)
+            if bank is None:
+                if name == DEFAULT_INSTRUMENT:
+                    audio_dir = self.root_dir
+                else:
+                    audio_dir = os.path.join(self.root_dir, name)
+                    if not os.path.isdir(audio_dir):
+                        raise KeyError(f"Unknown instrument: {name}")
+                bank = SampleBank(
+                    audio_dir,
+                    os.path.join(self.cache_dir, name),
+                    pcm_cache=self.pcm_cache,
+                )
+                self._banks[name] = bank
+            return bank
+
+    def select(self, name: str) -> SampleBank:
+        """Switch the current instrument."""
+        bank = self.get_bank(name)
+        self.current = name
+        return bank
+
+    def set_memory_budget(self, memory_budget: int) -> None:
+        self.pcm_cache.set_memory_budget(memory_budget)
+
+    def prefetch(self, tokens: list[ChartNotation], name: str | None = None) -> None:
+        """Prepare the samples of the given notes in the background.
+
+        Notes that are already playable without synthesis are skipped, so calling
+        this for every beat staged by the player is cheap.
+        """
+        bank = self.get_bank(name)
+        pending = [token for token in dict.fromkeys(tokens) if not bank.is_ready(token)]
+        if not pending:
+            return
+        for token in pending:
+            self._prefetch_queue.put((bank, token))
+        with self._lock:
+            if self._prefetch_thread is None:
+                self._prefetch_thread = threading.Thread(
+                    target=self._prefetch_loop, daemon=True
+                )
+                self._prefetch_thread.start()
+
+    def _prefetch_loop(self) -> None:
+        while True:
+            try:
+                bank, token = self._prefetch_queue.get(timeout=1.0)
+            except queue.Empty:
+                with self._lock:
+                    if self._prefetch_queue.empty():
+                        self._prefetch_thread = None
+                        return
+                continue
+            try:
+                bank.get_path(token)
+            except SampleBankError:
+                pass  # reported again when the note is played
@@ -0,0 +1,213 @@
+import bisect
+import statistics
+
+from chart.constants import KEYBOARD_INDEX_TABLE
+from player.pattern import NoteContainer
+from player.runtime import BeatContainer
+
+DEFAULT_HIT_WINDOW = 0.15  # a press further than this from a note is a miss, in seconds
+
+
+class NoteTiming:
+    """
+    The timing of one expected note in a timed practice.
+    Attributes:
+    note_container: The expected note.
+    line_number: The chart line of the note, None if unknown.
+    press_time: When the matched key was pressed in chart time, None if missed.
+    offset: Seconds the key was pressed late (negative when early), None if missed.
+    """
+
+    note_container: NoteContainer
+    line_number: int | None
+    press_time: float | None
+    offset: float | None
+
+    def __init__(
+        self,
+        note_container: NoteContainer,
+        line_number: int | None,
+        press_time: float | None = None,
+        offset: float | None = None,
+    ) -> None:
+        self.note_container = note_container
+        self.line_number = line_number
+        self.press_time = press_time
+        self.offset = offset
+
+    def __repr__(self) -> str:
+        return (
+            f"NoteTiming(note_container={self.note_container!r}, offset={self.offset})"
+        )
+
+
+def summarize_offsets(offsets: list[float], missed: int = 0) -> dict[str, float]:
+    """Get statistics of timing offsets in seconds."""
+    result: dict[str, float] = {"hit": len(offsets), "missed": missed}
+    if not offsets:
+        return result
+    ordered = sorted(offsets)
+    result.update(
+        {
+            "mean": statistics.fmean(ordered),
+            "mean_abs": statistics.fmean(abs(o) for o in ordered),
+            "stdev": statistics.pstdev(ordered),
+            "min": ordered[0],
+            "median": ordered[len(ordered) // 2],
+            "p95_abs": sorted(abs(o) for o in ordered)[
+                min(len(ordered) - 1, int(len(ordered) * 0.95))
+            ],
+            "max": ordered[-1],
+        }
+    )
+    return result
+
+
+class TimingReport:
+    """
+    The result of a timed practice.
+    Attributes:
+    notes: The timing of every expected note, in play order.
+    extra_presses: The number of presses that matched no note.
+    """
+
+    notes: list[NoteTiming]
+    extra_presses: int
+
+    def __init__(self, notes: list[NoteTiming], extra_presses: int) -> None:
+        self.notes = notes
+        self.extra_presses = extra_presses
+
+    def offsets(self) -> list[float]:
+        return [n.offset for n in self.notes if n.offset is not None]
+
+    def summary(self) -> dict[str, float]:
+        result = summarize_offsets(
+            self.offsets(), sum(1 for n in self.notes if n.offset is None)
+        )
+        result["extra_presses"] = self.extra_presses
+        return result
+
+    def histogram(self, bin_width: float = 0.01) -> dict[float, int]:
+        """Count the offsets in bins of bin_width seconds, keyed by the bin start."""
+        bins: dict[float, int] = {}
+        for offset in self.offsets():
+            start = round((offset // bin_width) * bin_width, 6)
+            bins[start] = bins.get(start, 0) + 1
+        return dict(sorted(bins.items()))
+
+    def sections(self) -> dict[int | None, dict[str, float]]:
+        """Summarize the offsets per chart line."""
+        grouped: dict[int | None, list[NoteTiming]] = {}
+        for note in self.notes:
+            grouped.setdefault(note.line_number, []).append(note)
+        return {
+            line_number: summarize_offsets(
+                [n.offset for n in notes if n.offset is not None],
+                sum(1 for n in notes if n.offset is None),
+            )
+            for line_number, notes in grouped.items()
+        }
+
+
+class TimingSession:
+    """
+    Records key presses during a timed practice and matches them to the notes.
+
+    Recording only appends to a list, so it adds nothing noticeable to the input
+    path; the matching happens in evaluate.
+    Attributes:
+    beat_containers: The beats being practiced.
+    begin_time: The clock value at which the chart time origin is played.
+    origin: The chart time the practice starts at, in seconds.
+    tempo: The speed of the practice relative to the chart, e.g. 0.5 for half speed.
+    hit_window: The largest offset a press may have to count for a note, in seconds.
+    presses: The recorded (key index, clock value) pairs.
+    """
+
+    beat_containers: list[BeatContainer]
+    begin_time: float
+    origin: float
+    tempo: float
+    hit_window: float
+    presses: list[tuple[int, float]]
+
+    def __init__(
+        self,
+        beat_containers: list[BeatContainer],
+        hit_window: float = DEFAULT_HIT_WINDOW,
+    ) -> None:
+        self.beat_containers = beat_containers
+        self.hit_window = hit_window
+        self.begin_time = 0.0
+        self.origin = 0.0
+        self.tempo = 1.0
+        self.presses = []
+
+    def begin(self, begin_time: float, origin: float = 0.0, tempo: float = 1.0) -> None:
+        self.begin_time = begin_time
+        self.origin = origin
+        self.tempo = tempo
+        self.presses = []
+
+    def record_press(self, index: int, timestamp: float) -> None:
+        self.presses.append((index, timestamp))
+
+    @property
+    def end_time(self) -> float:
+        """The clock value after which no press can match a note anymore."""
+        last = self.origin
+        for beat in self.beat_containers:
+            for nc in beat.notes:
+                last = max(last, nc.play_time)
+        return self.to_clock(last) + self.hit_window
+
+    def to_clock(self, chart_time: float) -> float:
+        return self.begin_time + (chart_time - self.origin) / self.tempo
+
+    def evaluate(self) -> TimingReport:
+        """Match every note to the nearest unused press of its key within the hit window."""
+        expected: list[list[NoteTiming]] = [[] for _ in KEYBOARD_INDEX_TABLE]
+        timings: list[NoteTiming] = []
+        for beat in self.beat_containers:
+            for nc in beat.notes:
+                timing = NoteTiming(nc, beat.line_number)
+                timings.append(timing)
+                if nc.note.keyboard is not None:
+                    expected[KEYBOARD_INDEX_TABLE.index(nc.note.keyboard)].append(
+                        timing
+                    )
+
+        press_times: list[list[float]] = [[] for _ in KEYBOARD_INDEX_TABLE]
+        for index, timestamp in self.presses:
+            press_times[index].append(timestamp)
+
+        matched_presses = 0
+        for notes, presses in zip(expected, press_times):
+            presses.sort()
+            used = [False] * len(presses)
+            for timing in sorted(notes, key=lambda t: t.note_container.play_time):
+                play_time = self.to_clock(timing.note_container.play_time)
+                position = bisect.bisect_left(presses, play_time - self.hit_window)
+                best: int | None = None
+                while (
+                    position < len(presses)
+                    and presses[position] <= play_time + self.hit_window
+                ):
+                    if not used[position] and (
+                        best is None
+                        or abs(presses[position] - play_time)
+                        < abs(presses[best] - play_time)
+                    ):
+                        best = position
+                    position += 1
+                if best is not None:
+                    used[best] = True
+                    timing.offset = presses[best] - play_time
+                    timing.press_time = (
+                        self.origin + (presses[best] - self.begin_time) * self.tempo
+                    )
+                    matched_presses += 1
+
+        timings.sort(key=lambda t: t.note_container.play_time)
+        return TimingReport(timings, len(self.presses) - matched_presses)
@@ -0,0 +1,65 @@
+import bisect
+
+from player.runtime import BeatContainer
+
+
+class BeatRangeIndex:
+    """
+    An index over a playlist to find the beats of a section quickly.
+
+    Built once per playlist; every lookup is a dict access or a binary search and
+    returns a (start, end) slice of the playlist, end exclusive.
+    Attributes:
+    beat_containers: The indexed playlist.
+    """
+
+    beat_containers: list[BeatContainer]
+
+    def __init__(self, beat_containers: list[BeatContainer]) -> None:
+        self.beat_containers = beat_containers
+        self.begin_times = [beat.begin_time for beat in beat_containers]
+        self.index_of_beat_id = {
+            beat.beat_id: index for index, beat in enumerate(beat_containers)
+        }
+        # first playlist index of every chart line, in line order
+        self.line_numbers: list[int] = []
+        self.line_starts: list[int] = []
+        for index, beat in enumerate(beat_containers):
+            if beat.line_number is None:
+                continue
+            if not self.line_numbers or self.line_numbers[-1] != beat.line_number:
+                self.line_numbers.append(beat.line_number)
+                self.line_starts.append(index)
+
+    def __len__(self) -> int:
+        return len(self.beat_containers)
+
+    def by_beat_ids(self, first_beat_id: int, last_beat_id: int) -> tuple[int, int]:
+        """The section from the first to the last beat, both included."""
+        try:
+            start = self.index_of_beat_id[first_beat_id]
+            end = self.index_of_beat_id[last_beat_id] + 1
+        except KeyError as e:
+            raise ValueError(f"Unknown beat id {e.args[0]}") from e
+        return self._checked(start, end)
+
+    def by_time(self, start_time: float, end_time: float) -> tuple[int, int]:
+        """The beats overlapping the time range, in seconds."""
+        start = max(bisect.bisect_right(self.begin_times, start_time) - 1, 0)
+        end = bisect.bisect_left(self.begin_times, end_time)
+        return self._checked(start, end)
+
+    def by_lines(self, first_line: int, last_line: int) -> tuple[int, int]:
+        """The beats on the chart lines from first_line to last_line, both included."""
+        first = bisect.bisect_left(self.line_numbers, first_line)
+        last = bisect.bisect_right(self.line_numbers, last_line)
+        if first >= last:
+            raise ValueError(f"No beats on lines {first_line} to {last_line}")
+        start = self.line_starts[first]
+        end = self.line_starts[last] if last < len(self.line_starts) else len(self)
+        return self._checked(start, end)
+
+    def _checked(self, start: int, end: int) -> tuple[int, int]:
+        if not 0 <= start < end <= len(self):
+            raise ValueError(f"Empty section: beats {start} to {end}")
+        return start, end
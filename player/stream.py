@@ -0,0 +1,207 @@
+import threading
+
+from typing import Callable, Iterable
+
+from chart.parser import BeatLine, CommandLine, ParseError, parse_line
+from player.clock import Clock, real_clock
+from player.command import CommandRegistry, command_registry
+from player.handlers.base import OutputBackend
+from player.interal import InternalProperty
+from player.live import RELOAD_ERRORS
+from player.runtime import BeatContainer, PlayerThreadingPool, layout_beat
+from player.tempo import TempoSegment
+from player.utils import FlagBoolean
+from shared import tracing
+
+STREAM_LATENCY = 0.5  # seconds between a beat arriving and it being played
+STREAM_MAX_AHEAD = 30.0  # seconds of input read ahead of the playback at most
+
+# errors that skip a streamed line, the stream goes on
+STREAM_ERRORS = (ParseError, *RELOAD_ERRORS)
+
+
+class StreamCompiler:
+    """
+    Compiles a chart one line at a time, in the order the lines arrive.
+
+    Commands change the running tempo state, which the following beats are
+    timed with; nothing before a line is compiled again. The beats get the same
+    beat ids, times and line numbers as in the playlist of the whole chart.
+    Attributes:
+    segment: The tempo segment the next beat is in.
+    beat_count: The number of beats compiled so far.
+    line_count: The number of lines fed so far, the line number of the last one.
+    """
+
+    segment: TempoSegment
+    beat_count: int
+    line_count: int
+
+    def __init__(
+        self,
+        internal_property: InternalProperty | None = None,
+        registry: CommandRegistry = command_registry,
+    ) -> None:
+        if internal_property is None:
+            internal_property = InternalProperty()
+        self.registry = registry
+        self.segment = TempoSegment(0, 0.0, internal_property.copy())
+        self.beat_count = 0
+        self.line_count = 0
+
+    def feed(self, line_str: str) -> list[BeatContainer]:
+        """
+        Compile the next line of the chart.
+        Returns:
+        The beats of the line, empty for other lines.
+        Raises one of STREAM_ERRORS if the line does not compile, the running
+        state is then left as it was.
+        """
+        self.line_count += 1
+        line = parse_line(line_str, self.line_count)
+        if isinstance(line, CommandLine):
+            current = self.segment.internal_property.copy()
+            self.registry.execute_command(
+                line.command, line.args, current, self.line_count
+            )
+            self.segment = TempoSegment(
+                self.beat_count,
+                self.segment.beat_to_time(self.beat_count),
+                current,
+                self.line_count,
+            )
+            return []
+        if not isinstance(line, BeatLine):
+            return []
+        beats = [
+            layout_beat(beat, self.beat_count + offset, self.segment, self.line_count)
+            for offset, beat in enumerate(line.beats)
+        ]
+        self.beat_count += len(beats)
+        return beats
+
+
+class StreamPlayer:
+    """
+    Plays chart lines while they are still being read, e.g. from a pipe.
+
+    Every line is compiled as it arrives and its beats are appended to a pool
+    that waits for them. Playback starts latency seconds after the first beat
+    arrives, so a beat that arrives up to latency seconds after the one before
+    it still plays on time. A beat that arrives after its play time is an
+    underrun: the playback is postponed so that beat plays latency seconds
+    later, refilling the buffer, and the underrun is reported. Reading stops
+    while the input is more than max_ahead seconds ahead of the playback.
+    Attributes:
+    compiler: Compiles the lines as they arrive.
+    pool: The pool playing the beats.
+    latency: Seconds between a beat arriving and it being played.
+    max_ahead: Seconds of input read ahead of the playback at most.
+    underruns: How many times a beat arrived too late.
+    underrun_time: The total time playback was postponed by, in seconds.
+    errors: (line number, error) of every line that did not compile.
+    """
+
+    compiler: StreamCompiler
+    pool: PlayerThreadingPool
+    latency: float
+    max_ahead: float
+    underruns: int
+    underrun_time: float
+    errors: list[tuple[int, Exception]]
+
+    def __init__(
+        self,
+        outputs: list[OutputBackend],
+        latencies: list[float] | None = None,
+        internal_property: InternalProperty | None = None,
+        latency: float = STREAM_LATENCY,
+        max_ahead: float = STREAM_MAX_AHEAD,
+        clock: Clock = real_clock,
+        on_underrun: Callable[[int, float], None] | None = None,
+        on_error: Callable[[int, Exception], None] | None = None,
+    ) -> None:
+        """
+        Args:
+            outputs: The outputs to play on.
+            latencies: The latency offset of every output, the calibrated ones by default.
+            internal_property: The initial bpm and time signature.
+            latency: Seconds between a beat arriving and it being played.
+            max_ahead: Seconds of input read ahead of the playback at most.
+            clock: A real clock, the stream is read in real time.
+            on_underrun: Called with the beat id of a late beat and how late it was, in seconds.
+            on_error: Called with the line number and the error of a line that does not compile.
+        """
+        self.compiler = StreamCompiler(internal_property)
+        self.pool = PlayerThreadingPool([], outputs, latencies=latencies, clock=clock)
+        self.pool.awaiting_beats = True
+        self.pool.START_DELAY = latency
+        self.latency = latency
+        self.max_ahead = max_ahead
+        self.clock = clock
+        self.on_underrun = on_underrun
+        self.on_error = on_error
+        self.underruns = 0
+        self.underrun_time = 0.0
+        self.errors = []
+        self.started = False
+        self.stop_flag = FlagBoolean(False)
+
+    def feed_line(self, line_str: str) -> int:
+        """Compile a line and queue its beats, returns how many beats it had."""
+        try:
+            beats = self.compiler.feed(line_str)
+        except STREAM_ERRORS as e:
+            self.errors.append((self.compiler.line_count, e))
+            if self.on_error is not None:
+                self.on_error(self.compiler.line_count, e)
+            return 0
+        if not beats:
+            return 0
+        if not self.started:
+            self.pool.append_beats(beats)
+            self.pool.play()
+            self.started = True
+            return len(beats)
+
+        pool = self.pool
+        lateness = self.clock.now() - (beats[0].begin_time + pool.begin_time)
+        if lateness > 0.0:
+            pool.postpone(lateness + self.latency)
+            self.underruns += 1
+            self.underrun_time += lateness + self.latency
+            tracing.increment("stream_underruns")
+            if self.on_underrun is not None:
+                self.on_underrun(beats[0].beat_id, lateness)
+        pool.append_beats(beats)
+        # the producer waits while the input is far ahead
+        self.clock.sleep_until(
+            beats[-1].begin_time + pool.begin_time - self.max_ahead, self.stop_flag
+        )
+        return len(beats)
+
+    def run(self, line_strs: Iterable[str]) -> None:
+        """Play lines until they end and every note was played, or stop is called."""
+        for line_str in line_strs:
+            if self.stop_flag.get():
+                break
+            self.feed_line(line_str.rstrip("\r\n"))
+        self.pool.end_beats()
+        if not self.started:
+            return
+        # pending events are only waited for while a dispatch thread is left
+        while not self.stop_flag.get() and (
+            self.pool.current_beat_index < len(self.pool.beats)
+            or (self.pool.dispatcher.pending() and self.pool.dispatcher.is_running())
+        ):
+            self.clock.sleep_until(self.clock.now() + 0.01, self.stop_flag)
+
+    def start(self, line_strs: Iterable[str]) -> threading.Thread:
+        """Run on a thread of its own."""
+        thread = threading.Thread(target=self.run, args=(line_strs,), daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stop_flag.modify(True)
+        self.pool.stop()
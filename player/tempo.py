@@ -0,0 +1,155 @@
+import bisect
+
+from chart.parser import BeatLine, CommandLine, Line
+from player.command import CommandRegistry, command_registry
+from player.interal import InternalProperty
+
+
+class TempoSegment:
+    """
+    A run of beats played with the same bpm and time signature.
+
+    Attributes:
+    start_beat: The index of the first beat of the segment in the playlist.
+    start_time: When the first beat begins, in seconds.
+    internal_property: The bpm and time signature of the segment, shared, do not modify.
+    line_number: The chart line of the last command of the segment, None if it has none.
+    """
+
+    __slots__ = ("start_beat", "start_time", "internal_property", "line_number")
+
+    start_beat: int
+    start_time: float  # in seconds
+    internal_property: InternalProperty
+    line_number: int | None
+
+    def __init__(
+        self,
+        start_beat: int,
+        start_time: float,
+        internal_property: InternalProperty,
+        line_number: int | None = None,
+    ) -> None:
+        self.start_beat = start_beat
+        self.start_time = start_time
+        self.internal_property = internal_property
+        self.line_number = line_number
+
+    @property
+    def bpm(self) -> float:
+        return self.internal_property.bpm
+
+    @property
+    def time_signature(self) -> int:
+        return self.internal_property.time_signature
+
+    @property
+    def beat_duration(self) -> float:
+        return 60.0 / self.internal_property.bpm
+
+    def beat_to_time(self, beat: float) -> float:
+        return self.start_time + (beat - self.start_beat) * self.beat_duration
+
+    def time_to_beat(self, time: float) -> float:
+        return self.start_beat + (time - self.start_time) / self.beat_duration
+
+    def __repr__(self) -> str:
+        return (
+            f"TempoSegment(start_beat={self.start_beat}, start_time={self.start_time}, "
+            f"bpm={self.bpm}, time_signature={self.time_signature})"
+        )
+
+
+class TempoMap:
+    """
+    The tempo and time signature of a chart, compiled once from its command lines.
+
+    Every command is validated and applied a single time while the map is built,
+    commands between the same two beats collapse into one segment. Beats are
+    counted over the whole chart like the beat ids of the playlist, and may be
+    fractional; lookups in both directions are binary searches.
+    Attributes:
+    segments: The segments in beat order, the first one starts at beat 0.
+    beat_count: The number of beats in the chart.
+    """
+
+    segments: list[TempoSegment]
+    beat_count: int
+
+    def __init__(self, segments: list[TempoSegment], beat_count: int) -> None:
+        if not segments or segments[0].start_beat != 0:
+            raise ValueError("A tempo map needs a segment starting at beat 0")
+        self.segments = segments
+        self.beat_count = beat_count
+        self.start_beats = [segment.start_beat for segment in segments]
+        self.start_times = [segment.start_time for segment in segments]
+
+    @staticmethod
+    def from_lines(
+        lines: list[Line],
+        internal_property: InternalProperty,
+        registry: CommandRegistry = command_registry,
+    ) -> "TempoMap":
+        """
+        Build the map from the lines of a chart, starting from internal_property.
+        Raises CommandParseError with the chart line of an invalid command.
+        """
+        current = internal_property.copy()
+        segments = [TempoSegment(0, 0.0, current)]
+        beat_count = 0
+        for line in lines:
+            if isinstance(line, BeatLine):
+                beat_count += len(line.beats)
+            elif isinstance(line, CommandLine):
+                line_number = line.line_number if line.line_number is not None else -1
+                current = current.copy()
+                registry.execute_command(line.command, line.args, current, line_number)
+                last = segments[-1]
+                if last.start_beat == beat_count:
+                    # no beat was played with the previous tempo
+                    last.internal_property = current
+                    last.line_number = line.line_number
+                else:
+                    segments.append(
+                        TempoSegment(
+                            beat_count,
+                            last.beat_to_time(beat_count),
+                            current,
+                            line.line_number,
+                        )
+                    )
+        return TempoMap(segments, beat_count)
+
+    def segment_index_at_beat(self, beat: float) -> int:
+        return max(bisect.bisect_right(self.start_beats, beat) - 1, 0)
+
+    def segment_at_beat(self, beat: float) -> TempoSegment:
+        return self.segments[self.segment_index_at_beat(beat)]
+
+    def segment_at_time(self, time: float) -> TempoSegment:
+        return self.segments[max(bisect.bisect_right(self.start_times, time) - 1, 0)]
+
+    def beat_to_time(self, beat: float) -> float:
+        """When a beat begins, in seconds."""
+        return self.segment_at_beat(beat).beat_to_time(beat)
+
+    def time_to_beat(self, time: float) -> float:
+        """The beat playing at a time in seconds, with the fraction already played."""
+        return self.segment_at_time(time).time_to_beat(time)
+
+    def property_at(self, beat: float) -> InternalProperty:
+        """The bpm and time signature a beat is played with, shared, do not modify."""
+        return self.segment_at_beat(beat).internal_property
+
+    @property
+    def duration(self) -> float:
+        """When the last beat ends, in seconds."""
+        return self.beat_to_time(self.beat_count)
+
+    @property
+    def bpms(self) -> list[float]:
+        return [segment.bpm for segment in self.segments]
+
+    @property
+    def time_signatures(self) -> list[int]:
+        return sorted({segment.time_signature for segment in self.segments})
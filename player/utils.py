@@ -1,14 +1,27 @@
 import time
 
+from typing import Callable
+
 
 class FlagBoolean:
     condition: bool
 
     def __init__(self, condition: bool = False) -> None:
         self.condition = condition
+        self._listeners: list[Callable[[bool], None]] = []
 
     def modify(self, condition: bool) -> None:
         self.condition = condition
+        for listener in self._listeners:
+            listener(condition)
+
+    def subscribe(self, listener: Callable[[bool], None]) -> None:
+        """Call listener with the new condition whenever the flag is modified."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[bool], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
 
     def get(self) -> bool:
         return self.condition
@@ -18,7 +31,7 @@ def wait_until(target_time: float) -> None:
     """Pause execution until the specified target time (in seconds since the epoch)."""
     while time.time() < target_time:
         time.sleep(
-            min((target_time - time.time()) / 2, 0.01)
+            max(min((target_time - time.time()) / 2, 0.01), 0.0)
         )  # Sleep briefly to avoid busy waiting
 
 
@@ -30,6 +43,6 @@ def wait_until_or_cancel(target_time: float, cancel_flag: FlagBoolean) -> bool:
         if cancel_flag.condition:
             return False
         time.sleep(
-            min((target_time - time.time()) / 2, 0.01)
+            max(min((target_time - time.time()) / 2, 0.01), 0.0)
         )  # Sleep briefly to avoid busy waiting
     return True
@@ -0,0 +1,59 @@
+import importlib
+import importlib.util
+import threading
+
+from types import ModuleType
+from typing import Any
+
+
+class LazyModule(ModuleType):
+    """
+    A stand-in for a module that is imported on first attribute access.
+
+    Heavy or optional dependencies (keyboard hooks, audio playback) are bound at
+    module level as usual, but only cost their import time once they are used.
+    Attributes:
+    module_name: The name of the module to import.
+    """
+
+    module_name: str
+
+    def __init__(self, module_name: str) -> None:
+        super().__init__(module_name)
+        self.module_name = module_name
+        self._module: ModuleType | None = None
+        self._lock = threading.Lock()
+
+    def load(self) -> ModuleType:
+        """Import the module now, raises ImportError if it is missing."""
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.module_name)
+                module = self._module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes not set in __init__
+        return getattr(self.load(), name)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self.module_name!r} ({state})>"
+
+
+def lazy_import(module_name: str) -> LazyModule:
+    return LazyModule(module_name)
+
+
+def is_installed(module_name: str) -> bool:
+    """Check whether a module can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError):
+        return False
@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import nullcontext
+from typing import Any, ContextManager
+
+# returned by span() while tracing is off, so a disabled span costs one call
+_NULL_SPAN = nullcontext()
+
+
+class Span:
+    """
+    A timed section of code, recorded as a complete event when it exits.
+    Attributes:
+    name: The name shown in the trace viewer.
+    category: The category of the event, e.g. "parse" or "player".
+    args: Extra values shown with the event.
+    """
+
+    name: str
+    category: str
+    args: dict[str, Any]
+
+    def __init__(
+        self, tracer: "Tracer", name: str, category: str, args: dict[str, Any]
+    ) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.tracer.complete(
+            self.name, self.category, self.start, time.perf_counter(), self.args
+        )
+
+
+class Tracer:
+    """
+    Collects trace events in the Chrome trace event format.
+
+    Events are appended to a list under a lock and only serialized in write, the
+    file can be opened in chrome://tracing or Perfetto.
+    Attributes:
+    events: The recorded trace events.
+    counters: The current value of every counter.
+    """
+
+    events: list[dict[str, Any]]
+    counters: dict[str, float]
+
+    def __init__(self) -> None:
+        self.events = []
+        self.counters = {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._named_threads: set[int] = set()
+
+    def _timestamp(self, perf_time: float) -> float:
+        return (perf_time - self.origin) * 1_000_000  # microseconds
+
+    def _append(self, event: dict[str, Any]) -> None:
+        thread = threading.current_thread()
+        tid = thread.ident or 0
+        event["pid"] = self.pid
+        event["tid"] = tid
+        with self._lock:
+            if tid not in self._named_threads:
+                self._named_threads.add(tid)
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self.pid,
+                        "tid": tid,
+                        "args": {"name": thread.name},
+                    }
+                )
+            self.events.append(event)
+
+    def complete(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        end: float,
+        args: dict[str, Any] | None = None,
+    ) -> None:
+        """Record a span from start to end, both perf_counter values."""
+        event: dict[str, Any] = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self._timestamp(start),
+            "dur": (end - start) * 1_000_000,
+        }
+        if args:
+            event["args"] = args
+        self._append(event)
+
+    def instant(
+        self, name: str, category: str = "", args: dict[str, Any] | None = None
+    ) -> None:
+        event: dict[str, Any] = {
+            "name": name,
+            "cat": category,
+            "ph": "i",
+            "s": "t",
+            "ts": self._timestamp(time.perf_counter()),
+        }
+        if args:
+            event["args"] = args
+        self._append(event)
+
+    def counter(self, name: str, value: float) -> None:
+        """Set a counter, the trace shows its value over time."""
+        with self._lock:
+            self.counters[name] = value
+        self._append_counter(name, value)
+
+    def increment(self, name: str, amount: float = 1) -> None:
+        # read, add and store in one section, concurrent increments all count
+        with self._lock:
+            value = self.counters.get(name, 0) + amount
+            self.counters[name] = value
+        self._append_counter(name, value)
+
+    def _append_counter(self, name: str, value: float) -> None:
+        self._append(
+            {
+                "name": name,
+                "ph": "C",
+                "ts": self._timestamp(time.perf_counter()),
+                "args": {name: value},
+            }
+        )
+
+    def to_json(self) -> dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
+
+
+_tracer: Tracer | None = None
+
+
+def start_tracing() -> Tracer:
+    """Start recording spans and counters, replacing a running tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing() -> Tracer | None:
+    """Stop recording, returns the tracer holding the recorded events."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def active_tracer() -> Tracer | None:
+    return _tracer
+
+
+def span(name: str, category: str = "", **args: Any) -> ContextManager[Any]:
+    """Time a with block. Does nothing while tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return Span(tracer, name, category, args)
+
+
+def counter(name: str, value: float) -> None:
+    tracer = _tracer
+    if tracer is not None:
+        tracer.counter(name, value)
+
+
+def increment(name: str, amount: float = 1) -> None:
+    tracer = _tracer
+    if tracer is not None:
+        tracer.increment(name, amount)
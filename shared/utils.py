@@ -20,3 +20,7 @@ def rpath(*paths: str) -> str:
 
 
 AUDIO_DIR = rpath("audio")
+
+CACHE_DIR = rpath("cache")
+
+CONFIG_DIR = rpath("config")